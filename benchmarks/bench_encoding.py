@@ -0,0 +1,68 @@
+# -*- encoding: utf-8 -*-
+"""
+Collector payloads benchmark, bytes on the wire and CPU per event:
+
+    $ PYTHONPATH=. python benchmarks/bench_encoding.py
+"""
+import json
+import timeit
+from datetime import datetime, timedelta
+
+from cube import encoding
+from cube.batch import chunk_events
+
+COUNT = 500
+NUMBER = 200
+
+start = datetime(2013, 10, 1)
+EVENTS = [dict(type='request',
+               time=(start + timedelta(milliseconds=37 * i)).isoformat(),
+               data={'path': '/api/v1/items/{0}'.format(i % 50),
+                     'elapsed_ms': (i * 7919) % 1000,
+                     'status': 200 if i % 20 else 500})
+          for i in range(COUNT)]
+
+
+def per_event_json(events):
+    """ The previous encoding: one json.dumps per event, joined. """
+    return "[" + ",".join(json.dumps(e) for e in events) + "]"
+
+
+def batch(events):
+    return encoding.encode_events(events)
+
+
+def batch_gzip(events):
+    return encoding.compress(encoding.encode_events(events), 0)[0]
+
+
+def chunked(events):
+    return [body for chunk, body in chunk_events(events)]
+
+
+def chunked_mtu(events):
+    """ Like UDPSender.send, datagrams of at most 1400 bytes. """
+    return [body for chunk, body in
+            chunk_events(events, max_events=65507, max_bytes=1400)]
+
+
+BENCHMARKS = [
+    ('per-event json.dumps', per_event_json),
+    ('encode_events ({0})'.format(encoding.ENCODER), batch),
+    ('encode_events + gzip', batch_gzip),
+    ('chunk_events', chunked),
+    ('chunk_events (1400B MTU)', chunked_mtu),
+]
+
+
+if __name__ == '__main__':
+    print('{0} events per batch\n'.format(COUNT))
+    print('{0:<28} {1:>12} {2:>12}'.format('', 'bytes/event', 'us/event'))
+    for name, func in BENCHMARKS:
+        size = sum(len(body) for body in
+                   (func(EVENTS) if name.startswith('chunk_events')
+                    else [func(EVENTS)]))
+        best = min(timeit.repeat(lambda: func(EVENTS), number=NUMBER,
+                                 repeat=3))
+        print('{0:<28} {1:>12.1f} {2:>12.2f}'.format(
+            name, float(size) / COUNT, best / NUMBER / COUNT * 1e6))
@@ -0,0 +1,61 @@
+# -*- encoding: utf-8 -*-
+"""
+Tail latency of reads over simulated replicas, with and without hedging:
+
+    $ PYTHONPATH=. python benchmarks/bench_hedging.py
+
+Each replica answers in about 2ms, but 3% of the requests stall for
+50ms, and one replica is twice as slow as the others.
+"""
+import random
+import time
+
+from cube.replicas import Replica, ReplicaSet, percentile
+
+CALLS = 1000
+STALL = 0.05
+STALL_RATE = 0.03
+
+
+def make_set(**kwargs):
+    replicas = [Replica('replica{0}'.format(i), None, 2 if i == 2 else 1)
+                for i in range(3)]
+    return ReplicaSet(replicas, **kwargs)
+
+
+def request(replica):
+    # session holds the slowdown factor
+    delay = random.uniform(0.001, 0.003) * replica.session
+    if random.random() < STALL_RATE:
+        delay += STALL
+    time.sleep(delay)
+
+
+def run(replicas):
+    random.seed(42)
+    latencies = []
+    for _ in range(CALLS):
+        start = time.time()
+        replicas.call(request)
+        latencies.append(time.time() - start)
+    latencies.sort()
+    return [percentile(latencies, pct) * 1000 for pct in (50, 99, 99.9)]
+
+
+BENCHMARKS = [
+    ('least outstanding, no hedge',
+     make_set(hedge_percentile=None)),
+    ('ewma, no hedge', make_set(policy='ewma', hedge_percentile=None)),
+    ('least outstanding, hedge p95', make_set(hedge_percentile=95)),
+    ('ewma, hedge p95', make_set(policy='ewma', hedge_percentile=95)),
+]
+
+
+if __name__ == '__main__':
+    print('{0} calls\n'.format(CALLS))
+    print('{0:<32} {1:>8} {2:>8} {3:>8} {4:>8}'.format(
+        '', 'p50 ms', 'p99 ms', 'p99.9 ms', 'hedged'))
+    for name, replicas in BENCHMARKS:
+        p50, p99, p999 = run(replicas)
+        print('{0:<32} {1:>8.1f} {2:>8.1f} {3:>8.1f} {4:>8}'.format(
+            name, p50, p99, p999, replicas.hedged))
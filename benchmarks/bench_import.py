@@ -0,0 +1,41 @@
+# -*- encoding: utf-8 -*-
+"""
+Import time benchmark, each import runs in a fresh interpreter:
+
+    $ PYTHONPATH=. python benchmarks/bench_import.py
+"""
+import subprocess
+import sys
+
+RUNS = 20
+
+CODE = """
+import time
+start = time.time()
+{statement}
+print(time.time() - start)
+"""
+
+BENCHMARKS = [
+    ('import cube', 'import cube'),
+    ('import cube, first Cube()', 'import cube; cube.Cube()'),
+    ("first Cube(transport='http') request",
+     "import cube; c = cube.Cube(transport='http')\n"
+     "try:\n    c.types()\nexcept Exception:\n    pass"),
+    ("first Cube() request (requests)",
+     "import cube; c = cube.Cube()\n"
+     "try:\n    c.types()\nexcept Exception:\n    pass"),
+    ('import requests', 'import requests'),
+]
+
+
+def timed(statement):
+    code = CODE.format(statement=statement)
+    times = sorted(float(subprocess.check_output([sys.executable, '-c', code]))
+                   for _ in range(RUNS))
+    return times[len(times) // 2]
+
+
+if __name__ == '__main__':
+    for name, statement in BENCHMARKS:
+        print('{0:<40} {1:8.1f} ms'.format(name, timed(statement) * 1000))
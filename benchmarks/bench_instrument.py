@@ -0,0 +1,83 @@
+# -*- encoding: utf-8 -*-
+"""
+Client-side cost of the instrumentation listeners, per call:
+
+    $ PYTHONPATH=. python benchmarks/bench_instrument.py
+
+Requests are answered in memory, so only the client work is measured.
+"""
+import json
+import timeit
+
+from cube import Cube
+from cube import transport
+from cube.instrument import Histograms
+
+NUMBER = 5000
+
+METRIC = json.dumps([{'time': '2013-10-01T00:00:{0:02d}.000Z'.format(i),
+                      'value': i} for i in range(60)]).encode('utf-8')
+
+
+class Response(object):
+    def __init__(self, url, content):
+        self.url = url
+        self.content = content
+        self.text = content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        pass
+
+
+class MemoryTransport(object):
+    """ Answers without sending anything. """
+    RequestException = transport.RequestException
+    ConnectionError = transport.ConnectionError
+    Timeout = transport.Timeout
+    HTTPError = transport.HTTPError
+
+    def __init__(self, **kwargs):
+        pass
+
+    def get(self, url, params=None, timeout=None, stream=False):
+        return Response(url, METRIC)
+
+    def post(self, url, data, headers=None, timeout=None):
+        return Response(url, b'{}')
+
+    def close(self):
+        pass
+
+
+def make_cube(listeners):
+    return Cube('localhost', transport=MemoryTransport, listeners=listeners)
+
+
+def bench(cube):
+    put = timeit.timeit(lambda: cube.put('request', {'status': 200}),
+                        number=NUMBER)
+    metric = timeit.timeit(lambda: cube.metric('sum(request)', step='1e4',
+                                               start='2013-10-01',
+                                               cache=False),
+                           number=NUMBER)
+    return put / NUMBER * 1e6, metric / NUMBER * 1e6
+
+
+BENCHMARKS = [
+    ('no listener', lambda: make_cube(())),
+    ('no-op listener', lambda: make_cube([lambda record: None])),
+    ('Histograms', lambda: make_cube([Histograms()])),
+]
+
+
+if __name__ == '__main__':
+    print('{0} calls\n'.format(NUMBER))
+    print('{0:<20} {1:>10} {2:>10}'.format('', 'put us', 'metric us'))
+    for name, make in BENCHMARKS:
+        cube = make()
+        put, metric = bench(cube)
+        cube.close()
+        print('{0:<20} {1:>10.1f} {2:>10.1f}'.format(name, put, metric))
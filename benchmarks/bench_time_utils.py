@@ -0,0 +1,54 @@
+# -*- encoding: utf-8 -*-
+"""
+Cube timestamps parsing benchmark:
+
+    $ PYTHONPATH=. python benchmarks/bench_time_utils.py
+"""
+import timeit
+from datetime import datetime, timedelta
+
+from cube import time_utils
+
+COUNT = 100000
+
+start = datetime(2013, 10, 1)
+REGULAR = [time_utils.format_iso(start + timedelta(seconds=10 * i))
+           for i in range(COUNT)]
+EVENTS = [time_utils.format_iso(start + timedelta(
+          milliseconds=10000 * i + (i * i) % 7919)) for i in range(COUNT)]
+
+
+def strptime(values):
+    return [time_utils.to_epoch_ms(datetime.strptime(v,
+                                                     '%Y-%m-%dT%H:%M:%S.%fZ'))
+            for v in values]
+
+
+def parse_iso(values):
+    return [time_utils.to_epoch_ms(time_utils.parse_iso(v)) for v in values]
+
+
+def parse_time_ms(values):
+    return [time_utils.parse_time_ms(v) for v in values]
+
+
+BENCHMARKS = [
+    ('datetime.strptime', strptime, REGULAR),
+    ('parse_iso', parse_iso, REGULAR),
+    ('parse_time_ms', parse_time_ms, REGULAR),
+    ('parse_times_ms, irregular', time_utils.parse_times_ms, EVENTS),
+    ('parse_times_ms, regular', time_utils.parse_times_ms, REGULAR),
+    ('parse_times_ms, known step',
+     lambda values: time_utils.parse_times_ms(values, 10000), REGULAR),
+]
+
+if __name__ == '__main__':
+    assert strptime(REGULAR) == time_utils.parse_times_ms(REGULAR)
+    assert strptime(EVENTS) == time_utils.parse_times_ms(EVENTS)
+    print("{0} timestamps".format(COUNT))
+    baseline = None
+    for name, func, values in BENCHMARKS:
+        best = min(timeit.repeat(lambda: func(values), number=1, repeat=3))
+        baseline = baseline or best
+        print("{0:<30} {1:>10.2f} ms {2:>10.1f}x".format(name, best * 1000,
+                                                         baseline / best))
@@ -1,15 +1,33 @@
 # -*- encoding: utf-8 -*-
+import json
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 
-try:
-    import ujson as json
-except ImportError:
-    import json
-
-import requests
-
 from cube.expression import Sum, Min, Max, Median, Distinct
 from cube.event import Event
+from cube.batch import ChunkResult, chunk_events
+from cube.batch import MAX_BATCH_EVENTS, MAX_BATCH_BYTES
+from cube.sender import BackgroundSender, PutFuture, SPOOLED
+from cube.udp import UDPSender, UDP_PORT, MAX_DATAGRAM
+from cube.spool import Spool, SEGMENT_SIZE, MAX_BYTES
+from cube.cache import MetricCache
+from cube.split import fetch_ranges, PARALLELISM
+from cube.evaluate import evaluate_many
+from cube.result import MetricSeries
+from cube.stream import iter_json_array, iter_chunks
+from cube.paginate import paginate_events
+from cube.rollup import multi_resolution
+from cube.planner import QueryPlan
+from cube.singleflight import SingleFlight, process_singleflight
+from cube.transport import make_transport, POOL_SIZE, _urlencode, _urlsplit
+from cube.encoding import COMPRESS_MIN_BYTES, compress, encode_events
+from cube.ring import HashRing
+from cube.replicas import Replica, ReplicaSet, LEAST_OUTSTANDING
+from cube.breaker import AdaptiveTimeout, CircuitBreaker, CircuitOpen
+from cube.instrument import CallRecord, clock, counted, emit, timed
+from cube import time_utils
 
 API_VERSION = '1.0'
 
@@ -21,79 +39,833 @@ FIVE_MINUTE = '3e5'
 ONE_HOUR = '36e5'
 ONE_DAY = '864e5'
 
+# Bytes read at a time from streamed responses
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def make_event(event_type, event_data={}, **kwargs):
+    """
+    Build an event, defaulting time to now.
+    """
+    event = dict(type=event_type, data=event_data)
+
+    event["time"] = kwargs.get("time", datetime.utcnow().isoformat())
+
+    if kwargs.get("id"):
+        event["id"] = kwargs.get("id")
+
+    return event
+
+
+def query_params(expression, **kwargs):
+    """
+    Build the evaluator query parameters,
+    try to convert datetime to isoformat on the fly
+    """
+    data = dict(expression=str(expression),
+                stop=kwargs.get('stop', datetime.utcnow()))
+    data.update(kwargs)
+
+    for k in ['start', 'stop']:
+        if k in data:
+            try:
+                data[k] = data[k].isoformat()
+            except AttributeError:
+                pass
+
+    return data
+
+
+class _Collector(object):
+    """ A collector host, with its own connection pool and, with
+    async_put, its own background sender. """
+    def __init__(self, host, url, session):
+        self.host = host
+        self.url = url
+        self.session = session
+        self.sender = None
+        # Built on first use, with udp
+        self.udp_sender = None
+        self.timeout = None
+        self.breaker = None
+        # Puts go straight to the spool until then
+        self.spool_until = 0
+
+    def __repr__(self):
+        return "<Collector: {0}>".format(self.host)
+
 
 class Cube(object):
+    """ Cube client, holding one connection pool per collector host
+    and one per evaluator host.
+
+    Extra kwargs:
+
+    - collector_port/evaluator_port
+    - collectors: collector hosts (host or host:port, collector_port
+      by default) to spread events over, each event type is sent to
+      one of them picked by consistent hashing, see add_collector
+      and remove_collector (default the hostname collector)
+    - evaluators: evaluator replicas (host or host:port, evaluator_port
+      by default) to spread the queries over (default the hostname
+      evaluator), see ReplicaSet for the balance ('least_outstanding'
+      or 'ewma'), hedge_percentile (default 95), hedge_delay,
+      eject_after (default 3) and eject_for (default 10) options
+    - pool_size: max connections kept alive per endpoint (default 10)
+    - pool_block: wait for a free connection instead of opening
+      a throwaway one when the pool is exhausted (default False)
+    - keep_alive: reuse connections between calls (default True)
+    - timeout: requests timeout, in seconds or (connect, read) tuple,
+      or 'adaptive' for timeout_multiplier (default 3) times the
+      timeout_percentile (default 99) of the recent latencies of each
+      endpoint, between min_timeout (default 0.5) and max_timeout
+      (default 30) seconds
+    - breaker: a circuit breaker per endpoint, failing calls fast with
+      CircuitOpen for breaker_reset seconds (default 5) once at least
+      breaker_min_calls calls (default 10) were made and
+      breaker_failure_rate of them (default 0.5) failed, or half of them
+      took more than breaker_slow_call seconds (default None), see
+      CircuitBreaker (default False)
+    - listeners: instrumentation listeners, see add_listener
+    - transport: 'requests' (default) or 'http' for the standard
+      library one, see cube.transport
+    - compress: gzip collector bodies of at least compress_min_bytes
+      (default 1024), the collector (or a proxy in front of it) must
+      accept Content-Encoding: gzip (default False)
+    - async_put: put enqueue events, sent in batches by a background
+      thread (default False), see BackgroundSender for the
+      queue_size, linger, overflow, block_timeout, batch_events
+      and batch_bytes options
+    - udp: send events to the collector over UDP instead of HTTP,
+      fire-and-forget (default False, can be overridden per put
+      or per Event), with udp_port (default 1180) and udp_mtu
+      (max datagram size, default 1400), events are sharded over
+      the collectors like over HTTP
+    - spool_dir: spool the events the collector can't take in this
+      directory, and replay them once it's back, see Spool for the
+      spool_max_bytes, spool_segment_size and spool_eviction options;
+      after a failure, puts to that collector go straight to the spool
+      for spool_retry seconds (default 5)
+    - metric_cache: cache metric results and only fetch the missing
+      buckets, True or a MetricCache instance (default None)
+    - coalesce: concurrent identical queries share one request (each
+      caller gets its own copy of the result), True for the queries
+      of this instance (default), 'process' for all the instances
+      sharing it, a SingleFlight instance, or False
+
+    A Cube instance can be shared between threads, just don't
+    change the sessions settings once requests are in flight.
+    """
     def __init__(self, hostname="localhost", **kwargs):
-        self.collector_url = 'http://{0}:{1}/{2}/'.format(hostname,
-                                                          kwargs.get('collector_port', 1080),
-                                                          API_VERSION)
-        self.evaluator_url = 'http://{0}:{1}/{2}/'.format(hostname,
-                                                          kwargs.get('evaluator_port', 1081),
-                                                          API_VERSION)
+        self.timeout = kwargs.get('timeout')
+        self._transport = kwargs.pop('transport', 'requests')
+        self._kwargs = kwargs
+        self.replicas = ReplicaSet(
+            [self._make_replica(host)
+             for host in kwargs.get('evaluators') or [hostname]],
+            policy=kwargs.get('balance', LEAST_OUTSTANDING),
+            hedge_percentile=kwargs.get('hedge_percentile', 95),
+            hedge_delay=kwargs.get('hedge_delay'),
+            eject_after=kwargs.get('eject_after', 3),
+            eject_for=kwargs.get('eject_for', 10),
+            is_failure=self._is_outage)
+        self.hostname = hostname
+        self.compress_min_bytes = kwargs.get('compress_min_bytes',
+                                             COMPRESS_MIN_BYTES) \
+            if kwargs.get('compress') else None
+        self.udp = kwargs.get('udp', False)
+        self.udp_port = kwargs.get('udp_port', UDP_PORT)
+        self.udp_mtu = kwargs.get('udp_mtu', MAX_DATAGRAM)
+        self.spool = None
+        if kwargs.get('spool_dir'):
+            self.spool = Spool(
+                kwargs['spool_dir'],
+                segment_size=kwargs.get('spool_segment_size', SEGMENT_SIZE),
+                max_bytes=kwargs.get('spool_max_bytes', MAX_BYTES),
+                eviction=kwargs.get('spool_eviction', 'drop_oldest'))
+        self.spool_retry = kwargs.get('spool_retry', 5)
+        self._replay_thread = None
+        self.metric_cache = kwargs.get('metric_cache')
+        if self.metric_cache is True:
+            self.metric_cache = MetricCache()
+        self.singleflight = kwargs.get('coalesce', True)
+        if self.singleflight is True:
+            self.singleflight = SingleFlight()
+        elif self.singleflight == 'process':
+            self.singleflight = process_singleflight()
+        elif not self.singleflight:
+            self.singleflight = None
+        self._listeners = tuple(kwargs.get('listeners') or ())
+        self.async_put = bool(kwargs.get('async_put'))
+        # host:port => _Collector, the ring picks one per event type
+        self.collectors = OrderedDict()
+        self.ring = HashRing()
+        self._collectors_lock = threading.Lock()
+        self._primary = None
+        for host in kwargs.get('collectors') or [hostname]:
+            self.add_collector(host)
+
+    def add_listener(self, listener):
+        """
+        Call listener with a cube.instrument.CallRecord after each
+        collector or evaluator request, see cube.instrument.Histograms
+        """
+        self._listeners += (listener,)
+
+    def remove_listener(self, listener):
+        self._listeners = tuple(l for l in self._listeners
+                                if l != listener)
+
+    def _guard(self, endpoint):
+        """ Give an endpoint its timeout and circuit breaker. """
+        kwargs = self._kwargs
+        endpoint.timeout = self.timeout
+        if self.timeout == 'adaptive':
+            endpoint.timeout = AdaptiveTimeout(
+                pct=kwargs.get('timeout_percentile', 99),
+                multiplier=kwargs.get('timeout_multiplier', 3),
+                min_timeout=kwargs.get('min_timeout', 0.5),
+                max_timeout=kwargs.get('max_timeout', 30))
+        if kwargs.get('breaker'):
+            endpoint.breaker = CircuitBreaker(
+                endpoint.host,
+                min_calls=kwargs.get('breaker_min_calls', 10),
+                failure_rate=kwargs.get('breaker_failure_rate', 0.5),
+                slow_call=kwargs.get('breaker_slow_call'),
+                reset_timeout=kwargs.get('breaker_reset', 5))
+        return endpoint
+
+    def _collector_host(self, host):
+        if ':' not in host:
+            host = '{0}:{1}'.format(host,
+                                    self._kwargs.get('collector_port', 1080))
+        return host
+
+    def _make_collector(self, host):
+        kwargs = self._kwargs
+        collector = _Collector(host,
+                               'http://{0}/{1}/'.format(host, API_VERSION),
+                               make_transport(self._transport, **kwargs))
+        self._guard(collector)
+        if self.async_put:
+            collector.sender = BackgroundSender(
+                lambda data, count: self._post_events(data, count,
+                                                      collector),
+                queue_size=kwargs.get('queue_size', 10000),
+                max_events=kwargs.get('batch_events', MAX_BATCH_EVENTS),
+                max_bytes=kwargs.get('batch_bytes', MAX_BATCH_BYTES),
+                linger=kwargs.get('linger', 0.5),
+                overflow=kwargs.get('overflow', 'block'),
+                block_timeout=kwargs.get('block_timeout'))
+        return collector
+
+    def add_collector(self, host):
+        """
+        Add a collector host (host or host:port), it takes over
+        its share of the event types from now on.
+        """
+        host = self._collector_host(host)
+        with self._collectors_lock:
+            if host in self.collectors:
+                raise ValueError("{0!r} is already a collector".format(host))
+            self.collectors[host] = self._make_collector(host)
+            self.ring.add(host)
+            self._primary = self.collectors[self.ring.nodes[0]]
+
+    def remove_collector(self, host):
+        """
+        Stop sending events to a collector host, its event types are
+        spread over the remaining ones. Events already enqueued for it
+        by async_put are still sent to it before its pool is closed.
+        """
+        host = self._collector_host(host)
+        with self._collectors_lock:
+            if host not in self.collectors:
+                raise ValueError("{0!r} isn't a collector".format(host))
+            if len(self.collectors) == 1:
+                raise ValueError("Can't remove the last collector")
+            self.ring.remove(host)
+            self._primary = self.collectors[self.ring.nodes[0]]
+        collector = self.collectors[host]
+        if collector.sender is not None:
+            collector.sender.close()
+        with self._collectors_lock:
+            del self.collectors[host]
+        if collector.udp_sender is not None:
+            collector.udp_sender.close()
+        collector.session.close()
+
+    def _make_replica(self, host):
+        if ':' not in host:
+            host = '{0}:{1}'.format(host,
+                                    self._kwargs.get('evaluator_port', 1081))
+        return self._guard(
+            Replica(host, 'http://{0}/{1}/'.format(host, API_VERSION),
+                    make_transport(self._transport, **self._kwargs)))
+
+    def _collector_for(self, event_type):
+        if len(self.ring) == 1:
+            return self._primary
+        return self.collectors[self.ring.get(event_type)]
+
+    def _route(self, events):
+        """ List of (collector, events) pairs, in order. """
+        routes = OrderedDict()
+        for event in events:
+            routes.setdefault(self._collector_for(event['type']),
+                              []).append(event)
+        return list(routes.items())
+
+    @property
+    def collector_url(self):
+        return self._primary.url
+
+    @property
+    def collector_session(self):
+        return self._primary.session
+
+    @property
+    def evaluator_url(self):
+        return self.replicas.replicas[0].url
+
+    @property
+    def evaluator_session(self):
+        return self.replicas.replicas[0].session
+
+    @property
+    def breakers(self):
+        """ host:port => circuit breaker, of each endpoint. """
+        endpoints = list(self.collectors.values()) + self.replicas.replicas
+        return dict((endpoint.host, endpoint.breaker)
+                    for endpoint in endpoints if endpoint.breaker is not None)
+
+    @property
+    def sender(self):
+        """ The background sender of the (first) collector, with
+        async_put, see collectors for the others. """
+        return self._primary.sender
+
+    @property
+    def udp_sender(self):
+        """ The UDP sender of the (first) collector. """
+        return self._udp_for(self._primary)
+
+    def _udp_for(self, collector):
+        if collector.udp_sender is None:
+            with self._collectors_lock:
+                if collector.udp_sender is None:
+                    collector.udp_sender = UDPSender(
+                        collector.host.rsplit(':', 1)[0], self.udp_port,
+                        self.udp_mtu)
+        return collector.udp_sender
+
+    def flush(self, timeout=None):
+        """
+        Wait for the events enqueued by an async put to be sent.
+        """
+        deadline = timeout is not None and time.time() + timeout
+        flushed = True
+        for collector in list(self.collectors.values()):
+            if collector.sender is not None:
+                flushed &= collector.sender.flush(
+                    None if timeout is None
+                    else max(0, deadline - time.time()))
+        return flushed
+
+    def close(self):
+        """
+        Flush pending events and close the connection pools.
+        """
+        collectors = list(self.collectors.values())
+        for collector in collectors:
+            if collector.sender is not None:
+                collector.sender.close()
+            if collector.udp_sender is not None:
+                collector.udp_sender.close()
+        if self.spool is not None:
+            self.spool.close()
+        for collector in collectors:
+            collector.session.close()
+        for replica in self.replicas.replicas:
+            replica.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _call(self, endpoint, request):
+        """
+        Return request(timeout) for an endpoint, through its
+        circuit breaker
+        """
+        breaker, timeout = endpoint.breaker, endpoint.timeout
+        adaptive = isinstance(timeout, AdaptiveTimeout)
+        if breaker is None and not adaptive:
+            return request(timeout)
+
+        if breaker is not None:
+            breaker.before()
+        start = time.time()
+        try:
+            result = request(timeout.get() if adaptive else timeout)
+        except Exception as exc:
+            elapsed = time.time() - start
+            if breaker is not None:
+                breaker.record(elapsed, self._is_outage(exc))
+            if adaptive and isinstance(exc, endpoint.session.Timeout):
+                timeout.record(elapsed)
+            raise
+        elapsed = time.time() - start
+        if breaker is not None:
+            breaker.record(elapsed)
+        if adaptive:
+            timeout.record(elapsed)
+        return result
+
+    def _send_events(self, data, collector=None, count=None,
+                     serialize=None):
+        collector = collector or self._primary
+        listeners = self._listeners
+        if listeners:
+            start = clock()
+        headers = {'content-type': 'application/json'}
+        data, encoding = compress(data, self.compress_min_bytes)
+        if encoding:
+            headers['content-encoding'] = encoding
+
+        def request(timeout):
+            r = collector.session.post(collector.url + 'event/put',
+                                       data, headers=headers,
+                                       timeout=timeout)
+            r.raise_for_status()
+            return r
+        if not listeners:
+            self._call(collector, request)
+            return
+
+        record = CallRecord('collector', 'event/put', host=collector.host,
+                            events=count, bytes_sent=len(data),
+                            serialize=(serialize or 0) + clock() - start)
+        if collector.sender is not None:
+            record.queue_depth = collector.sender.queue_depth
+        start = clock()
+        try:
+            r = self._call(collector, request)
+            record.bytes_received = len(r.content)
+        except Exception as exc:
+            record.error = exc
+            raise
+        finally:
+            record.network = clock() - start
+            emit(listeners, record)
+
+    @property
+    def _request_errors(self):
+        """ What a failed request raises. """
+        return self.collector_session.RequestException, CircuitOpen
+
+    def _is_outage(self, exc):
+        """ Whether the collector or evaluator is down, rather than
+        rejecting the request. """
+        transport = self.collector_session
+        if isinstance(exc, CircuitOpen):
+            return True
+        if isinstance(exc, transport.HTTPError):
+            return exc.response.status_code >= 500
+        return isinstance(exc, (transport.ConnectionError,
+                                transport.Timeout))
+
+    def _post_events(self, data, count=1, collector=None, serialize=None):
+        """ Send events, returns SPOOLED if they were spooled instead. """
+        collector = collector or self._primary
+        if self.spool is None:
+            return self._send_events(data, collector, count, serialize)
+
+        if time.time() < collector.spool_until:
+            self.spool.append(data, count)
+            return SPOOLED
+        try:
+            self._send_events(data, collector, count, serialize)
+        except self._request_errors as exc:
+            if not self._is_outage(exc):
+                raise
+            collector.spool_until = time.time() + self.spool_retry
+            self.spool.append(data, count)
+            return SPOOLED
+        if self.spool.pending and (self._replay_thread is None or
+                                   not self._replay_thread.is_alive()):
+            self._replay_thread = threading.Thread(target=self.replay_spool)
+            self._replay_thread.daemon = True
+            self._replay_thread.start()
+
+    def _replay_events(self, data):
+        if len(self.ring) == 1:
+            routes = [(self._primary, None)]
+        else:
+            # Replayed batches mix the events spooled for each collector,
+            # and the ring may have changed since. A failure past the
+            # first collector replays the whole batch again.
+            routes = self._route(json.loads(data.decode('utf-8')))
+            if len(routes) == 1:
+                routes = [(routes[0][0], None)]
+        for collector, events in routes:
+            if time.time() < collector.spool_until:
+                # Wait for the collector to be given another chance
+                raise collector.session.ConnectionError(
+                    "{0} is down".format(collector.host))
+            try:
+                self._send_events(data if events is None
+                                  else encode_events(events), collector)
+            except self._request_errors as exc:
+                # Don't retry forever events the collector rejects
+                if self._is_outage(exc):
+                    collector.spool_until = time.time() + self.spool_retry
+                    raise
+
+    def replay_spool(self, max_events=MAX_BATCH_EVENTS):
+        """
+        Send the spooled events, returns how many were sent.
+        """
+        if self.spool is None:
+            return 0
+        try:
+            return self.spool.replay(self._replay_events, max_events)
+        except self._request_errors:
+            return 0
 
     def put(self, event_type, event_data={}, **kwargs):
         """
         Create/update an event.
+
+        With async_put, the event is only enqueued, pass future=True
+        to get a PutFuture resolved once it has been sent.
+        Pass udp=True/False to override the instance transport.
         """
-        event = dict(type=event_type, data=event_data)
+        event = make_event(event_type, event_data, **kwargs)
 
-        event["time"] = kwargs.get("time", datetime.utcnow().isoformat())
+        collector = self._collector_for(event_type)
+        if kwargs.get("udp", self.udp):
+            self._udp_for(collector).send([event])
+            return [event]
 
-        if kwargs.get("id"):
-            event["id"] = kwargs.get("id")
+        if collector.sender is not None:
+            future = PutFuture() if kwargs.get("future") else None
+            collector.sender.put(event, future)
+            return future or [event]
 
-        data = json.dumps([event])
+        if not self._listeners:
+            self._post_events(encode_events([event]), collector=collector)
+            return [event]
 
-        r = requests.post(self.collector_url + 'event/put',
-                          data=data,
-                          headers={'content-type': 'application/json'})
-        r.raise_for_status()
+        start = clock()
+        data = encode_events([event])
+        self._post_events(data, collector=collector,
+                          serialize=clock() - start)
 
         return [event]
 
+    def put_many(self, events, max_events=MAX_BATCH_EVENTS,
+                 max_bytes=MAX_BATCH_BYTES, udp=None):
+        """
+        Create/update several events, sent in as few POST as possible.
+
+        events is an iterable of dict with a type key, and optional
+        data, time and id keys (defaulted like put does).
+        Returns a list of ChunkResult, one per POST, events sharded
+        over several collectors are grouped per collector first.
+
+        Over UDP, events are packed in datagrams and the number
+        of events sent is returned instead.
+        """
+        events = (make_event(e["type"], e.get("data", {}),
+                              **dict((k, e[k]) for k in ("time", "id")
+                                     if k in e))
+                  for e in events)
+
+        if len(self.ring) == 1:
+            routes = [(self._primary, events)]
+        else:
+            routes = self._route(events)
+
+        if self.udp if udp is None else udp:
+            return sum(self._udp_for(collector).send(events)
+                       for collector, events in routes)
+
+        results = []
+        for collector, events in routes:
+            chunks = chunk_events(events, max_events, max_bytes)
+            chunks = timed(chunks) if self._listeners else \
+                ((chunk, None) for chunk in chunks)
+            for (chunk, data), serialize in chunks:
+                try:
+                    outcome = self._post_events(data, len(chunk), collector,
+                                                serialize)
+                except self._request_errors as exc:
+                    results.append(ChunkResult(chunk, len(data), exc))
+                else:
+                    results.append(ChunkResult(
+                        chunk, len(data), spooled=outcome == SPOOLED))
+
+        return results
+
+    def _evaluator_get(self, replica, path, params=None, stream=False):
+        def request(timeout):
+            r = replica.session.get(replica.url + path, params=params,
+                                    timeout=timeout, stream=stream)
+            try:
+                r.raise_for_status()
+            except Exception:
+                r.close()
+                raise
+            return r
+        return self._call(replica, request)
+
+    def _fetch(self, path, params=None, decode=None):
+        """
+        GET path from an evaluator replica, returns decode(response),
+        or the decoded JSON
+        """
+        def fetch(replica):
+            return self._evaluator_get(replica, path, params)
+        decode = decode or (lambda r: r.json())
+        listeners = self._listeners
+        if not listeners:
+            return decode(self.replicas.call(fetch))
+
+        record = CallRecord('evaluator', path)
+        if params:
+            start = clock()
+            record.bytes_sent = len(_urlencode(sorted(params.items())))
+            record.serialize = clock() - start
+            record.expression = params.get('expression')
+            record.step = params.get('step')
+        start = clock()
+        try:
+            r = self.replicas.call(fetch)
+            record.network = clock() - start
+            record.host = _urlsplit(r.url).netloc
+            record.bytes_received = len(r.content)
+            start = clock()
+            result = decode(r)
+            record.decode = clock() - start
+            record.result_size = len(result)
+        except Exception as exc:
+            if record.network is None:
+                record.network = clock() - start
+            record.error = exc
+            raise
+        finally:
+            emit(listeners, record)
+        return result
+
+    def iter_events(self, expression, chunk_size=None, **kwargs):
+        """
+        Query with an event expression, yielding the events as they are
+        received and decoded instead of loading the whole response,
+        or lists of at most chunk_size events if given
+        """
+        data = query_params(expression, **kwargs)
+        listeners = self._listeners
+        record = None
+        if listeners:
+            # Decode includes reading the streamed body
+            record = CallRecord('evaluator', 'event',
+                                expression=data['expression'],
+                                bytes_received=0, result_size=0, decode=0)
+            start = clock()
+
+        try:
+            # Streamed, so not hedged
+            r = self.replicas.call(
+                lambda replica: self._evaluator_get(replica, 'event', data,
+                                                    stream=True),
+                hedge=False)
+        except Exception as exc:
+            if record is not None:
+                record.network = clock() - start
+                record.error = exc
+                emit(listeners, record)
+            raise
+
+        try:
+            chunks = r.iter_content(STREAM_CHUNK_SIZE)
+            if record is not None:
+                record.network = clock() - start
+                record.host = _urlsplit(r.url).netloc
+                chunks = counted(chunks, record)
+            events = iter_json_array(chunks)
+            if chunk_size:
+                events = iter_chunks(events, chunk_size)
+            if record is None:
+                for item in events:
+                    yield item
+                return
+            for item, elapsed in timed(events):
+                record.decode += elapsed
+                record.result_size += len(item) if chunk_size else 1
+                yield item
+        except Exception as exc:
+            if record is not None:
+                record.error = exc
+            raise
+        finally:
+            r.close()
+            if record is not None:
+                emit(listeners, record)
+
+    def paginate_events(self, expression, start, stop=None, **kwargs):
+        """
+        Iterate over all the events between start and stop, querying
+        adaptive time windows to stay under the evaluator limit,
+        see cube.paginate.paginate_events for the options
+        """
+        return paginate_events(self, expression, start, stop, **kwargs)
+
+    def _query_key(self, query_type, expression, kwargs):
+        data = query_params(expression, **kwargs)
+        if 'stop' not in kwargs:
+            # Not the utcnow() query_params defaults to
+            del data['stop']
+        return (self.evaluator_url, query_type,
+                tuple(sorted((k, str(v)) for k, v in data.items())))
+
     def make_query(self, query_type, expression, **kwargs):
         """
         Actually perform the query,
-        try to convert datetime to isoformat on the fly
+        try to convert datetime to isoformat on the fly,
+        concurrent identical queries share a request, see coalesce
         """
-        data = dict(expression=str(expression),
-                    stop=kwargs.get('stop', datetime.utcnow()))
-        data.update(kwargs)
+        data = query_params(expression, **kwargs)
+        if self.singleflight is None:
+            return self._fetch(query_type, data)
+        return self.singleflight.do(
+            self._query_key(query_type, expression, kwargs),
+            lambda: self._fetch(query_type, data))
 
-        for k in ['start', 'stop']:
-            if k in data:
-                try:
-                    data[k] = data[k].isoformat()
-                except AttributeError:
-                    pass
+    def _query_range(self, query_type, expression, split=None,
+                     parallelism=PARALLELISM, **kwargs):
+        """
+        Perform the query, cutting [start, stop) into sub-ranges of
+        at most split (a timedelta) fetched concurrently, if given
+        """
+        if split is None or 'start' not in kwargs:
+            return self.make_query(query_type, expression, **kwargs)
 
-        r = requests.get(self.evaluator_url + query_type, params=data)
-        r.raise_for_status()
+        start = time_utils.to_datetime(kwargs['start'])
+        stop = time_utils.to_datetime(kwargs.get('stop') or
+                                      datetime.utcnow())
+        step = None
+        if query_type == 'metric' and 'step' in kwargs:
+            step = time_utils.step_to_ms(kwargs['step'])
 
-        return r.json()
+        def fetch(start, stop):
+            return self.make_query(query_type, expression,
+                                   **dict(kwargs, start=start, stop=stop))
+        limit = kwargs.get('limit')
+        return fetch_ranges(fetch, start, stop, split, step, parallelism,
+                            None if limit is None else int(limit))
 
     def event(self, expression, **kwargs):
         """
-        Query with an event expression
+        Query with an event expression,
+        pass split=timedelta(...) to fetch long ranges as sub-ranges,
+        up to parallelism (default 4) at a time, a limit then applies
+        to the whole range
+        """
+        return self._query_range('event', expression, **kwargs)
+
+    def _cache_range(self, kwargs):
+        """
+        Return the (step, start, stop) of a cacheable metric query,
+        or None
         """
-        return self.make_query('event', expression, **kwargs)
+        if self.metric_cache is None or 'limit' in kwargs:
+            return None
+        try:
+            step = kwargs['step']
+            start = time_utils.to_datetime(kwargs['start'])
+            stop = kwargs.get('stop')
+            if stop is not None:
+                stop = time_utils.to_datetime(stop)
+            time_utils.floor(start, time_utils.step_to_ms(step))
+        except (KeyError, ValueError):
+            return None
+        return step, start, stop
 
     def metric(self, expression, **kwargs):
         """
-        Query with a metric expression
+        Query with a metric expression,
+        pass cache=False to bypass the metric cache,
+        split/parallelism work like for event,
+        pass local=True to evaluate compound expressions client-side,
+        pass columnar=True to get a MetricSeries instead of a list
+        """
+        columnar = kwargs.pop('columnar', False)
+        step_ms = None
+        if 'step' in kwargs:
+            step_ms = time_utils.step_to_ms(kwargs['step'])
+        cache = kwargs.pop('cache', True)
+        cache_range = self._cache_range(kwargs) if cache else None
+
+        if kwargs.pop('local', False):
+            # The leaves are fetched like expression would be, columnar
+            # only applies to the result
+            result = evaluate_many(self, [expression], cache=cache,
+                                   **kwargs)[0]
+        elif cache_range is not None:
+            def fetch(start, stop):
+                return self._query_range('metric', expression,
+                                         **dict(kwargs, start=start,
+                                                stop=stop))
+            result = self.metric_cache.query(fetch, expression,
+                                             *cache_range)
+        elif columnar and kwargs.get('split') is None:
+            # Parse the response straight into columns
+            return self._fetch('metric', query_params(expression, **kwargs),
+                               lambda r: MetricSeries.from_json(r.text,
+                                                                step_ms))
+        else:
+            result = self._query_range('metric', expression, **kwargs)
+
+        if columnar:
+            return MetricSeries.from_buckets(result, step_ms)
+        return result
+
+    def plan_metrics(self, queries, parallelism=PARALLELISM, **kwargs):
+        """
+        Plan several metric queries without running them, queries are
+        expressions or dicts with an expression key and metric kwargs,
+        kwargs are the defaults
+        """
+        return QueryPlan(self.metric, queries, parallelism, **kwargs)
+
+    def metrics(self, queries, parallelism=PARALLELISM, **kwargs):
+        """
+        Run several metric queries (see plan_metrics), each distinct
+        leaf metric is fetched once, up to parallelism at a time,
+        returns the results in order
+        """
+        return self.plan_metrics(queries, parallelism, **kwargs).execute()
+
+    def metric_rollups(self, expression, steps, **kwargs):
+        """
+        Query a metric at several resolutions with a single fetch at
+        the finest one, the others are rolled up client-side.
+        Returns a dict step => MetricSeries, pass approximate=True
+        to allow median and distinct metrics
         """
-        return self.make_query('metric', expression, **kwargs)
+        return multi_resolution(self, expression, steps, **kwargs)
 
     def types(self):
         """
         List of the known event types
         """
-        r = requests.get(self.evaluator_url + 'types')
-        r.raise_for_status()
-        return r.json()
+        return self._fetch('types')
 
-    def get_event(self, event_type):
+    def get_event(self, event_type, udp=None):
         """
         Shortcut to initialize an Event object
         """
-        return Event(self, event_type)
+        return Event(self, event_type, udp=udp)
@@ -0,0 +1,139 @@
+# -*- encoding: utf-8 -*-
+"""
+asyncio Cube client, requires Python 3.5+ and aiohttp.
+
+Not imported by the cube package, import it explicitly:
+
+    from cube.aio import AsyncCube
+"""
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from cube import API_VERSION, POOL_SIZE, make_event, query_params
+from cube.expression import EventExpression
+
+
+class AsyncCube(object):
+    """ Coroutine flavor of Cube, all the queries share
+    one pooled aiohttp session, so they can run concurrently.
+
+    Extra kwargs: collector_port, evaluator_port, pool_size (max
+    connections, for both endpoints), timeout (total, in seconds)
+    and session (an existing aiohttp.ClientSession to use).
+    """
+    def __init__(self, hostname="localhost", **kwargs):
+        if aiohttp is None:
+            raise ImportError("AsyncCube requires aiohttp")
+        self.collector_url = 'http://{0}:{1}/{2}/'.format(
+            hostname, kwargs.get('collector_port', 1080), API_VERSION)
+        self.evaluator_url = 'http://{0}:{1}/{2}/'.format(
+            hostname, kwargs.get('evaluator_port', 1081), API_VERSION)
+        self.pool_size = kwargs.get('pool_size', POOL_SIZE)
+        self.timeout = kwargs.get('timeout')
+        self._session = kwargs.get('session')
+        self._owns_session = self._session is None
+
+    @property
+    def session(self):
+        if self._session is None:
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=timeout)
+        return self._session
+
+    async def close(self):
+        """
+        Close the session, unless it was given by the caller.
+        """
+        if self._session is not None and self._owns_session:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def put(self, event_type, event_data={}, **kwargs):
+        """
+        Create/update an event.
+        """
+        event = make_event(event_type, event_data, **kwargs)
+
+        async with self.session.post(
+                self.collector_url + 'event/put',
+                data=json.dumps([event]),
+                headers={'content-type': 'application/json'}) as r:
+            r.raise_for_status()
+
+        return [event]
+
+    async def make_query(self, query_type, expression, **kwargs):
+        """
+        Actually perform the query, with the same
+        arguments handling as Cube.make_query
+        """
+        data = query_params(expression, **kwargs)
+        # aiohttp only takes strings as query parameters
+        params = dict((k, str(v)) for k, v in data.items())
+
+        async with self.session.get(self.evaluator_url + query_type,
+                                    params=params) as r:
+            r.raise_for_status()
+            return await r.json(loads=json.loads, content_type=None)
+
+    async def event(self, expression, **kwargs):
+        """
+        Query with an event expression
+        """
+        return await self.make_query('event', expression, **kwargs)
+
+    async def metric(self, expression, **kwargs):
+        """
+        Query with a metric expression
+        """
+        return await self.make_query('metric', expression, **kwargs)
+
+    async def types(self):
+        """
+        List of the known event types
+        """
+        async with self.session.get(self.evaluator_url + 'types') as r:
+            r.raise_for_status()
+            return await r.json(loads=json.loads, content_type=None)
+
+    def get_event(self, event_type):
+        """
+        Shortcut to initialize an AsyncEvent object
+        """
+        return AsyncEvent(self, event_type)
+
+
+class AsyncEvent(object):
+    """ Coroutine flavor of cube.event.Event. """
+    def __init__(self, cube, event_type):
+        self.cube = cube
+        self.event_type = event_type
+
+    async def put(self, event_data={}, **kwargs):
+        return await self.cube.put(self.event_type, event_data, **kwargs)
+
+    async def event(self, expression=None, **kwargs):
+        if expression is None:
+            expression = self.event_type
+        return await self.cube.event(expression, **kwargs)
+
+    async def metric(self, expression, **kwargs):
+        return await self.cube.metric(expression, **kwargs)
+
+    def expression(self, event_properties):
+        return EventExpression(self.event_type, event_properties)
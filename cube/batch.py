@@ -0,0 +1,90 @@
+# -*- encoding: utf-8 -*-
+from itertools import islice
+
+from cube.encoding import dumps, encode_events
+
+# Default bounds for a single collector POST
+MAX_BATCH_EVENTS = 500
+MAX_BATCH_BYTES = 1024 * 1024
+
+
+class ChunkResult(object):
+    """ Outcome of posting one chunk of events to the collector. """
+    def __init__(self, events, size, error=None, spooled=False):
+        """
+        :param events: The events sent in this chunk.
+        :type events: list(dict)
+        :param size: Size of the JSON body, in bytes.
+        :type size: int
+        :param error: The exception raised while posting, if any.
+        :param spooled: True if the chunk was spooled on disk
+            instead of sent.
+        """
+        self.events = events
+        self.size = size
+        self.error = error
+        self.spooled = spooled
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return "<ChunkResult: {0} events, {1} bytes, {2}>".format(
+            len(self.events), self.size,
+            self.error if not self.ok else
+            "spooled" if self.spooled else "ok")
+
+
+def chunk_events(events, max_events=MAX_BATCH_EVENTS,
+                 max_bytes=MAX_BATCH_BYTES):
+    """Split events into size-bounded JSON arrays.
+
+    Yields (events, body) tuples, each body (bytes) holding at most
+    max_events events and max_bytes bytes. An event larger than max_bytes
+    on its own is still sent, alone in its chunk.
+
+    Chunks are encoded in one go, events are only encoded one by one
+    once a chunk is over max_bytes, to find where to cut it, then
+    chunks are filled from the running size of the encoded events:
+    each event is encoded at most twice.
+
+    >>> chunks = chunk_events([{'type': 'a'}] * 5, max_events=2)
+    >>> [len(c) for c, body in chunks]
+    [2, 2, 1]
+    """
+    events = iter(events)
+    # Events left over from a cut chunk, and their encodings
+    pending, encoded = [], []
+    while True:
+        new = list(islice(events, max_events - len(pending)))
+        if pending and not new:
+            # No more events, or pending is a full chunk
+            yield pending, _join(encoded)
+            pending, encoded = [], []
+            continue
+        if not pending:
+            if not new:
+                return
+            body = encode_events(new)
+            if len(body) <= max_bytes or len(new) == 1:
+                yield new, body
+                continue
+        pending += new
+        encoded += [dumps(event) for event in new]
+
+        # Cut where the next event would go over max_bytes, the brackets
+        # and commas count for one byte per event plus one
+        start, size = 0, 1
+        for end, data in enumerate(encoded):
+            if end > start and size + len(data) + 1 > max_bytes:
+                yield pending[start:end], _join(encoded[start:end])
+                start, size = end, 1
+            size += len(data) + 1
+        # The last one may have room left for the next events
+        pending, encoded = pending[start:], encoded[start:]
+
+
+def _join(encoded):
+    """ A JSON array of already encoded events. """
+    return b"[" + b",".join(encoded) + b"]"
@@ -0,0 +1,180 @@
+# -*- encoding: utf-8 -*-
+"""
+Circuit breakers and adaptive timeouts, one of each per endpoint.
+
+A CircuitBreaker opens once too many of the recent calls failed or were
+slow, calls then fail fast with CircuitOpen for reset_timeout seconds,
+after which a probe call is let through (half-open): the circuit closes
+if it succeeds, and opens again otherwise.
+
+An AdaptiveTimeout is a multiple of a percentile of the recent
+latencies, kept between min_timeout and max_timeout.
+"""
+import threading
+import time
+from collections import deque
+
+from cube.replicas import percentile
+
+# Latencies recorded between two timeout updates
+TIMEOUT_REFRESH = 16
+
+# Circuit states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(IOError):
+    """ The endpoint circuit is open, the call wasn't made. """
+
+
+class CircuitBreaker(object):
+    """ Trips once at least min_calls of the last window calls were made
+    and failure_rate of them failed, or slow_rate of them took more than
+    slow_call seconds (if given).
+
+    >>> breaker = CircuitBreaker('collector', window=4, min_calls=4)
+    >>> for failed in [False, True, True, False]:
+    ...     breaker.before()
+    ...     breaker.record(0.01, failed)
+    >>> breaker.state
+    'open'
+    """
+    def __init__(self, name, window=20, min_calls=10, failure_rate=0.5,
+                 slow_call=None, slow_rate=0.5, reset_timeout=5,
+                 half_open_calls=1, clock=time.time):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+
+        self.state = CLOSED
+        self.opened = 0
+        self.rejected = 0
+
+        # (failed, slow) of the last calls
+        self._calls = deque(maxlen=window)
+        self._failures = 0
+        self._slow = 0
+        self._opened_at = None
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<CircuitBreaker: {0} {1}>".format(self.name, self.state)
+
+    @property
+    def stats(self):
+        return dict(state=self.state, calls=len(self._calls),
+                    failures=self._failures, slow=self._slow,
+                    opened=self.opened, rejected=self.rejected)
+
+    def before(self):
+        """ Raise CircuitOpen unless a call can be made now. """
+        with self._lock:
+            if self.state == OPEN:
+                retry_in = self._opened_at + self.reset_timeout - \
+                    self.clock()
+                if retry_in > 0:
+                    self.rejected += 1
+                    raise CircuitOpen("{0} circuit is open, retrying in "
+                                      "{1:.1f}s".format(self.name,
+                                                        retry_in))
+                self.state = HALF_OPEN
+                self._probes = 0
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpen("{0} circuit is half-open, waiting "
+                                      "for the probe".format(self.name))
+                self._probes += 1
+
+    def record(self, elapsed, failed=False):
+        """ Record the outcome of a call allowed by before. """
+        slow = self.slow_call is not None and elapsed > self.slow_call
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes -= 1
+                if failed or slow:
+                    self._open()
+                else:
+                    self.state = CLOSED
+                    self._reset()
+                return
+            if self.state == OPEN:
+                # A call made before the circuit opened
+                return
+            if len(self._calls) == self._calls.maxlen:
+                old_failed, old_slow = self._calls[0]
+                self._failures -= old_failed
+                self._slow -= old_slow
+            self._calls.append((failed, slow))
+            self._failures += failed
+            self._slow += slow
+            count = len(self._calls)
+            if count >= self.min_calls and (
+                    self._failures >= self.failure_rate * count or
+                    self._slow >= self.slow_rate * count):
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened += 1
+        self._opened_at = self.clock()
+        self._reset()
+
+    def _reset(self):
+        self._calls.clear()
+        self._failures = self._slow = 0
+
+
+class AdaptiveTimeout(object):
+    """ multiplier times the pct percentile of the last window
+    latencies, max_timeout until min_samples were recorded.
+
+    Calls that timed out should be recorded too, so that the timeout
+    grows back when the endpoint gets slower.
+
+    >>> timeout = AdaptiveTimeout(min_samples=3, min_timeout=0.01)
+    >>> for elapsed in [0.02, 0.01, 0.03]:
+    ...     timeout.record(elapsed)
+    >>> round(timeout.get(), 2)
+    0.09
+    """
+    def __init__(self, pct=99, multiplier=3, min_timeout=0.5,
+                 max_timeout=30, window=256, min_samples=20):
+        self.pct = pct
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._timeout = max_timeout
+        # Latencies recorded since the timeout was computed
+        self._stale = 0
+
+    def __repr__(self):
+        return "<AdaptiveTimeout: {0:.3f}s>".format(self.get())
+
+    def record(self, elapsed):
+        self._latencies.append(elapsed)
+        self._stale += 1
+        if elapsed >= self._timeout:
+            # Don't wait for the next refresh to grow
+            self._stale = TIMEOUT_REFRESH
+
+    def get(self):
+        """ The timeout, in seconds. """
+        if len(self._latencies) >= self.min_samples and \
+                self._stale >= min(TIMEOUT_REFRESH, self.min_samples):
+            latency = percentile(sorted(self._latencies), self.pct)
+            self._timeout = min(self.max_timeout,
+                                max(self.min_timeout,
+                                    self.multiplier * latency))
+            self._stale = 0
+        return self._timeout
@@ -0,0 +1,151 @@
+# -*- encoding: utf-8 -*-
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from cube import time_utils
+from cube.canonical import canonical_string
+from cube.parser import ParseError
+
+# Max number of buckets held by default, across all the series
+MAX_BUCKETS = 100000
+
+
+def _series_key(expression):
+    try:
+        return canonical_string(expression)
+    except ParseError:
+        # Not an expression the parser knows about
+        return str(expression)
+
+
+class MetricCache(object):
+    """ Step-aligned cache of metric results.
+
+    Buckets are cached per (canonical expression, step), so equivalent
+    expressions share their buckets, and a query only fetches
+    from the evaluator the buckets it doesn't already have, plus the
+    trailing ones that may still change: a bucket is considered final
+    once it ended grace seconds ago.
+
+    Least recently used series are evicted once more than max_buckets
+    buckets are held.
+    """
+    def __init__(self, max_buckets=MAX_BUCKETS, grace=10):
+        self.max_buckets = max_buckets
+        self.grace = timedelta(seconds=grace)
+
+        # Queries fully served from the cache, partially, or not at all
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.buckets_hit = 0
+        self.buckets_fetched = 0
+        self.evictions = 0
+
+        self._series = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def stats(self):
+        return dict(hits=self.hits, partial_hits=self.partial_hits,
+                    misses=self.misses, buckets_hit=self.buckets_hit,
+                    buckets_fetched=self.buckets_fetched,
+                    evictions=self.evictions, buckets=self._size,
+                    series=len(self._series))
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+            self._size = 0
+
+    def query(self, fetch, expression, step, start, stop=None, now=None):
+        """ Return the buckets for expression between start and stop,
+        calling fetch(start, stop) for the missing ones.
+
+        fetch must return the evaluator response, a list of dicts with
+        time and value keys, start and stop are datetimes. The buckets
+        returned are copies of the cached ones.
+        """
+        step_ms = time_utils.step_to_ms(step)
+        now = now or datetime.utcnow()
+        start_ms = time_utils.to_epoch_ms(time_utils.floor(start, step_ms))
+        stop_ms = time_utils.to_epoch_ms(time_utils.floor(stop or now,
+                                                          step_ms))
+        final_ms = time_utils.to_epoch_ms(now - self.grace)
+        key = (_series_key(expression), step_ms)
+
+        with self._lock:
+            buckets = self._series.pop(key, {})
+            # Back to the most recently used end
+            self._series[key] = buckets
+            missing = [t for t in range(start_ms, stop_ms, step_ms)
+                       if t not in buckets]
+
+        fetched = {}
+        for run_start, run_stop in self._runs(missing, step_ms):
+            result = fetch(time_utils.from_epoch_ms(run_start),
+                           time_utils.from_epoch_ms(run_stop))
+            times = time_utils.parse_times_ms([bucket['time']
+                                               for bucket in result])
+            fetched.update(zip(times, result))
+
+        result = []
+        with self._lock:
+            total = (stop_ms - start_ms) // step_ms if stop_ms > start_ms \
+                else 0
+            self.buckets_fetched += len(fetched)
+            self.buckets_hit += total - len(missing)
+            if not missing:
+                self.hits += 1
+            elif len(missing) < total:
+                self.partial_hits += 1
+            else:
+                self.misses += 1
+
+            for t, bucket in fetched.items():
+                if t + step_ms <= final_ms and t not in buckets:
+                    buckets[t] = bucket
+                    self._size += 1
+            for t in range(start_ms, stop_ms, step_ms):
+                bucket = fetched.get(t) or buckets.get(t)
+                if bucket is not None:
+                    # A copy, the caller may change it
+                    result.append(dict(bucket))
+            self._evict(key)
+        return result
+
+    def _runs(self, missing, step_ms):
+        """ Group missing bucket times into contiguous [start, stop) ranges.
+
+        >>> list(MetricCache()._runs([0, 10, 20, 50, 60], 10))
+        [(0, 30), (50, 70)]
+        """
+        run_start = previous = None
+        for t in missing:
+            if previous is not None and t != previous + step_ms:
+                yield run_start, previous + step_ms
+                run_start = None
+            if run_start is None:
+                run_start = t
+            previous = t
+        if run_start is not None:
+            yield run_start, previous + step_ms
+
+    def _evict(self, keep):
+        while self._size > self.max_buckets and len(self._series) > 1:
+            key = next(iter(self._series))
+            if key == keep:
+                break
+            self._size -= len(self._series.pop(key))
+            self.evictions += 1
+        if self._size > self.max_buckets:
+            # The series alone is too large, forget its oldest buckets
+            buckets = self._series[keep]
+            for t in sorted(buckets)[:self._size - self.max_buckets]:
+                del buckets[t]
+                self._size -= 1
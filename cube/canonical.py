@@ -0,0 +1,181 @@
+# -*- encoding: utf-8 -*-
+"""
+Canonical form of expressions, equivalent expressions get the same
+canonical string.
+
+- + and * chains are flattened and their operands sorted,
+- numeric constants are folded, x + 0, x - 0, x * 1 and x / 1 are x,
+- filters are sorted and deduplicated, in() arrays sorted.
+
+    >>> print(canonical_string('sum(b) + (sum(a) + sum(b) * 2 * 3)'))
+    ((sum(a) + sum(b)) + (sum(b) * 6))
+
+x * 0 is not folded: a null bucket stays null.
+"""
+import hashlib
+import json
+import numbers
+
+from cube.expression import CompoundMetricExpression, EventExpression
+from cube.expression import MetricExpression
+from cube.filters import IN
+from cube.parser import FILTERS, OPERATORS, parse
+
+try:
+    basestring
+except NameError:
+    # Python 3
+    basestring = str
+
+COMMUTATIVE = ('+', '*')
+
+# Max number of cached canonical forms
+CACHE_SIZE = 4096
+
+_IDENTITY = {'+': 0, '-': 0, '*': 1, '/': 1}
+
+_cache = {}
+
+
+def _combine(left, op, right):
+    if isinstance(left, (MetricExpression, CompoundMetricExpression)):
+        # Built like the operators do, to compare equal to parses
+        return OPERATORS[op](left, right)
+    return CompoundMetricExpression(left, op, right)
+
+
+def _fold(op, a, b):
+    if op == '/':
+        return float(a) / b if b else None
+    return OPERATORS[op](a, b)
+
+
+def _is_number(node):
+    return isinstance(node, numbers.Number) and not isinstance(node, bool)
+
+
+def _sort_key(node):
+    # Metrics, then compound expressions, then the constant
+    return (_is_number(node), isinstance(node, CompoundMetricExpression),
+            str(node))
+
+
+def _value_key(value):
+    return json.dumps(value, sort_keys=True)
+
+
+def _event(expression):
+    seen = set()
+    unique = []
+    for f in expression.filters:
+        if f.type == 'in':
+            values = dict((_value_key(v), v) for v in f.value)
+            f = IN(f.property_name, [values[k] for k in sorted(values)])
+        if f not in seen:
+            seen.add(f)
+            unique.append(f)
+    unique.sort(key=lambda f: (f.property_name, f.type, _value_key(f.value)))
+
+    canonical = EventExpression(expression.event_type,
+                                expression.event_properties)
+    for f in unique:
+        canonical = getattr(canonical, FILTERS[f.type])(f.property_name,
+                                                        f.value)
+    return canonical
+
+
+def _operands(node, op):
+    """The operands of a flattened op chain."""
+    if isinstance(node, CompoundMetricExpression):
+        if not node.operator:
+            return _operands(node.metric1, op)
+        if node.operator == op:
+            return _operands(node.metric1, op) + _operands(node.metric2, op)
+    return [node]
+
+
+def _chain(node, op):
+    flat = []
+    for operand in _operands(node, op):
+        operand = _canonical(operand)
+        # x + (y - 0) is x + y, the canonical operand may be a chain
+        flat.extend(_operands(operand, op))
+    constant = None
+    terms = []
+    for operand in flat:
+        if _is_number(operand):
+            constant = operand if constant is None else \
+                _fold(op, constant, operand)
+        else:
+            terms.append(operand)
+    terms.sort(key=_sort_key)
+    if constant is not None and (constant != _IDENTITY[op] or not terms):
+        terms.append(constant)
+    result = terms[0]
+    for term in terms[1:]:
+        result = _combine(result, op, term)
+    return result
+
+
+def _canonical(node):
+    if isinstance(node, EventExpression):
+        return _event(node)
+    if isinstance(node, MetricExpression):
+        return MetricExpression(node.metric_type,
+                                _event(node.event_expression))
+    if not isinstance(node, CompoundMetricExpression):
+        return node
+    if not node.operator:
+        return _canonical(node.metric1)
+    if node.operator in COMMUTATIVE:
+        return _chain(node, node.operator)
+
+    left = _canonical(node.metric1)
+    right = _canonical(node.metric2)
+    if _is_number(left) and _is_number(right):
+        folded = _fold(node.operator, left, right)
+        if folded is not None:
+            return folded
+    if _is_number(right) and right == _IDENTITY[node.operator]:
+        return left
+    return _combine(left, node.operator, right)
+
+
+def canonicalize(expression):
+    """Return the canonical form of an expression (or expression string).
+
+    >>> print(canonicalize('request.eq(path, "/").gt(ms, 1).eq(path, "/")'))
+    request.gt(ms, 1).eq(path, "/")
+    """
+    if isinstance(expression, basestring):
+        expression = parse(expression)
+    try:
+        return _cache[expression]
+    except KeyError:
+        pass
+    canonical = _canonical(expression)
+    if len(_cache) >= CACHE_SIZE:
+        _cache.clear()
+    _cache[expression] = canonical
+    return canonical
+
+
+def canonical_string(expression):
+    """The string of the canonical form of expression."""
+    return str(canonicalize(expression))
+
+
+def canonical_key(expression):
+    """A stable (across processes) hash of the canonical form of
+    expression, as an hex string.
+
+    >>> canonical_key('sum(a) * sum(b)') == canonical_key('sum(b) * sum(a)')
+    True
+    """
+    return hashlib.sha1(canonical_string(expression).encode('utf-8')) \
+        .hexdigest()
+
+
+def equivalent(expression1, expression2):
+    """Whether two expressions have the same canonical form."""
+    return canonicalize(expression1) == canonicalize(expression2)
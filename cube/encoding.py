@@ -0,0 +1,81 @@
+# -*- encoding: utf-8 -*-
+"""
+Collector payloads encoding.
+
+A batch of events is serialized with a single encoder call, straight
+to bytes, with the fastest encoder available (orjson, ujson, then the
+standard library json), without whitespace. What orjson or ujson
+can't encode, such as ints over 64 bits, is left to json. Bodies of
+at least COMPRESS_MIN_BYTES can then be gzip-compressed.
+
+    >>> encode_events([{'type': 'test'}, {'type': 'test'}])
+    '[{"type":"test"},{"type":"test"}]'
+"""
+import json
+import zlib
+
+_json_dumps = json.JSONEncoder(separators=(',', ':')).encode
+
+try:
+    import orjson
+
+    ENCODER = 'orjson'
+
+    def _dumps(obj):
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # e.g. ints over 64 bits, which json encodes
+            return _json_dumps(obj)
+except ImportError:
+    try:
+        import ujson
+
+        ENCODER = 'ujson'
+
+        def _dumps(obj):
+            try:
+                return ujson.dumps(obj)
+            except (TypeError, OverflowError):
+                return _json_dumps(obj)
+    except ImportError:
+        ENCODER = 'json'
+        _dumps = _json_dumps
+
+# Bodies smaller than that aren't worth compressing
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+
+# zlib wbits for a gzip container
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def dumps(obj):
+    """ obj as compact JSON bytes. """
+    data = _dumps(obj)
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    return data
+
+
+def encode_events(events):
+    """ A list of events as a JSON array, in bytes. """
+    return dumps(events if isinstance(events, list) else list(events))
+
+
+def compress(body, min_bytes=COMPRESS_MIN_BYTES, level=COMPRESS_LEVEL):
+    """Gzip body if it's at least min_bytes long.
+
+    Returns (body, content encoding), the encoding is None when
+    body was left as is.
+
+    >>> compress(b'[]')
+    ('[]', None)
+    >>> body, encoding = compress(b'[' + b'{},' * 1000 + b'{}]')
+    >>> len(body) < 100, encoding
+    (True, 'gzip')
+    """
+    if min_bytes is None or len(body) < min_bytes:
+        return body, None
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _GZIP_WBITS)
+    return compressor.compress(body) + compressor.flush(), 'gzip'
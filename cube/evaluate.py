@@ -0,0 +1,155 @@
+# -*- encoding: utf-8 -*-
+"""
+Client-side evaluation of CompoundMetricExpression.
+
+Each distinct leaf MetricExpression is fetched once, then the arithmetic
+is done locally, column by column, over buckets aligned on time.
+
+A bucket missing from a leaf result, a null value, or a division by zero
+all yield a None value for that bucket.
+"""
+import numbers
+
+from cube.expression import CompoundMetricExpression, MetricExpression
+from cube.parser import parse_metric
+from cube.split import PARALLELISM
+
+try:
+    basestring
+except NameError:
+    # Python 3
+    basestring = str
+
+
+def _add(a, b):
+    return a + b
+
+
+def _sub(a, b):
+    return a - b
+
+
+def _mul(a, b):
+    return a * b
+
+
+def _div(a, b):
+    if not b:
+        return None
+    return float(a) / b
+
+
+OPERATORS = {'+': _add, '-': _sub, '*': _mul, '/': _div}
+
+
+def leaves(expression):
+    """Yield the MetricExpressions of an expression tree (or string),
+    each distinct one once.
+
+    >>> from cube.expression import EventExpression, Sum
+    >>> m = Sum(EventExpression('request'))
+    >>> [str(leaf) for leaf in leaves(m / m + m * 2)]
+    ['sum(request)']
+    >>> [str(leaf) for leaf in leaves('sum(request) / max(request(ms))')]
+    ['sum(request)', 'max(request(ms))']
+    """
+    if isinstance(expression, basestring):
+        expression = parse_metric(expression)
+    seen = set()
+    stack = [expression]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, CompoundMetricExpression):
+            stack.extend([node.metric2, node.metric1])
+        elif isinstance(node, MetricExpression):
+            key = str(node)
+            if key not in seen:
+                seen.add(key)
+                yield node
+        elif node is not None and not isinstance(node, numbers.Number):
+            raise TypeError("Can't evaluate {0!r} locally".format(node))
+
+
+def _column(node, columns, size):
+    """Return the values of node, aligned on the buckets, or a number."""
+    if isinstance(node, CompoundMetricExpression):
+        left = _column(node.metric1, columns, size)
+        if not node.operator:
+            return left
+        right = _column(node.metric2, columns, size)
+        op = OPERATORS[node.operator]
+        if not isinstance(left, list):
+            left = [left] * size
+        if not isinstance(right, list):
+            right = [right] * size
+        return [None if a is None or b is None else op(a, b)
+                for a, b in zip(left, right)]
+    if isinstance(node, MetricExpression):
+        return columns[str(node)]
+    return node
+
+
+def evaluate(expression, results):
+    """Compute expression from the results of its leaves.
+
+    results maps str(leaf) to the evaluator response for that leaf,
+    a list of dicts with time and value keys.
+
+    >>> from cube.expression import EventExpression, Sum
+    >>> ms = Sum(EventExpression('request', 'elapsed_ms'))
+    >>> count = Sum(EventExpression('request'))
+    >>> result = evaluate(ms / count, {
+    ...     'sum(request(elapsed_ms))': [{'time': 't1', 'value': 30},
+    ...                                  {'time': 't2', 'value': 0}],
+    ...     'sum(request)': [{'time': 't1', 'value': 3},
+    ...                      {'time': 't2', 'value': 0}]})
+    >>> [(b['time'], b['value']) for b in result]
+    [('t1', 10.0), ('t2', None)]
+    """
+    if isinstance(expression, basestring):
+        expression = parse_metric(expression)
+    times = sorted(set(bucket['time'] for result in results.values()
+                       for bucket in result))
+    index = dict((t, i) for i, t in enumerate(times))
+    columns = {}
+    for key, result in results.items():
+        column = [None] * len(times)
+        for bucket in result:
+            column[index[bucket['time']]] = bucket.get('value')
+        columns[key] = column
+
+    values = _column(expression, columns, len(times))
+    if not isinstance(values, list):
+        values = [values] * len(times)
+    return [dict(time=t, value=v) for t, v in zip(times, values)]
+
+
+def fetch_leaves(fetch, expressions, parallelism=PARALLELISM):
+    """Call fetch(leaf) once for each distinct leaf of the expressions,
+    up to parallelism at a time, returns a dict str(leaf) => result.
+    """
+    unique = {}
+    for expression in expressions:
+        for leaf in leaves(expression):
+            unique.setdefault(str(leaf), leaf)
+    keys = list(unique)
+    if len(keys) < 2 or parallelism < 2:
+        values = [fetch(unique[k]) for k in keys]
+    else:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(parallelism, len(keys)))
+        try:
+            values = pool.map(lambda k: fetch(unique[k]), keys)
+        finally:
+            pool.close()
+            pool.join()
+    return dict(zip(keys, values))
+
+
+def evaluate_many(cube, expressions, parallelism=PARALLELISM, **kwargs):
+    """Evaluate several expressions locally, with the same query
+    arguments (step, start, stop...), fetching shared leaves once.
+    """
+    results = fetch_leaves(lambda leaf: cube.metric(leaf, **kwargs),
+                           expressions, parallelism)
+    return [evaluate(expression, results) for expression in expressions]
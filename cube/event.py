@@ -5,19 +5,43 @@ from cube.expression import EventExpression
 class Event(object):
     """ Cube instance that hold an event_type,
     with shortcut for getting/creating events/metrics,
-    and creating expression. """
-    def __init__(self, cube, event_type):
+    and creating expression.
+
+    udp overrides the Cube transport for this event type. """
+    def __init__(self, cube, event_type, udp=None):
         self.cube = cube
         self.event_type = event_type
+        self.udp = udp
 
     def put(self, event_data={}, **kwargs):
+        if self.udp is not None:
+            kwargs.setdefault('udp', self.udp)
         return self.cube.put(self.event_type, event_data, **kwargs)
 
+    def put_many(self, events, **kwargs):
+        """ Put several events of this type in batches,
+        events is an iterable of dict with optional data, time
+        and id keys (defaulted like put does). """
+        events = (dict(event, type=self.event_type) for event in events)
+        if self.udp is not None:
+            kwargs.setdefault('udp', self.udp)
+        return self.cube.put_many(events, **kwargs)
+
     def event(self, expression=None, **kwargs):
         if expression is None:
             expression = self.event_type
             return self.cube.event(expression, **kwargs)
 
+    def iter_events(self, expression=None, **kwargs):
+        if expression is None:
+            expression = self.event_type
+        return self.cube.iter_events(expression, **kwargs)
+
+    def paginate_events(self, start, stop=None, expression=None, **kwargs):
+        if expression is None:
+            expression = self.event_type
+        return self.cube.paginate_events(expression, start, stop, **kwargs)
+
     def metric(self, expression, **kwargs):
         return self.cube.metric(expression, **kwargs)
 
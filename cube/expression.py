@@ -6,12 +6,51 @@ Originally from:
 https://github.com/sbuss/pypercube/blob/master/pypercube/expression.py
 """
 
-import types
-
 from cube import filters
 
+try:
+    basestring
+except NameError:
+    # Python 3
+    basestring = str
+
+
+class _Immutable(object):
+    """Expressions are immutable, so they can be shared between
+    expression trees, hashed, and their string rendered only once.
+    """
+    _str = None
+    _hash = None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("{0} is immutable".format(
+            self.__class__.__name__))
+
+    def _set(self, **attrs):
+        for name, value in attrs.items():
+            object.__setattr__(self, name, value)
+
+    def _key(self):
+        raise NotImplementedError
+
+    def _render(self):
+        raise NotImplementedError
+
+    def __str__(self):
+        if self._str is None:
+            self._set(_str=self._render())
+        return self._str
+
+    def __hash__(self):
+        if self._hash is None:
+            self._set(_hash=hash(self._key()))
+        return self._hash
 
-class CompoundMetricExpression(object):
+    def __ne__(self, other):
+        return not self == other
+
+
+class CompoundMetricExpression(_Immutable):
     """CompoundMetricExpressions have two MetricExpressions and an operator.
 
     Used to do calculated metrics like sum(request(elapsed_ms)) / sum(request)
@@ -40,24 +79,33 @@ class CompoundMetricExpression(object):
         >>> print(m + m * m / m)
         (sum(request) + ((sum(request) * sum(request)) / sum(request)))
         """
-        if not operator and metric2:
+        if not operator and metric2 is not None:
             raise ValueError("You must have an operator if metric2 is"
                 "defined.")
-        self.metric1 = metric1
-        self.operator = operator
-        self.metric2 = metric2
+        self._set(metric1=metric1, operator=operator, metric2=metric2)
 
     def __eq__(self, other):
         """Note that this tests for *equality* not *equivalence*, eg
         m + (m + m) != (m + m) + m, though the two expressions are equivalent.
+        cube.canonical.equivalent tests for equivalence.
         """
-        return self.metric1 == other.metric1 and \
+        if self is other:
+            return True
+        return isinstance(other, CompoundMetricExpression) and \
+                hash(self) == hash(other) and \
+                self.metric1 == other.metric1 and \
                 self.operator == other.operator and \
                 self.metric2 == other.metric2
 
-    def __str__(self):
+    # Python 3 drops the inherited __hash__ of a class defining __eq__
+    __hash__ = _Immutable.__hash__
+
+    def _key(self):
+        return (self.metric1, self.operator, self.metric2)
+
+    def _render(self):
         response = "%s" % self.metric1
-        if self.operator and self.metric2:
+        if self.operator and self.metric2 is not None:
             response = "(" + response
             response += " {op} {right})".format(
                     op=self.operator,
@@ -104,7 +152,7 @@ class CompoundMetricExpression(object):
         return self.__div__(right)
 
 
-class MetricExpression(object):
+class MetricExpression(_Immutable):
     """A single MetricExpression."""
     def __init__(self, metric_type, event_expression):
         """Calculate a Cube Metric.
@@ -127,10 +175,12 @@ class MetricExpression(object):
         if len(event_expression.event_properties) > 1:
             raise ValueError("Events for Metrics may only select a single "
                     "event property")
-        self.metric_type = metric_type
-        self.event_expression = event_expression
+        self._set(metric_type=metric_type, event_expression=event_expression)
 
-    def __str__(self):
+    def _key(self):
+        return (self.metric_type, self.event_expression)
+
+    def _render(self):
         return "{type}({value})".format(
                 type=self.metric_type,
                 value=self.event_expression)
@@ -157,10 +207,18 @@ class MetricExpression(object):
         >>> m2 = MetricExpression('sum', e1)
         >>> m1 == m2
         True
+        >>> len(set([m1, m2]))
+        1
         """
-        return self.metric_type == other.metric_type and \
+        if self is other:
+            return True
+        return isinstance(other, MetricExpression) and \
+                hash(self) == hash(other) and \
+                self.metric_type == other.metric_type and \
                 self.event_expression == other.event_expression
 
+    __hash__ = _Immutable.__hash__
+
 
 class Sum(MetricExpression):
     """A "sum" metric."""
@@ -192,7 +250,7 @@ class Distinct(MetricExpression):
         super(Distinct, self).__init__("distinct", event)
 
 
-class EventExpression(object):
+class EventExpression(_Immutable):
     def __init__(self, event_type, event_properties=None):
         """Create an Event expression.
 
@@ -210,20 +268,46 @@ class EventExpression(object):
         ...     'elapsed_ms', 1000))  # doctest:+NORMALIZE_WHITESPACE
         request(elapsed_ms).eq(path, "/").gt(elapsed_ms, 100).lt(elapsed_ms,
                 1000)
+
+        Adding a filter returns a new EventExpression sharing its parent,
+        the filters aren't copied.
         """
-        self.event_type = event_type
         if event_properties:
-            if isinstance(event_properties, types.StringTypes):
+            if isinstance(event_properties, basestring):
                 event_properties = [event_properties]
         else:
             event_properties = []
-        self.event_properties = event_properties
-        self.filters = []
+        self._set(event_type=event_type,
+                  _properties=tuple(event_properties),
+                  _parent=None, _filter=None, _filters=())
+
+    @property
+    def event_properties(self):
+        return list(self._properties)
+
+    @property
+    def filters(self):
+        """The filters, in the order they were added, as a tuple."""
+        if self._filters is None:
+            chain, node = [], self
+            while node._filter is not None:
+                chain.append(node._filter)
+                node = node._parent
+            self._set(_filters=tuple(reversed(chain)))
+        return self._filters
+
+    def _add_filter(self, filter):
+        c = object.__new__(EventExpression)
+        c._set(event_type=self.event_type, _properties=self._properties,
+               _parent=self, _filter=filter, _filters=None)
+        return c
 
     def copy(self):
-        c = EventExpression(self.event_type, self.event_properties[:])
-        c.filters = self.filters[:]
-        return c
+        """Expressions are immutable, a copy is the expression itself."""
+        return self
+
+    def _key(self):
+        return (self.event_type, self._properties, self.filters)
 
     def __eq__(self, other):
         """
@@ -235,13 +319,15 @@ class EventExpression(object):
         >>> e1 == e2
         False
         """
-        return self.event_type == other.event_type and \
-                len(self.event_properties) == len(other.event_properties) and \
-                all((x == y) for (x, y) in \
-                    zip(self.event_properties, other.event_properties)) and \
-                self.event_properties == other.event_properties and \
-                len(self.filters) == len(other.filters) and \
-                all((x == y) for (x, y) in zip(self.filters, other.filters))
+        if self is other:
+            return True
+        return isinstance(other, EventExpression) and \
+                hash(self) == hash(other) and \
+                self.event_type == other.event_type and \
+                self._properties == other._properties and \
+                self.filters == other.filters
+
+    __hash__ = _Immutable.__hash__
 
     def eq(self, event_property, value):
         """An equals filter chain.
@@ -251,9 +337,7 @@ class EventExpression(object):
         >>> print(filtered)
         request(elapsed_ms).eq(path, "/")
         """
-        c = self.copy()
-        c.filters.append(filters.EQ(event_property, value))
-        return c
+        return self._add_filter(filters.EQ(event_property, value))
 
     def ne(self, event_property, value):
         """A not-equal filter chain.
@@ -263,9 +347,7 @@ class EventExpression(object):
         >>> print(filtered)
         request(elapsed_ms).ne(path, "/")
         """
-        c = self.copy()
-        c.filters.append(filters.NE(event_property, value))
-        return c
+        return self._add_filter(filters.NE(event_property, value))
 
     def lt(self, event_property, value):
         """A less-than filter chain.
@@ -275,9 +357,7 @@ class EventExpression(object):
         >>> print(filtered)
         request(elapsed_ms).lt(elapsed_ms, 500)
         """
-        c = self.copy()
-        c.filters.append(filters.LT(event_property, value))
-        return c
+        return self._add_filter(filters.LT(event_property, value))
 
     def le(self, event_property, value):
         """A less-than-or-equal-to filter chain.
@@ -287,9 +367,7 @@ class EventExpression(object):
         >>> print(filtered)
         request(elapsed_ms).le(elapsed_ms, 500)
         """
-        c = self.copy()
-        c.filters.append(filters.LE(event_property, value))
-        return c
+        return self._add_filter(filters.LE(event_property, value))
 
     def gt(self, event_property, value):
         """A greater-than filter chain.
@@ -299,9 +377,7 @@ class EventExpression(object):
         >>> print(filtered)
         request(elapsed_ms).gt(elapsed_ms, 500)
         """
-        c = self.copy()
-        c.filters.append(filters.GT(event_property, value))
-        return c
+        return self._add_filter(filters.GT(event_property, value))
 
     def ge(self, event_property, value):
         """A greater-than-or-equal-to filter chain.
@@ -311,9 +387,7 @@ class EventExpression(object):
         >>> print(filtered)
         request(elapsed_ms).ge(elapsed_ms, 500)
         """
-        c = self.copy()
-        c.filters.append(filters.GE(event_property, value))
-        return c
+        return self._add_filter(filters.GE(event_property, value))
 
     def re(self, event_property, value):
         """A regular expression filter chain.
@@ -323,9 +397,7 @@ class EventExpression(object):
         >>> print(filtered)
         request(elapsed_ms).re(path, "[^A-Za-z0-9+]")
         """
-        c = self.copy()
-        c.filters.append(filters.RE(event_property, value))
-        return c
+        return self._add_filter(filters.RE(event_property, value))
 
     def startswith(self, event_property, value):
         """A starts-with filter chain.
@@ -335,10 +407,8 @@ class EventExpression(object):
         >>> print(filtered)
         request(elapsed_ms).re(path, "^/cube")
         """
-        c = self.copy()
-        c.filters.append(filters.RE(event_property, "^{value}".format(
+        return self._add_filter(filters.RE(event_property, "^{value}".format(
             value=value)))
-        return c
 
     def endswith(self, event_property, value):
         """An ends-with filter chain.
@@ -348,10 +418,8 @@ class EventExpression(object):
         >>> print(filtered)
         request(elapsed_ms).re(path, ".*event/get$")
         """
-        c = self.copy()
-        c.filters.append(filters.RE(event_property, ".*{value}$".format(
-            value=value)))
-        return c
+        return self._add_filter(filters.RE(
+            event_property, ".*{value}$".format(value=value)))
 
     def contains(self, event_property, value):
         """A string-contains filter chain.
@@ -361,10 +429,8 @@ class EventExpression(object):
         >>> print(filtered)
         request(elapsed_ms).re(path, ".*event.*")
         """
-        c = self.copy()
-        c.filters.append(filters.RE(event_property, ".*{value}.*".format(
-            value=value)))
-        return c
+        return self._add_filter(filters.RE(
+            event_property, ".*{value}.*".format(value=value)))
 
     def in_array(self, event_property, value):
         """An in-array filter chain.
@@ -377,31 +443,20 @@ class EventExpression(object):
         >>> print(filtered)
         request(elapsed_ms).in(path, ["/event", "/"])
         """
-        c = self.copy()
-        c.filters.append(filters.IN(event_property, value))
-        return c
+        return self._add_filter(filters.IN(event_property, value))
 
     def get_expression(self):
-        event_type = self.event_type
-        event_property = self.event_properties
-        filters = self.filters
-
-        expression = "{event_type}".format(event_type=event_type)
+        return str(self)
 
-        if event_property:
-            if isinstance(event_property, types.StringTypes):
-                p = event_property
-            else:
-                p = ", ".join(str(x) for x in event_property)
+    def _render(self):
+        if self._parent is not None:
+            return str(self._parent) + str(self._filter)
 
+        expression = "{event_type}".format(event_type=self.event_type)
+        if self._properties:
+            p = ", ".join(str(x) for x in self._properties)
             expression += "({properties})".format(properties=p)
-
-        if filters:
-            expression += "".join(str(filter) for filter in filters)
         return expression
 
     def __repr__(self):
         return "<EventExpression: {value}>".format(value=self)
-
-    def __str__(self):
-        return self.get_expression()
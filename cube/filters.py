@@ -9,8 +9,30 @@ https://github.com/sbuss/pypercube/blob/master/pypercube/filters.py
 import json
 
 
+def _freeze(value):
+    """ A hashable stand-in for a JSON value. """
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(x) for x in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+def _copy(value):
+    """ A copy of a JSON value the caller can't change, arrays
+    become tuples. """
+    if isinstance(value, (list, tuple)):
+        return tuple(_copy(x) for x in value)
+    if isinstance(value, dict):
+        return dict((k, _copy(v)) for k, v in value.items())
+    return value
+
+
 class Filter(object):
-    """A filter for a cube event query."""
+    """A filter for a cube event query.
+
+    Filters are immutable and hashable, their string is rendered once.
+    """
     def __init__(self, type, property_name, value):
         """Create a Filter.
 
@@ -19,25 +41,40 @@ class Filter(object):
         :param property_name: The name of property on which to filter.
         :type property_name: str
         :param value: The value to which the property will be compared.
-        :type value: str or list(str)
+        :type value: str or list(str), lists are stored as tuples
         """
-        self.type = type
-        self.property_name = property_name
-        self.value = value
+        object.__setattr__(self, 'type', type)
+        object.__setattr__(self, 'property_name', property_name)
+        value = _copy(value)
+        object.__setattr__(self, 'value', value)
+        object.__setattr__(self, '_key', (type, property_name,
+                                          _freeze(value)))
+        object.__setattr__(self, '_str', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("{0} is immutable".format(
+            self.__class__.__name__))
 
     def __repr__(self):
         return "<{name}: {value}>".format(name=self.__class__.__name__,
                                           value=self)
 
     def __str__(self):
-        return ".{type}({property}, {value})".format(
-            type=self.type, property=self.property_name,
-            value=json.dumps(self.value))
+        if self._str is None:
+            object.__setattr__(self, '_str', ".{type}({property}, {value})"
+                               .format(type=self.type,
+                                       property=self.property_name,
+                                       value=json.dumps(self.value)))
+        return self._str
 
     def __eq__(self, other):
-        return self.type == other.type and \
-            self.property_name == other.property_name and \
-            self.value == other.value
+        return isinstance(other, Filter) and self._key == other._key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key)
 
 
 class EQ(Filter):
@@ -0,0 +1,266 @@
+# -*- encoding: utf-8 -*-
+"""
+Instrumentation of the requests a Cube client makes.
+
+Listeners added with Cube.add_listener are called with a CallRecord
+after each collector or evaluator request, from the thread that made
+it, so they should be quick. Histograms is a listener keeping latency
+histograms per (endpoint, path).
+
+Nothing is measured while no listener is attached.
+"""
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Durations are measured with the most precise clock available
+clock = getattr(time, 'perf_counter', time.time)
+
+# Histogram sub-buckets per power of two, 2 ** SUB_BITS, ~3% precision
+SUB_BITS = 5
+SUB_BUCKETS = 1 << SUB_BITS
+
+DURATIONS = ('total', 'serialize', 'network', 'decode')
+
+
+class CallRecord(object):
+    """ What a request cost, durations are in seconds.
+
+    - endpoint: 'collector' or 'evaluator'
+    - host: host:port of the endpoint that answered (if known)
+    - path: event/put, event, metric or types
+    - expression, step: of queries
+    - events: number of events put
+    - bytes_sent: body size, or query string size for queries
+    - bytes_received: response body size
+    - serialize: encoding the events (and compressing them),
+      or the query parameters
+    - network: from sending the request to reading the response
+    - decode: decoding the response
+    - result_size: number of events or buckets returned
+    - queue_depth: events waiting in the async_put queue
+    - error: the exception raised, if any
+    """
+    __slots__ = ('endpoint', 'host', 'path', 'expression', 'step', 'events',
+                 'bytes_sent', 'bytes_received', 'serialize', 'network',
+                 'decode', 'result_size', 'queue_depth', 'error')
+
+    def __init__(self, endpoint, path, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.get(name))
+        self.endpoint = endpoint
+        self.path = path
+
+    def __repr__(self):
+        return "<CallRecord: {0} {1} {2:.1f}ms{3}>".format(
+            self.endpoint, self.path, self.total * 1000,
+            ', error' if self.error is not None else '')
+
+    @property
+    def total(self):
+        return sum(d for d in (self.serialize, self.network, self.decode)
+                   if d is not None)
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+def emit(listeners, record):
+    """ Call each listener with record, a failing listener is logged,
+    it doesn't fail the request. """
+    for listener in listeners:
+        try:
+            listener(record)
+        except Exception:
+            log.exception("Instrumentation listener %r failed", listener)
+
+
+def timed(iterable):
+    """ Yield (item, seconds it took to get it) pairs. """
+    iterator = iter(iterable)
+    while True:
+        start = clock()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        yield item, clock() - start
+
+
+def counted(chunks, record):
+    """ Yield chunks, adding their size to record.bytes_received. """
+    for chunk in chunks:
+        record.bytes_received += len(chunk)
+        yield chunk
+
+
+def _index(value):
+    """ Bucket of a value, values below 2 * SUB_BUCKETS have their own,
+    then each power of two is cut in SUB_BUCKETS buckets. """
+    shift = max(0, value.bit_length() - SUB_BITS - 1)
+    return (shift << SUB_BITS) + (value >> shift)
+
+
+def _lowest(index):
+    """ Lowest value of a bucket. """
+    shift = max(0, (index >> SUB_BITS) - 1)
+    return (index - (shift << SUB_BITS)) << shift
+
+
+class Histogram(object):
+    """ Log-linear histogram of durations, in microseconds buckets of
+    about 3% width, like HdrHistogram with 2 significant digits.
+
+    >>> histogram = Histogram()
+    >>> for ms in range(1, 101):
+    ...     histogram.record(ms / 1000.0)
+    >>> snapshot = histogram.snapshot()
+    >>> snapshot.count, snapshot.max
+    (100, 0.1)
+    >>> 0.05 <= snapshot.percentile(50) < 0.0516
+    True
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._counts = []
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.sum = 0
+
+    def record(self, seconds):
+        value = max(0, int(seconds * 1000000))
+        index = _index(value)
+        with self._lock:
+            counts = self._counts
+            if index >= len(counts):
+                counts.extend([0] * (index + 1 - len(counts)))
+            counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def snapshot(self, reset=False):
+        """ A HistogramSnapshot, reset for interval histograms. """
+        with self._lock:
+            snapshot = HistogramSnapshot(list(self._counts), self.count,
+                                         self.min, self.max, self.sum)
+            if reset:
+                self._reset()
+        return snapshot
+
+
+class HistogramSnapshot(object):
+    """ Histogram counts at a point in time, values in seconds. """
+    def __init__(self, counts, count, min, max, sum):
+        self.counts = counts
+        self.count = count
+        self._min = min
+        self._max = max
+        self._sum = sum
+
+    @property
+    def min(self):
+        return None if self._min is None else self._min / 1e6
+
+    @property
+    def max(self):
+        return None if self._max is None else self._max / 1e6
+
+    @property
+    def mean(self):
+        return self._sum / 1e6 / self.count if self.count else None
+
+    def percentile(self, pct):
+        """ Highest value equivalent to the pct percentile one. """
+        if not self.count:
+            return None
+        target = max(1, int(round(pct / 100.0 * self.count)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._max, _lowest(index + 1) - 1) / 1e6
+        return self.max
+
+    def as_dict(self):
+        """ Summary in milliseconds. """
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+        return dict(count=self.count, min_ms=ms(self.min),
+                    mean_ms=ms(self.mean), max_ms=ms(self.max),
+                    p50_ms=ms(self.percentile(50)),
+                    p90_ms=ms(self.percentile(90)),
+                    p99_ms=ms(self.percentile(99)),
+                    p999_ms=ms(self.percentile(99.9)))
+
+
+class _PathStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.max_queue_depth = 0
+        self.histograms = dict((name, Histogram()) for name in DURATIONS)
+
+
+class Histograms(object):
+    """ Listener keeping, per (endpoint, path), call, error and byte
+    counts, and histograms of the total, serialize, network and
+    decode durations.
+
+    >>> histograms = Histograms()
+    >>> histograms(CallRecord('evaluator', 'metric', network=0.01))
+    >>> histograms.snapshot()[('evaluator', 'metric')]['calls']
+    1
+    """
+    def __init__(self):
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        key = (record.endpoint, record.path)
+        stats = self._paths.get(key)
+        if stats is None:
+            with self._lock:
+                stats = self._paths.setdefault(key, _PathStats())
+        histograms = stats.histograms
+        histograms['total'].record(record.total)
+        for name in DURATIONS[1:]:
+            duration = getattr(record, name)
+            if duration is not None:
+                histograms[name].record(duration)
+        with self._lock:
+            stats.calls += 1
+            stats.errors += record.error is not None
+            stats.bytes_sent += record.bytes_sent or 0
+            stats.bytes_received += record.bytes_received or 0
+            stats.max_queue_depth = max(stats.max_queue_depth,
+                                        record.queue_depth or 0)
+
+    def snapshot(self, reset=False):
+        """ (endpoint, path) => counters and HistogramSnapshot of each
+        duration, reset for interval statistics. """
+        with self._lock:
+            paths = list(self._paths.items())
+            if reset:
+                self._paths = {}
+        snapshot = {}
+        for key, stats in paths:
+            snapshot[key] = dict(
+                (name, histogram.snapshot())
+                for name, histogram in stats.histograms.items())
+            snapshot[key].update(calls=stats.calls, errors=stats.errors,
+                                 bytes_sent=stats.bytes_sent,
+                                 bytes_received=stats.bytes_received,
+                                 max_queue_depth=stats.max_queue_depth)
+        return snapshot
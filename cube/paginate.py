@@ -0,0 +1,97 @@
+# -*- encoding: utf-8 -*-
+import logging
+from datetime import datetime, timedelta
+
+from cube import time_utils
+
+log = logging.getLogger(__name__)
+
+# Max number of events asked per window
+LIMIT = 10000
+
+WINDOW = timedelta(hours=1)
+MIN_WINDOW = timedelta(seconds=1)
+MAX_WINDOW = timedelta(days=1)
+
+
+class _Inline(object):
+    """ Already computed stand-in for an AsyncResult. """
+    def __init__(self, func, args):
+        self.value = func(*args)
+
+    def get(self):
+        return self.value
+
+
+def paginate_events(cube, expression, start, stop=None, limit=LIMIT,
+                    window=WINDOW, min_window=MIN_WINDOW,
+                    max_window=MAX_WINDOW, prefetch=True, **kwargs):
+    """Iterate over all the events of [start, stop), in time order,
+    querying one time window at a time.
+
+    A window returning limit events may have been truncated by the
+    evaluator: it is halved and queried again (down to min_window).
+    A window returning less than a quarter of limit is doubled for the
+    next query (up to max_window). Events returned by two adjacent
+    windows, on their boundary, are only yielded once.
+
+    With prefetch, the next window is fetched in a background thread
+    while the current one is consumed.
+    """
+    start = time_utils.to_datetime(start)
+    stop = time_utils.to_datetime(stop or datetime.utcnow())
+
+    def fetch(w_start, w_end):
+        events = cube.event(expression, start=w_start, stop=w_end,
+                            limit=limit, **kwargs)
+        return sorted(events, key=lambda event: event.get('time'))
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(1) if prefetch else None
+
+    def submit(w_start, w_end):
+        if pool is None:
+            return _Inline(fetch, (w_start, w_end))
+        return pool.apply_async(fetch, (w_start, w_end))
+
+    try:
+        w_start = start
+        w_end = min(start + window, stop)
+        pending = submit(w_start, w_end)
+        boundary = []
+        while True:
+            events = pending.get()
+            if len(events) >= limit and w_end - w_start > min_window:
+                window = max(min_window, (w_end - w_start) // 2)
+                w_end = min(w_start + window, stop)
+                pending = submit(w_start, w_end)
+                continue
+
+            if len(events) >= limit:
+                log.warning("%d events or more between %s and %s, some are "
+                            "missing, lower min_window", limit, w_start,
+                            w_end)
+            elif len(events) < limit // 4:
+                window = min(max_window, window * 2)
+            if w_end < stop:
+                next_start, next_end = w_end, min(w_end + window, stop)
+                pending = submit(next_start, next_end)
+
+            seam = time_utils.format_iso(w_start)
+            next_boundary = []
+            end_seam = time_utils.format_iso(w_end)
+            for event in events:
+                if event.get('time') == seam and event in boundary:
+                    boundary.remove(event)
+                    continue
+                if event.get('time') == end_seam:
+                    next_boundary.append(event)
+                yield event
+
+            if w_end >= stop:
+                break
+            boundary = next_boundary
+            w_start, w_end = next_start, next_end
+    finally:
+        if pool is not None:
+            pool.terminate()
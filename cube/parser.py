@@ -0,0 +1,215 @@
+# -*- encoding: utf-8 -*-
+"""
+Parse Cube expression strings into expression objects.
+
+    >>> print(parse_metric('sum(request(elapsed_ms).eq(path, "/")) / 1000'))
+    (sum(request(elapsed_ms).eq(path, "/")) / 1000)
+
+Expressions are immutable, so the parses of repeated strings are cached
+and shared.
+"""
+import json
+import operator
+import re
+
+from cube.expression import CompoundMetricExpression, EventExpression
+from cube.expression import MetricExpression
+from cube.expression import Sum, Min, Max, Median, Distinct
+
+METRICS = {'sum': Sum, 'min': Min, 'max': Max, 'median': Median,
+           'distinct': Distinct}
+
+# Filter name => EventExpression method
+FILTERS = {'eq': 'eq', 'ne': 'ne', 'lt': 'lt', 'le': 'le', 'gt': 'gt',
+           'ge': 'ge', 're': 're', 'in': 'in_array'}
+
+OPERATORS = {'+': operator.add, '-': operator.sub, '*': operator.mul,
+             '/': operator.truediv}
+
+# Max number of cached parses
+CACHE_SIZE = 4096
+
+_NAME_RE = re.compile(r'\s*([A-Za-z_$][\w$]*)')
+_PROPERTY_RE = re.compile(r'\s*([A-Za-z_$][\w$]*(?:\.[A-Za-z_$][\w$]*|'
+                          r'\[\d+\])*)')
+_NUMBER_RE = re.compile(r'\s*(-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+_METRIC_RE = re.compile(r'\s*(?:\(|-?[\d.]|(?:{0})\s*\()'.format(
+    '|'.join(METRICS)))
+
+_METRIC_TYPES = (MetricExpression, CompoundMetricExpression)
+
+_decoder = json.JSONDecoder()
+_cache = {}
+
+
+class ParseError(ValueError):
+    """ The string is not a valid Cube expression. """
+    def __init__(self, message, text, pos):
+        super(ParseError, self).__init__("{0} at position {1}: {2!r}".format(
+            message, pos, text))
+        self.text = text
+        self.pos = pos
+
+
+class _Parser(object):
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+
+    def error(self, message):
+        raise ParseError(message, self.text, self.pos)
+
+    def peek(self):
+        text, pos = self.text, self.pos
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        self.pos = pos
+        return text[pos:pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            self.error("Expected {0!r}".format(char))
+        self.pos += 1
+
+    def match(self, regex, what):
+        m = regex.match(self.text, self.pos)
+        if m is None:
+            self.error("Expected {0}".format(what))
+        self.pos = m.end()
+        return m.group(1)
+
+    def end(self):
+        if self.peek():
+            self.error("Unexpected {0!r}".format(self.text[self.pos]))
+
+    def event(self):
+        expression = EventExpression(self.match(_NAME_RE, "an event type"),
+                                     self.properties())
+        while self.peek() == '.':
+            self.pos += 1
+            name = self.match(_NAME_RE, "a filter")
+            if name not in FILTERS:
+                self.error("Unknown filter {0!r}".format(name))
+            self.expect('(')
+            event_property = self.match(_PROPERTY_RE, "a property")
+            self.expect(',')
+            self.peek()
+            try:
+                value, self.pos = _decoder.raw_decode(self.text, self.pos)
+            except ValueError:
+                self.error("Expected a JSON value")
+            self.expect(')')
+            expression = getattr(expression, FILTERS[name])(event_property,
+                                                            value)
+        return expression
+
+    def properties(self):
+        if self.peek() != '(':
+            return []
+        self.pos += 1
+        properties = [self.match(_PROPERTY_RE, "a property")]
+        while self.peek() == ',':
+            self.pos += 1
+            properties.append(self.match(_PROPERTY_RE, "a property"))
+        self.expect(')')
+        return properties
+
+    def term(self):
+        char = self.peek()
+        if char == '(':
+            self.pos += 1
+            expression = self.compound()
+            self.expect(')')
+            return expression
+        if char == '-' or char == '.' or char.isdigit():
+            number = self.match(_NUMBER_RE, "a number")
+            if '.' in number or 'e' in number or 'E' in number:
+                return float(number)
+            return int(number)
+        name = self.match(_NAME_RE, "a metric")
+        if name not in METRICS:
+            self.error("Unknown metric {0!r}".format(name))
+        self.expect('(')
+        expression = METRICS[name](self.event())
+        self.expect(')')
+        return expression
+
+    def _binary(self, operand, operators):
+        left = operand()
+        op = self.peek()
+        while op and op in operators:
+            self.pos += 1
+            right = operand()
+            if isinstance(left, _METRIC_TYPES):
+                # Built like the operators do, to compare equal
+                left = OPERATORS[op](left, right)
+            else:
+                left = CompoundMetricExpression(left, op, right)
+            op = self.peek()
+        return left
+
+    def product(self):
+        return self._binary(self.term, '*/')
+
+    def compound(self):
+        return self._binary(self.product, '+-')
+
+
+def _cached(kind, parse, text):
+    key = (kind, text)
+    try:
+        return _cache[key]
+    except KeyError:
+        pass
+    parser = _Parser(text)
+    expression = parse(parser)
+    parser.end()
+    if len(_cache) >= CACHE_SIZE:
+        _cache.clear()
+    _cache[key] = expression
+    return expression
+
+
+def _has_metric(expression):
+    if isinstance(expression, CompoundMetricExpression):
+        return _has_metric(expression.metric1) or \
+            _has_metric(expression.metric2)
+    return isinstance(expression, MetricExpression)
+
+
+def _metric(parser):
+    expression = parser.compound()
+    if not _has_metric(expression):
+        parser.error("Expected a metric")
+    return expression
+
+
+def parse_event(text):
+    """Parse an event expression.
+
+    >>> parse_event('request(path).gt(elapsed_ms, 500)').filters
+    (<GT: .gt(elapsed_ms, 500)>,)
+    """
+    return _cached('event', lambda parser: parser.event(), text)
+
+
+def parse_metric(text):
+    """Parse a metric expression, or arithmetic over metrics
+    and numbers (a CompoundMetricExpression).
+
+    >>> parse_metric('sum(request)') == Sum(EventExpression('request'))
+    True
+    """
+    return _cached('metric', _metric, text)
+
+
+def parse(text):
+    """Parse a metric or an event expression, text is parsed as
+    a metric if it can be one.
+
+    >>> parse('request.eq(path, "/")')
+    <EventExpression: request.eq(path, "/")>
+    """
+    if _METRIC_RE.match(text):
+        return parse_metric(text)
+    return parse_event(text)
@@ -0,0 +1,120 @@
+# -*- encoding: utf-8 -*-
+"""
+Run many metric queries at once, as a dashboard does.
+
+Each query is canonicalized and split into its leaf metrics, each
+distinct (leaf, query parameters) fetch is done once, on a bounded
+thread pool, and compound queries are evaluated client-side.
+"""
+from collections import OrderedDict
+from datetime import datetime
+
+from cube import time_utils
+from cube.canonical import canonicalize
+from cube.evaluate import evaluate, leaves
+from cube.expression import CompoundMetricExpression
+from cube.result import MetricSeries
+from cube.split import PARALLELISM
+
+
+def _params_key(params):
+    key = []
+    for name, value in sorted(params.items()):
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif name == 'step':
+            value = time_utils.step_to_ms(value)
+        key.append((name, value))
+    return tuple(key)
+
+
+class QueryPlan(object):
+    """ The fetches needed by a list of metric queries.
+
+    A query is an expression (string or object), or a dict with an
+    expression key and metric query parameters overriding the defaults.
+
+    requested is the number of leaf fetches the queries need,
+    unique the number that will actually be done.
+    """
+    def __init__(self, fetch, queries, parallelism=PARALLELISM, **defaults):
+        self.fetch = fetch
+        self.parallelism = parallelism
+        self.requested = 0
+        # (str(leaf), params key) => (leaf, params)
+        self.fetches = OrderedDict()
+        self._queries = []
+        for query in queries:
+            if isinstance(query, dict):
+                params = dict(defaults, **query)
+                expression = params.pop('expression')
+            else:
+                params, expression = dict(defaults), query
+            self._add(expression, params)
+
+    def _add(self, expression, params):
+        columnar = params.pop('columnar', False)
+        params.pop('local', None)
+        try:
+            expression = canonicalize(expression)
+        except ValueError:
+            # Not an expression the parser knows, fetched as is
+            pass
+        if isinstance(expression, CompoundMetricExpression):
+            query_leaves = list(leaves(expression))
+        else:
+            query_leaves = [expression]
+
+        params_key = _params_key(params)
+        keys = []
+        for leaf in query_leaves:
+            key = (str(leaf), params_key)
+            self.fetches.setdefault(key, (leaf, params))
+            keys.append(key)
+        self.requested += len(keys)
+        step_ms = time_utils.step_to_ms(params['step']) \
+            if columnar and 'step' in params else None
+        self._queries.append((expression, keys, columnar, step_ms))
+
+    @property
+    def unique(self):
+        return len(self.fetches)
+
+    def __len__(self):
+        return len(self._queries)
+
+    def __repr__(self):
+        return "<QueryPlan: {0} queries, {1} fetches for {2} requested>" \
+            .format(len(self), self.unique, self.requested)
+
+    def _run(self, key):
+        leaf, params = self.fetches[key]
+        return self.fetch(leaf, **params)
+
+    def execute(self):
+        """ Do the fetches, and return the result of each query,
+        in order. """
+        keys = list(self.fetches)
+        if len(keys) < 2 or self.parallelism < 2:
+            values = [self._run(key) for key in keys]
+        else:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(self.parallelism, len(keys)))
+            try:
+                values = pool.map(self._run, keys)
+            finally:
+                pool.close()
+                pool.join()
+        results = dict(zip(keys, values))
+
+        output = []
+        for expression, query_keys, columnar, step_ms in self._queries:
+            if isinstance(expression, CompoundMetricExpression):
+                result = evaluate(expression, dict((key[0], results[key])
+                                                   for key in query_keys))
+            else:
+                result = results[query_keys[0]]
+            if columnar:
+                result = MetricSeries.from_buckets(result, step_ms)
+            output.append(result)
+        return output
@@ -0,0 +1,291 @@
+# -*- encoding: utf-8 -*-
+"""
+Reads spread over several evaluator replicas.
+
+Each call goes to the replica with the least outstanding requests
+(or the lowest EWMA latency), and is hedged: still pending past a
+percentile of the recent latencies, or failed, it's sent to a second
+replica too, and the first answer wins. Replicas failing eject_after
+times in a row are left out for eject_for seconds.
+"""
+import math
+import threading
+import time
+from collections import deque
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# Replica picking policies
+LEAST_OUTSTANDING = 'least_outstanding'
+EWMA = 'ewma'
+
+POLICY_CHOICES = (LEAST_OUTSTANDING, EWMA)
+
+# Weight of the latest latency in the EWMA
+EWMA_ALPHA = 0.2
+
+# Latencies kept per replica, for percentiles
+LATENCY_WINDOW = 256
+
+# Latencies needed before hedging on a percentile
+HEDGE_MIN_SAMPLES = 20
+
+
+def percentile(values, pct):
+    """ Nearest-rank percentile of sorted values.
+
+    >>> percentile([1, 2, 3, 4], 50), percentile([1, 2, 3, 4], 99)
+    (2, 4)
+    """
+    if not values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+class Replica(object):
+    """ A replica endpoint and its latency statistics, in seconds. """
+    def __init__(self, host, url, session):
+        self.host = host
+        self.url = url
+        self.session = session
+        self.requests = 0
+        self.errors = 0
+        self.outstanding = 0
+        self.picks = 0
+        self.ewma = None
+        self.failures = 0
+        self.ejected_until = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        # Request timeout and circuit breaker, set by the client
+        self.timeout = None
+        self.breaker = None
+
+    def __repr__(self):
+        return "<Replica: {0}>".format(self.host)
+
+    @property
+    def ejected(self):
+        return time.time() < self.ejected_until
+
+    @property
+    def stats(self):
+        latencies = sorted(self.latencies)
+
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+        return dict(requests=self.requests, errors=self.errors,
+                    outstanding=self.outstanding, ejected=self.ejected,
+                    ewma_ms=ms(self.ewma),
+                    p50_ms=ms(percentile(latencies, 50)),
+                    p90_ms=ms(percentile(latencies, 90)),
+                    p99_ms=ms(percentile(latencies, 99)))
+
+
+class _Race(object):
+    """ The attempts of a hedged call. """
+    def __init__(self):
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.hedged = False
+        self.done = False
+
+
+def _close(value):
+    close = getattr(value, 'close', None)
+    if close is not None:
+        close()
+
+
+class ReplicaSet(object):
+    """ Replicas of an endpoint, see the module docstring.
+
+    hedge_percentile (default 95) of the recent latencies of all the
+    replicas is how long a call waits before hedging, or hedge_delay
+    seconds if given; hedging is off when both are None.
+
+    is_failure tells the errors that count against a replica from
+    the ones the request itself is to blame for, which are raised
+    right away.
+    """
+    def __init__(self, replicas, policy=LEAST_OUTSTANDING,
+                 hedge_percentile=95, hedge_delay=None, eject_after=3,
+                 eject_for=10, is_failure=None):
+        if policy not in POLICY_CHOICES:
+            raise ValueError("{0} is not a valid replica policy. Valid "
+                             "choices are {1}".format(policy,
+                                                      POLICY_CHOICES))
+        if not replicas:
+            raise ValueError("No replicas")
+        self.replicas = list(replicas)
+        self.policy = policy
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.eject_after = eject_after
+        self.eject_for = eject_for
+        self.is_failure = is_failure or (lambda exc: True)
+
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+        self._lock = threading.Lock()
+        # (samples count it was computed at, delay)
+        self._hedge_cache = (0, None)
+        self._samples = 0
+
+    def __len__(self):
+        return len(self.replicas)
+
+    @property
+    def stats(self):
+        """ host => latency statistics of the replica. """
+        return dict((r.host, r.stats) for r in self.replicas)
+
+    def _score(self, replica):
+        if self.policy == EWMA:
+            # Unmeasured replicas first, then spread by load,
+            # ties go round robin
+            return ((replica.ewma or 0) * (replica.outstanding + 1),
+                    replica.picks)
+        return replica.outstanding, replica.picks
+
+    def choose(self, exclude=()):
+        """ The replica to send the next request to, ejected ones
+        only if they all are, None if they're all excluded. """
+        now = time.time()
+        with self._lock:
+            candidates = [r for r in self.replicas if r not in exclude]
+            healthy = [r for r in candidates if r.ejected_until <= now]
+            candidates = healthy or candidates
+            if not candidates:
+                return None
+            replica = min(candidates, key=self._score)
+            replica.picks += 1
+            return replica
+
+    def hedge_after(self):
+        """ Seconds to wait before hedging, None not to. """
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        if self.hedge_percentile is None:
+            return None
+        samples, delay = self._hedge_cache
+        if self._samples - samples >= HEDGE_MIN_SAMPLES or \
+                (delay is None and self._samples >= HEDGE_MIN_SAMPLES):
+            with self._lock:
+                samples = self._samples
+                latencies = sorted(l for r in self.replicas
+                                   for l in r.latencies)
+            delay = percentile(latencies, self.hedge_percentile)
+            self._hedge_cache = (samples, delay)
+        return delay
+
+    def _attempt(self, replica, func):
+        with self._lock:
+            replica.requests += 1
+            replica.outstanding += 1
+        start = time.time()
+        try:
+            value = func(replica)
+        except Exception as exc:
+            failed = self.is_failure(exc)
+            with self._lock:
+                replica.outstanding -= 1
+                if failed:
+                    replica.errors += 1
+                    replica.failures += 1
+                    if replica.failures >= self.eject_after:
+                        replica.ejected_until = time.time() + self.eject_for
+            raise
+        elapsed = time.time() - start
+        with self._lock:
+            replica.outstanding -= 1
+            replica.failures = 0
+            replica.latencies.append(elapsed)
+            replica.ewma = elapsed if replica.ewma is None else \
+                EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * replica.ewma
+            self._samples += 1
+        return value
+
+    def call(self, func, hedge=True):
+        """ Return func(replica), hedged unless hedge is False. """
+        with self._lock:
+            self.calls += 1
+        replica = self.choose()
+        delay = self.hedge_after() if hedge and len(self) > 1 else None
+        if delay is None:
+            return self._attempt(replica, func)
+
+        race = _Race()
+        race.pending = 1
+        self._start(race, replica, func)
+        timer = threading.Timer(delay, self._hedge, (race, func, replica))
+        timer.daemon = True
+        timer.start()
+        try:
+            while True:
+                winner, value, error = race.results.get()
+                with race.lock:
+                    race.pending -= 1
+                    if error is None or not self.is_failure(error):
+                        race.done = True
+                if error is None:
+                    if winner is not replica:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return value
+                if race.done:
+                    raise error
+                # Hedge right away, unless it's been done already
+                self._hedge(race, func, replica)
+                with race.lock:
+                    if not race.pending:
+                        race.done = True
+                        raise error
+        finally:
+            timer.cancel()
+            self._discard(race)
+
+    def _start(self, race, replica, func):
+        def target():
+            try:
+                result = (replica, self._attempt(replica, func), None)
+            except Exception as exc:
+                result = (replica, None, exc)
+            with race.lock:
+                if not race.done:
+                    race.results.put(result)
+                    return
+            _close(result[1])
+        thread = threading.Thread(target=target, name='cube-replica')
+        thread.daemon = True
+        thread.start()
+
+    def _hedge(self, race, func, first):
+        with race.lock:
+            if race.done or race.hedged:
+                return
+            race.hedged = True
+            other = self.choose(exclude=(first,))
+            if other is None:
+                return
+            race.pending += 1
+        with self._lock:
+            self.hedged += 1
+        self._start(race, other, func)
+
+    def _discard(self, race):
+        """ Close the answers that came too late. """
+        with race.lock:
+            race.done = True
+        while True:
+            try:
+                replica, value, error = race.results.get_nowait()
+            except queue.Empty:
+                return
+            _close(value)
@@ -0,0 +1,110 @@
+# -*- encoding: utf-8 -*-
+import math
+import re
+from array import array
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from cube import time_utils
+
+try:
+    array('q')
+    TIMES_TYPECODE = 'q'
+except ValueError:
+    # Python 2, long is 64 bits on the platforms Cube runs on
+    TIMES_TYPECODE = 'l'
+
+NAN = float('nan')
+
+# A metric bucket, as serialized by the evaluator
+_BUCKET_RE = re.compile(r'\{\s*"time"\s*:\s*"([^"]*)"\s*,\s*'
+                        r'"value"\s*:\s*(null|[-+0-9.eE]+)\s*\}')
+
+
+class MetricSeries(object):
+    """ Columnar metric result: bucket times as epoch milliseconds
+    in an int64 array, values in a float64 array (NaN for null).
+
+    Iterating yields the same dicts the evaluator returns, built on
+    the fly, so it can stand in for the list Cube.metric returns.
+    """
+    def __init__(self, times=(), values=()):
+        self.times = array(TIMES_TYPECODE, times)
+        self.values = array('d', values)
+        if len(self.times) != len(self.values):
+            raise ValueError("times and values must have the same length")
+
+    @classmethod
+    def from_buckets(cls, buckets, step=None):
+        """ Build from a list of dicts with time and value keys,
+        step (in ms) speeds up the times parsing. """
+        values = [bucket.get('value') for bucket in buckets]
+        return cls(time_utils.parse_times_ms([bucket['time']
+                                              for bucket in buckets], step),
+                   [NAN if value is None else value for value in values])
+
+    @classmethod
+    def from_json(cls, text, step=None):
+        """ Build from the evaluator JSON response, without decoding
+        it into per-bucket dicts. """
+        times, values = [], array('d')
+        for match in _BUCKET_RE.finditer(text):
+            t, value = match.groups()
+            times.append(t)
+            values.append(NAN if value == 'null' else float(value))
+        if len(times) != text.count('{'):
+            # Not the expected layout, take the slow path
+            return cls.from_buckets(json.loads(text), step)
+        series = cls()
+        series.times = array(TIMES_TYPECODE,
+                             time_utils.parse_times_ms(times, step))
+        series.values = values
+        return series
+
+    def __len__(self):
+        return len(self.times)
+
+    def _bucket(self, i):
+        value = self.values[i]
+        return dict(time=time_utils.format_iso(
+                    time_utils.from_epoch_ms(self.times[i])),
+                    value=None if math.isnan(value) else value)
+
+    def __iter__(self):
+        for i in range(len(self.times)):
+            yield self._bucket(i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return MetricSeries(self.times[index], self.values[index])
+        return self._bucket(index)
+
+    def __eq__(self, other):
+        return isinstance(other, MetricSeries) and \
+            self.times == other.times and \
+            all(a == b or (math.isnan(a) and math.isnan(b))
+                for a, b in zip(self.values, other.values))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "<MetricSeries: {0} buckets>".format(len(self))
+
+    def to_list(self):
+        """ The buckets as dicts, like Cube.metric returns. """
+        return list(self)
+
+    def items(self):
+        """ (epoch ms, value) pairs. """
+        return zip(self.times, self.values)
+
+    def to_numpy(self):
+        """ (times, values) as numpy int64/float64 arrays,
+        requires numpy. """
+        import numpy
+        return (numpy.frombuffer(self.times, dtype=numpy.int64).copy(),
+                numpy.frombuffer(self.values, dtype=numpy.float64).copy())
@@ -0,0 +1,78 @@
+# -*- encoding: utf-8 -*-
+"""
+Consistent hashing, to spread event types over several collectors.
+
+Each node is placed REPLICAS times on a ring of 32 bits hashes, a key
+goes to the first node point at or after its own hash. Adding or
+removing a node only moves the keys of the ring arcs it owns.
+
+    >>> ring = HashRing(['a:1080', 'b:1080'])
+    >>> ring.get('request') in ('a:1080', 'b:1080')
+    True
+    >>> ring.get('request') == HashRing(['b:1080', 'a:1080']).get('request')
+    True
+"""
+import bisect
+import hashlib
+
+# Points per node on the ring
+REPLICAS = 160
+
+
+def _hash(key):
+    if not isinstance(key, bytes):
+        key = key.encode('utf-8')
+    return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+
+class HashRing(object):
+    """ Nodes (strings) on a consistent hashing ring.
+
+    Lookups don't lock, add and remove build new point lists
+    and swap them in at once.
+    """
+    def __init__(self, nodes=(), replicas=REPLICAS):
+        self.replicas = replicas
+        self._nodes = ()
+        # (sorted hashes, node of each hash)
+        self._points = ((), ())
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self):
+        return list(self._nodes)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, node):
+        return node in self._nodes
+
+    def __repr__(self):
+        return "<HashRing: {0}>".format(", ".join(self._nodes))
+
+    def _build(self, nodes):
+        points = sorted((_hash("{0}-{1}".format(node, i)), node)
+                        for node in nodes for i in range(self.replicas))
+        self._points = (tuple(h for h, _ in points),
+                        tuple(node for _, node in points))
+        self._nodes = tuple(nodes)
+
+    def add(self, node):
+        if node in self._nodes:
+            raise ValueError("{0!r} is already on the ring".format(node))
+        self._build(self._nodes + (node,))
+
+    def remove(self, node):
+        if node not in self._nodes:
+            raise ValueError("{0!r} isn't on the ring".format(node))
+        self._build(tuple(n for n in self._nodes if n != node))
+
+    def get(self, key):
+        """ The node key maps to. """
+        hashes, nodes = self._points
+        if not hashes:
+            raise LookupError("Empty ring")
+        i = bisect.bisect_left(hashes, _hash(key))
+        return nodes[i % len(nodes)]
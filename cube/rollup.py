@@ -0,0 +1,158 @@
+# -*- encoding: utf-8 -*-
+"""
+Derive coarser metric resolutions from a single fine-grained fetch.
+
+sum, min and max compose exactly: the sum of the 10-second sums over
+a minute is the 1-minute sum. median and distinct don't, they can only
+be approximated (median of the medians, and the largest distinct count,
+a lower bound), and are rejected unless approximate=True.
+"""
+import math
+from itertools import groupby
+
+from cube import time_utils
+from cube.expression import MetricExpression
+from cube.parser import ParseError, parse_metric
+from cube.result import MetricSeries, NAN
+
+EXACT = ('sum', 'min', 'max')
+APPROXIMATE = ('median', 'distinct')
+
+# Imported on first use, None if it isn't installed
+numpy = False
+
+
+class NotComposable(ValueError):
+    """ The metric can't be exactly rolled up. """
+
+
+def metric_type(expression):
+    """Return the metric type (sum, min...) of an expression.
+
+    >>> metric_type('sum(request(elapsed_ms))')
+    'sum'
+    """
+    if not isinstance(expression, MetricExpression):
+        try:
+            expression = parse_metric(str(expression))
+        except ParseError:
+            raise NotComposable("{0} is not a metric expression".format(
+                expression))
+    if not isinstance(expression, MetricExpression):
+        # Summing ratios of sums doesn't give the coarser ratio
+        raise NotComposable("{0} is a compound expression".format(
+            expression))
+    return expression.metric_type
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+_REDUCERS = {'sum': sum, 'min': min, 'max': max,
+             'median': _median, 'distinct': max}
+
+_NUMPY_REDUCERS = {'sum': 'add', 'min': 'fmin', 'max': 'fmax',
+                   'distinct': 'fmax'}
+
+
+def _numpy():
+    global numpy
+    if numpy is False:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+    return numpy
+
+
+def _check(kind, approximate):
+    if kind in EXACT:
+        return
+    if kind in APPROXIMATE:
+        if approximate:
+            return
+        raise NotComposable("{0} metrics can't be rolled up exactly, pass "
+                            "approximate=True".format(kind))
+    raise NotComposable("Unknown metric type {0}".format(kind))
+
+
+def rollup(series, step, to_step, kind, approximate=False,
+           drop_partial=False):
+    """Roll up a MetricSeries at step (in ms) to the coarser to_step.
+
+    kind is the metric type, null buckets are ignored, a coarse bucket
+    with only null buckets is null. With drop_partial, coarse buckets
+    not fully covered by the series are dropped.
+    """
+    _check(kind, approximate)
+    step = time_utils.step_to_ms(step)
+    to_step = time_utils.step_to_ms(to_step)
+    if to_step % step:
+        raise ValueError("{0} is not a multiple of {1}".format(to_step, step))
+    if to_step == step or not len(series):
+        return MetricSeries(series.times, series.values)
+
+    if kind in _NUMPY_REDUCERS and _numpy() is not None:
+        times, values = series.to_numpy()
+        groups = times - times % to_step
+        starts = numpy.flatnonzero(numpy.r_[True, groups[1:] != groups[:-1]])
+        counts = numpy.diff(numpy.r_[starts, len(times)])
+        if kind == 'sum':
+            valid = ~numpy.isnan(values)
+            reduced = numpy.add.reduceat(numpy.where(valid, values, 0),
+                                         starts)
+            reduced[numpy.add.reduceat(valid, starts) == 0] = NAN
+        else:
+            reduced = getattr(numpy, _NUMPY_REDUCERS[kind]).reduceat(values,
+                                                                 starts)
+        result = MetricSeries(groups[starts].tolist(), reduced.tolist())
+        counts = counts.tolist()
+    else:
+        reduce = _REDUCERS[kind]
+        result, counts = MetricSeries(), []
+        for group, buckets in groupby(series.items(),
+                                      key=lambda b: b[0] - b[0] % to_step):
+            buckets = list(buckets)
+            values = [v for t, v in buckets if not math.isnan(v)]
+            result.times.append(group)
+            result.values.append(reduce(values) if values else NAN)
+            counts.append(len(buckets))
+
+    if drop_partial:
+        full = to_step // step
+        keep = [i for i, count in enumerate(counts) if count == full]
+        result = MetricSeries([result.times[i] for i in keep],
+                              [result.values[i] for i in keep])
+    return result
+
+
+def multi_resolution(cube, expression, steps, approximate=False, **kwargs):
+    """Fetch expression once at the finest of steps, and roll it up
+    to the others. Returns a dict step => MetricSeries.
+
+    start is floored to the coarsest step so its first bucket is complete,
+    coarse buckets cut short by stop are dropped.
+    """
+    kind = metric_type(expression)
+    _check(kind, approximate)
+    by_ms = dict((time_utils.step_to_ms(step), step) for step in steps)
+    finest, coarsest = min(by_ms), max(by_ms)
+    for step_ms in by_ms:
+        if step_ms % finest:
+            raise ValueError("{0} is not a multiple of {1}".format(step_ms,
+                                                                   finest))
+    if 'start' in kwargs:
+        kwargs['start'] = time_utils.floor(
+            time_utils.to_datetime(kwargs['start']), coarsest)
+
+    series = cube.metric(expression, step=by_ms[finest], columnar=True,
+                         **kwargs)
+    return dict((step, rollup(series, finest, step_ms, kind, approximate,
+                              drop_partial=True))
+                for step_ms, step in by_ms.items())
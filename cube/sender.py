@@ -0,0 +1,270 @@
+# -*- encoding: utf-8 -*-
+import logging
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from cube.batch import MAX_BATCH_EVENTS, MAX_BATCH_BYTES
+from cube.encoding import dumps
+
+log = logging.getLogger(__name__)
+
+# Overflow policies
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+OVERFLOW_CHOICES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+# Returned by post when the events were spooled on disk instead of sent
+SPOOLED = 'spooled'
+
+
+class EventDropped(Exception):
+    """ The event was dropped because the queue was full. """
+
+
+class SenderClosed(Exception):
+    """ The sender has been closed. """
+
+
+class PutFuture(object):
+    """ Result of an asynchronous put, resolved once
+    the event has been sent, spooled (or dropped). """
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+        self._spooled = False
+
+    def set_result(self, result, spooled=False):
+        self._result = result
+        self._spooled = spooled
+        self._done.set()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError("Timed out waiting for the event to be sent")
+        return self._exception
+
+    def result(self, timeout=None):
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self._result
+
+    def spooled(self, timeout=None):
+        """ True if the event was spooled on disk, to be sent once
+        the collector is back, rather than sent. """
+        self.result(timeout)
+        return self._spooled
+
+
+class BackgroundSender(object):
+    """ Drain events put in a bounded queue into batched collector POSTs,
+    from a background thread.
+
+    A batch is sent as soon as it holds max_events events or max_bytes
+    bytes, or when its oldest event has waited linger seconds.
+    """
+    def __init__(self, post, queue_size=10000, max_events=MAX_BATCH_EVENTS,
+                 max_bytes=MAX_BATCH_BYTES, linger=0.5, overflow=BLOCK,
+                 block_timeout=None):
+        """
+        :param post: Called with a JSON array body and its number of
+            events, must raise on failure, and return SPOOLED if the
+            events were spooled instead of sent.
+        :param queue_size: Max number of events waiting in the queue.
+        :param linger: Max time in seconds an event waits before being sent.
+        :param overflow: What to do with a put on a full queue:
+            block, drop_oldest or drop_newest.
+        :param block_timeout: With the block policy, drop the new event
+            after waiting that many seconds (wait forever if None).
+        """
+        if overflow not in OVERFLOW_CHOICES:
+            raise ValueError("{0} is not a valid overflow policy. Valid "
+                             "choices are {1}".format(overflow,
+                                                      OVERFLOW_CHOICES))
+        self.post = post
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.linger = linger
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+
+        self.sent = 0
+        self.spooled = 0
+        self.failed = 0
+        self.dropped = 0
+        self.batches = 0
+
+        self._queue = queue.Queue(queue_size)
+        self._cond = threading.Condition()
+        self._enqueued = 0
+        self._processed = 0
+        self._flush_requested = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run,
+                                        name='cube-sender')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def put(self, event, future=None):
+        """ Enqueue an event, never blocks unless the overflow
+        policy is block and the queue is full. """
+        if self._closed:
+            raise SenderClosed("Can't put events on a closed sender")
+        item = (event, future)
+        with self._cond:
+            self._enqueued += 1
+        if self.overflow == BLOCK:
+            try:
+                self._queue.put(item, timeout=self.block_timeout)
+            except queue.Full:
+                self._drop(item)
+            return future
+
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return future
+            except queue.Full:
+                if self.overflow == DROP_NEWEST:
+                    self._drop(item)
+                    return future
+                try:
+                    self._drop(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+
+    def _drop(self, item):
+        event, future = item
+        if future is not None:
+            future.set_exception(EventDropped("Queue full"))
+        with self._cond:
+            self.dropped += 1
+            self._processed += 1
+            self._cond.notify_all()
+
+    def _fail(self, item, exc):
+        log.warning("Failed to encode event: %s", exc)
+        event, future = item
+        if future is not None:
+            future.set_exception(exc)
+        with self._cond:
+            self.failed += 1
+            self._processed += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """ Send everything enqueued so far, returns False
+        if it's not done after timeout seconds. """
+        deadline = timeout is not None and time.time() + timeout
+        with self._cond:
+            target = self._enqueued
+            self._flush_requested = True
+            while self._processed < target:
+                remaining = None
+                if deadline:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """ Flush the queue and stop the background thread. """
+        if self._closed:
+            return True
+        flushed = self.flush(timeout)
+        self._closed = True
+        self._thread.join(timeout)
+        return flushed
+
+    def _run(self):
+        pending, encoded, size = [], [], 2
+        first_at = None
+        while not (self._closed and not pending and self._queue.empty()):
+            # Wake up regularly to honor flush requests
+            wait = 0.05
+            if pending:
+                wait = min(wait, max(0, first_at + self.linger - time.time()))
+            try:
+                item = self._queue.get(timeout=wait) if wait else \
+                    self._queue.get_nowait()
+            except queue.Empty:
+                item = None
+
+            if item is not None:
+                try:
+                    data = dumps(item[0])
+                except Exception as exc:
+                    # A poison event fails alone, the thread keeps going
+                    self._fail(item, exc)
+                    item = None
+            if item is not None:
+                if pending and size + 1 + len(data) > self.max_bytes:
+                    self._send(pending, b"[" + b",".join(encoded) + b"]")
+                    pending, encoded, size = [], [], 2
+                if pending:
+                    size += 1
+                else:
+                    first_at = time.time()
+                pending.append(item)
+                encoded.append(data)
+                size += len(data)
+
+            if not pending:
+                continue
+            with self._cond:
+                flush_requested = self._flush_requested and \
+                    self._queue.empty()
+                if flush_requested:
+                    self._flush_requested = False
+            if (len(pending) >= self.max_events or size >= self.max_bytes or
+                    time.time() - first_at >= self.linger or
+                    flush_requested or self._closed):
+                self._send(pending, b"[" + b",".join(encoded) + b"]")
+                pending, encoded, size = [], [], 2
+
+    def _send(self, items, data):
+        spooled = False
+        try:
+            spooled = self.post(data, len(items)) == SPOOLED
+        except Exception as exc:
+            log.warning("Failed to send %d events: %s", len(items), exc)
+            error = exc
+        else:
+            error = None
+        for event, future in items:
+            if future is None:
+                continue
+            if error is None:
+                future.set_result([event], spooled)
+            else:
+                future.set_exception(error)
+        with self._cond:
+            self.batches += 1
+            if error is not None:
+                self.failed += len(items)
+            elif spooled:
+                self.spooled += len(items)
+            else:
+                self.sent += len(items)
+            self._processed += len(items)
+            self._cond.notify_all()
@@ -0,0 +1,91 @@
+# -*- encoding: utf-8 -*-
+import copy
+import threading
+
+# Shared by the Cube instances created with coalesce='process'
+PROCESS = None
+_process_lock = threading.Lock()
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """ Coalesce concurrent calls sharing a key: the first one runs,
+    the others wait for it and get the same result (or exception).
+
+    When calls were coalesced, each caller gets its own copy(result),
+    so they can mutate it, pass copy=None to share the result object.
+
+    >>> flight = SingleFlight()
+    >>> flight.do('key', lambda: 42)
+    42
+    >>> flight.executed, flight.coalesced
+    (1, 0)
+    """
+    def __init__(self, copy=copy.deepcopy):
+        self.copy = copy
+        self.calls = 0
+        self.executed = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self):
+        return len(self._calls)
+
+    @property
+    def stats(self):
+        return dict(calls=self.calls, executed=self.executed,
+                    coalesced=self.coalesced, in_flight=self.in_flight)
+
+    def do(self, key, func):
+        """ Return func(), or the result of the in-flight call
+        with the same key. """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return self._copy(call.result)
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                waiters = call.waiters
+            call.done.set()
+        # Nobody else got it, no need to copy
+        return self._copy(call.result) if waiters else call.result
+
+    def _copy(self, result):
+        return result if self.copy is None else self.copy(result)
+
+
+def process_singleflight():
+    """ The SingleFlight shared process-wide. """
+    global PROCESS
+    with _process_lock:
+        if PROCESS is None:
+            PROCESS = SingleFlight()
+    return PROCESS
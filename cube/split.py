@@ -0,0 +1,97 @@
+# -*- encoding: utf-8 -*-
+from datetime import timedelta
+
+from cube import time_utils
+
+# Default number of sub-ranges fetched concurrently
+PARALLELISM = 4
+
+
+def split_range(start, stop, size, step=None):
+    """Cut [start, stop) into consecutive sub-ranges of at most size.
+
+    With a step (in ms), boundaries are aligned on it, and size rounded
+    down to a multiple of it (but at least one step).
+
+    >>> from datetime import datetime
+    >>> for r in split_range(datetime(2013, 10, 1, 0, 0, 15),
+    ...                      datetime(2013, 10, 1, 0, 3), timedelta(minutes=1),
+    ...                      time_utils.STEP_1_MIN):
+    ...     print("{0} {1}".format(*r))
+    2013-10-01 00:00:00 2013-10-01 00:01:00
+    2013-10-01 00:01:00 2013-10-01 00:02:00
+    2013-10-01 00:02:00 2013-10-01 00:03:00
+    """
+    if step is not None:
+        start = time_utils.floor(start, step)
+        size_ms = time_utils._timedelta_total_seconds(size) * 1000
+        size = timedelta(milliseconds=max(step, size_ms - size_ms % step))
+    if size <= timedelta(0):
+        raise ValueError("The sub-range size must be positive")
+    while start < stop:
+        end = min(start + size, stop)
+        yield start, end
+        start = end
+
+
+def merge(results, seams):
+    """Concatenate sub-range results sorted by time, dropping the items
+    returned twice by two adjacent sub-ranges.
+
+    results is a list of lists of dicts with a time key, in range order,
+    seams the ISO strings of the boundaries between sub-ranges.
+
+    >>> merge([[{'time': 'b'}, {'time': 'a'}], [{'time': 'b'}]], set('b'))
+    [{'time': 'a'}, {'time': 'b'}]
+    """
+    merged, on_seams = [], []
+    for items in results:
+        # Only items on a seam, returned by a previous sub-range,
+        # can be duplicates
+        previous, on_seams = on_seams, []
+        for item in sorted(items, key=lambda item: item.get('time')):
+            if item.get('time') in seams:
+                if item in previous:
+                    previous.remove(item)
+                    continue
+                on_seams.append(item)
+            merged.append(item)
+    return merged
+
+
+def _fetch_all(fetch, ranges, parallelism):
+    if len(ranges) < 2 or parallelism < 2:
+        return [fetch(*r) for r in ranges]
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(parallelism, len(ranges)))
+    try:
+        return pool.map(lambda r: fetch(*r), ranges)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def fetch_ranges(fetch, start, stop, size, step=None,
+                 parallelism=PARALLELISM, limit=None):
+    """Call fetch(start, stop) for each sub-range of [start, stop),
+    using up to parallelism threads, and merge the results.
+
+    With a limit, only the latest limit items are kept, like the
+    evaluator does: sub-ranges are fetched from the most recent one,
+    and older ones aren't fetched once limit items were gathered.
+    """
+    ranges = list(split_range(start, stop, size, step))
+    seams = set(time_utils.format_iso(r_start) for r_start, r_stop
+                in ranges[1:])
+    if limit is None:
+        return merge(_fetch_all(fetch, ranges, parallelism), seams)
+
+    results = []
+    wave = max(1, parallelism)
+    while ranges:
+        ranges, latest = ranges[:-wave], ranges[-wave:]
+        results = _fetch_all(fetch, latest, parallelism) + results
+        merged = merge(results, seams)
+        if len(merged) >= limit:
+            break
+    return merged[-limit:] if limit > 0 else []
@@ -0,0 +1,272 @@
+# -*- encoding: utf-8 -*-
+"""
+Append-only, segment-rotated on-disk log of collector payloads.
+
+Each segment is a preallocated file written through mmap, holding records:
+
+    length (uint32) | crc32 (uint32) | events count (uint32) | JSON array
+
+A zero length marks the end of the written part of a segment. The replay
+position is kept in a cursor file, replaced atomically.
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+log = logging.getLogger(__name__)
+
+SEGMENT_SIZE = 16 * 1024 * 1024
+MAX_BYTES = 256 * 1024 * 1024
+
+# Eviction policies, applied when the spool is full
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+_HEADER = struct.Struct('<III')
+_SUFFIX = '.seg'
+
+
+def _crc(data):
+    return zlib.crc32(data) & 0xffffffff
+
+
+class Spool(object):
+    """ Durable buffer for events the collector couldn't take.
+
+    Appends are a memcpy into the current mmap'd segment, full segments
+    are rotated, and when the spool holds more than max_bytes the oldest
+    segment is evicted (drop_oldest) or new payloads are refused
+    (drop_newest). Torn or corrupted records, left by a crash, are
+    detected on open and everything after them is discarded.
+    """
+    def __init__(self, directory, segment_size=SEGMENT_SIZE,
+                 max_bytes=MAX_BYTES, eviction=DROP_OLDEST, sync=False):
+        """
+        :param directory: Where segments are stored, created if needed.
+        :param segment_size: Size of a segment file, in bytes.
+        :param max_bytes: Max total size of the segments, in bytes.
+        :param eviction: drop_oldest or drop_newest.
+        :param sync: msync the segment after each append, survive
+            OS crashes at the cost of latency (default False, only
+            survive process crashes).
+        """
+        if eviction not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError("{0} is not a valid eviction policy".format(
+                eviction))
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.eviction = eviction
+        self.sync = sync
+
+        self.appended = 0
+        self.replayed = 0
+        self.dropped = 0
+
+        self._lock = threading.RLock()
+        self._replay_lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._recover()
+
+    def _path(self, seq):
+        return os.path.join(self.directory, '{0:020d}{1}'.format(seq,
+                                                                 _SUFFIX))
+
+    def _segments(self):
+        return sorted(int(name[:-len(_SUFFIX)])
+                      for name in os.listdir(self.directory)
+                      if name.endswith(_SUFFIX))
+
+    def _recover(self):
+        segments = self._segments()
+        self._read_seq, self._read_offset = self._load_cursor()
+        if not segments:
+            self._open_segment(self._read_seq or 0)
+            self._read_seq, self._read_offset = self._seq, 0
+            return
+
+        if self._read_seq not in segments:
+            self._read_seq, self._read_offset = segments[0], 0
+
+        # Only the last segment can hold a torn write
+        self._seq = segments[-1]
+        self._file = open(self._path(self._seq), 'r+b')
+        self._size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), self._size)
+        for record in self._scan(self._mmap, 0, self._size):
+            pass
+        end = self._end
+        if end < self._size:
+            # Zero what's after the last valid record
+            self._mmap[end:self._size] = b'\0' * (self._size - end)
+        self._offset = end
+        if self._read_seq == self._seq and self._read_offset > end:
+            self._read_offset = end
+
+    def _scan(self, buf, offset, end):
+        """ Yield (next offset, count, payload) for the valid records
+        between offset and end, set self._end to the end of the last one. """
+        while offset + _HEADER.size <= end:
+            length, crc, count = _HEADER.unpack_from(buf, offset)
+            start = offset + _HEADER.size
+            if not length or start + length > end:
+                break
+            payload = buf[start:start + length]
+            if _crc(payload) != crc:
+                log.warning("Corrupted spool record at %s:%d",
+                            self.directory, offset)
+                break
+            offset = start + length
+            yield offset, count, payload
+        self._end = offset
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, 'cursor')) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (IOError, OSError, ValueError):
+            return None, 0
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, 'cursor')
+        with open(path + '.tmp', 'w') as f:
+            f.write('{0} {1}'.format(self._read_seq, self._read_offset))
+        os.rename(path + '.tmp', path)
+
+    def _open_segment(self, seq, size=None):
+        self._seq = seq
+        self._size = max(size or 0, self.segment_size)
+        self._file = open(self._path(seq), 'w+b')
+        self._file.truncate(self._size)
+        self._mmap = mmap.mmap(self._file.fileno(), self._size)
+        self._offset = 0
+
+    def _close_segment(self):
+        self._mmap.flush()
+        self._mmap.close()
+        self._file.close()
+
+    @property
+    def size(self):
+        """ Total size of the segments, in bytes. """
+        return sum(os.path.getsize(self._path(seq))
+                   for seq in self._segments())
+
+    @property
+    def pending(self):
+        """ True if there's something left to replay. """
+        with self._lock:
+            return (self._read_seq, self._read_offset) != \
+                (self._seq, self._offset)
+
+    def append(self, data, count=1):
+        """ Append a JSON array of count events, returns False if
+        it was refused because the spool is full. """
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        record = _HEADER.pack(len(data), _crc(data), count) + data
+        with self._lock:
+            if self._offset + len(record) > self._size:
+                while self.size + max(len(record), self.segment_size) > \
+                        self.max_bytes:
+                    if not self._evict():
+                        self.dropped += count
+                        return False
+                self._close_segment()
+                self._open_segment(self._seq + 1, len(record))
+            self._mmap[self._offset:self._offset + len(record)] = record
+            self._offset += len(record)
+            if self.sync:
+                self._mmap.flush()
+            self.appended += count
+        return True
+
+    def _evict(self):
+        if self.eviction == DROP_NEWEST:
+            return False
+        segments = self._segments()
+        if len(segments) < 2:
+            return False
+        oldest = segments[0]
+        log.warning("Spool full, evicting segment %d", oldest)
+        for record in self._records(oldest, 0):
+            self.dropped += record[2]
+        os.remove(self._path(oldest))
+        if self._read_seq <= oldest:
+            self._read_seq, self._read_offset = segments[1], 0
+            self._save_cursor()
+        return True
+
+    def _records(self, seq, offset):
+        """ Yield (seq, next offset, count, payload)
+        from the given position. """
+        if seq == self._seq:
+            for record in self._scan(self._mmap, offset, self._offset):
+                yield (seq,) + record
+            return
+        with open(self._path(seq), 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for record in self._scan(buf, offset, len(buf)):
+                    yield (seq,) + record
+            finally:
+                buf.close()
+
+    def _next_batch(self, max_events):
+        batch, count, position = [], 0, None
+        for segment in [s for s in self._segments() if s >= self._read_seq]:
+            offset = self._read_offset if segment == self._read_seq else 0
+            for position in self._records(segment, offset):
+                batch.append(position[3])
+                count += position[2]
+                if count >= max_events:
+                    return batch, count, position
+        return batch, count, position
+
+    def replay(self, send, max_events=500):
+        """ Send the spooled events in batches of about max_events.
+
+        send is called with a JSON array body and must raise on failure,
+        replay then stops and resumes from there on the next call.
+        Appends are not blocked while send runs.
+        Returns the number of events replayed.
+        """
+        replayed = 0
+        with self._replay_lock:
+            while True:
+                with self._lock:
+                    cursor = (self._read_seq, self._read_offset)
+                    batch, count, position = self._next_batch(max_events)
+                if not batch:
+                    break
+                body = b'[' + b','.join(p.strip()[1:-1] for p in batch
+                                        if p.strip() != b'[]') + b']'
+                send(body)
+                with self._lock:
+                    # Unless an eviction moved the cursor in the meantime
+                    if cursor == (self._read_seq, self._read_offset):
+                        self._advance(position[0], position[1])
+                replayed += count
+        self.replayed += replayed
+        return replayed
+
+    def _advance(self, seq, offset):
+        for segment in self._segments():
+            if segment < seq:
+                os.remove(self._path(segment))
+        if seq == self._seq and offset == self._offset:
+            # Everything has been replayed, reuse the segment from start
+            self._mmap[:self._offset] = b'\0' * self._offset
+            self._offset = offset = 0
+        self._read_seq, self._read_offset = seq, offset
+        self._save_cursor()
+
+    def close(self):
+        with self._lock:
+            self._save_cursor()
+            self._close_segment()
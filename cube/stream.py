@@ -0,0 +1,72 @@
+# -*- encoding: utf-8 -*-
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+# Drop the consumed part of the buffer once it's that large
+_COMPACT_SIZE = 64 * 1024
+
+
+def iter_json_array(chunks):
+    """Incrementally decode a JSON array received in chunks,
+    yielding its items as soon as they are complete.
+
+    >>> list(iter_json_array(['[{"a": ', '1}, {"b"', ': 2}', ']']))
+    [{u'a': 1}, {u'b': 2}]
+    """
+    decode = codecs.getincrementaldecoder('utf-8')().decode
+    buf, pos = u'', 0
+    started = done = False
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decode(chunk)
+        if pos > _COMPACT_SIZE:
+            buf, pos = buf[pos:], 0
+        buf += chunk
+        while not done:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos == len(buf):
+                break
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                done = True
+                break
+            if buf[pos] == ',':
+                pos += 1
+                continue
+            try:
+                item, end = _decoder.raw_decode(buf, pos)
+            except ValueError:
+                # Incomplete item, wait for more data
+                break
+            if end == len(buf) and buf[end - 1] not in '}]"':
+                # A number may be cut in the middle
+                break
+            pos = end
+            yield item
+    if not done:
+        raise ValueError("Truncated JSON array")
+
+
+def iter_chunks(items, size):
+    """Group items into lists of at most size items.
+
+    >>> list(iter_chunks(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
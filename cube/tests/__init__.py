@@ -2,9 +2,77 @@
 
 import unittest
 import logging
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
 
 logging.basicConfig(level=logging.DEBUG)
 
 
 class CubeTestCase(unittest.TestCase):
     pass
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write, flushed by handle_one_request,
+    # instead of small writes delayed by Nagle's algorithm
+    wbufsize = -1
+
+    def _handle(self):
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length) if length else b''
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path,
+                                    dict(self.headers.items()), body))
+            server.clients.add(self.client_address)
+            responder = server.responder
+        status, payload = responder(self.command, self.path, body)
+        if not isinstance(payload, bytes):
+            payload = payload.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        if self.close_connection:
+            # tell the client, so it does not reuse the socket we close
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """ Local stand-in for a Cube collector/evaluator.
+
+    responder is called with (method, path, body) and must return a
+    (status, body) tuple, requests are recorded in self.requests
+    and client addresses in self.clients. """
+    daemon_threads = True
+
+    def __init__(self, responder=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.clients = set()
+        self.responder = responder or (lambda method, path, body:
+                                       (200, '{}'))
+        self.port = self.server_address[1]
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       kwargs={'poll_interval': 0.01})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,70 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import sys
+import unittest
+from datetime import datetime
+
+try:
+    import asyncio
+    import aiohttp
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    aiohttp = None
+
+from cube.tests import StubServer
+
+
+@unittest.skipIf(sys.version_info < (3, 5) or aiohttp is None,
+                 "requires Python 3.5+ and aiohttp")
+class TestAsyncCube(unittest.TestCase):
+    def setUp(self):
+        from cube.aio import AsyncCube
+        self.server = StubServer(lambda method, path, body: (200, '[]'))
+        self.cube = AsyncCube('127.0.0.1', collector_port=self.server.port,
+                              evaluator_port=self.server.port)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.cube.close())
+        self.loop.close()
+        self.server.stop()
+
+    def run_until_complete(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_put(self):
+        event = self.run_until_complete(self.cube.put('test', {'i': 1}))
+        self.assertEqual(event[0]['type'], 'test')
+        sent = json.loads(self.server.requests[0][3].decode('utf-8'))
+        self.assertEqual(sent[0]['data'], {'i': 1})
+
+    def test_concurrent_metrics(self):
+        start = datetime(2013, 10, 1)
+        coros = [self.cube.metric('sum(test)', step='1e4', start=start,
+                                  limit=10)
+                 for i in range(20)]
+        results = self.run_until_complete(asyncio.gather(*coros))
+        self.assertEqual(results, [[]] * 20)
+        self.assertEqual(len(self.server.requests), 20)
+        params = parse_qs(urlparse(self.server.requests[0][1]).query)
+        self.assertEqual(params['start'], ['2013-10-01T00:00:00'])
+        self.assertEqual(params['limit'], ['10'])
+        self.assertTrue(len(self.server.clients) <= 10)
+
+    def test_event_helper(self):
+        event = self.cube.get_event('test')
+        self.assertEqual(self.run_until_complete(event.event()), [])
+        self.assertTrue('expression=test' in self.server.requests[0][1])
+        self.assertEqual(self.run_until_complete(self.cube.types()), [])
+
+
+@unittest.skipIf(sys.version_info < (3, 5), "requires Python 3.5+")
+class TestImport(unittest.TestCase):
+    def test_import(self):
+        # Doesn't need aiohttp until an AsyncCube is built
+        import cube
+        import cube.aio
+        self.assertEqual(cube.aio.API_VERSION, cube.API_VERSION)
+        self.assertEqual(cube.time_utils.step_to_ms('1e4'), 10000)
@@ -0,0 +1,92 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import unittest
+
+from cube import Cube
+from cube import batch
+from cube.batch import chunk_events
+from cube.tests import StubServer
+
+
+class TestChunkEvents(unittest.TestCase):
+    def test_max_events(self):
+        events = [{'type': 'test', 'data': {'i': i}} for i in range(7)]
+        chunks = list(chunk_events(events, max_events=3))
+        self.assertEqual([len(c) for c, body in chunks], [3, 3, 1])
+        for chunk, body in chunks:
+            self.assertEqual(json.loads(body), chunk)
+
+    def test_max_bytes(self):
+        events = [{'type': 'test', 'data': {'i': i}} for i in range(10)]
+        size = len(json.dumps(events[0]))
+        chunks = list(chunk_events(events, max_bytes=2 + 3 * size + 2))
+        self.assertEqual([len(c) for c, body in chunks], [3, 3, 3, 1])
+        for chunk, body in chunks:
+            self.assertTrue(len(body) <= 2 + 3 * size + 2)
+
+    def test_oversized_event(self):
+        events = [{'type': 'test', 'data': {'v': 'x' * 100}},
+                  {'type': 'test'}]
+        chunks = list(chunk_events(events, max_bytes=50))
+        self.assertEqual([len(c) for c, body in chunks], [1, 1])
+
+    def test_encoded_at_most_twice(self):
+        # Like UDPSender.send, one big chunk cut into datagrams
+        events = [{'type': 'test', 'data': {'i': i}} for i in range(2000)]
+        encoded = []
+        dumps, encode_events = batch.dumps, batch.encode_events
+        batch.dumps = lambda event: encoded.append(1) or dumps(event)
+        batch.encode_events = lambda chunk: \
+            encoded.extend(chunk) or encode_events(chunk)
+        try:
+            chunks = list(chunk_events(events, max_events=65507,
+                                       max_bytes=1400))
+        finally:
+            batch.dumps, batch.encode_events = dumps, encode_events
+        self.assertTrue(len(chunks) > 40)
+        self.assertEqual(sum(len(c) for c, body in chunks), 2000)
+        self.assertTrue(all(len(body) <= 1400 for c, body in chunks))
+        self.assertTrue(len(encoded) <= 2 * len(events))
+
+
+class TestPutMany(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer()
+        self.cube = Cube('127.0.0.1', collector_port=self.server.port)
+
+    def tearDown(self):
+        self.cube.close()
+        self.server.stop()
+
+    def test_put_many(self):
+        events = [dict(type='test', data={'i': i}) for i in range(5)]
+        events[0]['id'] = 'abc'
+        results = self.cube.put_many(events, max_events=2)
+        self.assertEqual([len(r.events) for r in results], [2, 2, 1])
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(len(self.server.requests), 3)
+        method, path, headers, body = self.server.requests[0]
+        self.assertEqual((method, path), ('POST', '/1.0/event/put'))
+        sent = json.loads(body.decode('utf-8'))
+        self.assertEqual(sent[0]['id'], 'abc')
+        self.assertTrue('time' in sent[1])
+
+    def test_event_put_many(self):
+        event = self.cube.get_event('test')
+        results = event.put_many([{'data': {'i': 1}},
+                                   {'data': {'i': 2}, 'id': 'abc',
+                                    'time': '2013-10-01T00:00:00'}, {}])
+        self.assertEqual(len(results), 1)
+        sent = json.loads(self.server.requests[0][3].decode('utf-8'))
+        self.assertEqual([e['type'] for e in sent], ['test'] * 3)
+        self.assertEqual([e['data'] for e in sent], [{'i': 1}, {'i': 2}, {}])
+        self.assertEqual((sent[1]['id'], sent[1]['time']),
+                         ('abc', '2013-10-01T00:00:00'))
+        self.assertTrue('id' not in sent[0] and 'time' in sent[0])
+
+    def test_failed_chunk(self):
+        self.server.responder = lambda method, path, body: (500, '{}')
+        results = self.cube.put_many([dict(type='test')])
+        self.assertFalse(results[0].ok)
+        self.assertTrue(results[0].error is not None)
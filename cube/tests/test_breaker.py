@@ -0,0 +1,255 @@
+# -*- encoding: utf-8 -*-
+
+import shutil
+import tempfile
+import time
+import unittest
+
+from cube import Cube
+from cube.breaker import (AdaptiveTimeout, CircuitBreaker, CircuitOpen,
+                          CLOSED, OPEN, HALF_OPEN)
+from cube.tests import StubServer
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+    def calls(self, breaker, outcomes, elapsed=0.01):
+        for failed in outcomes:
+            breaker.before()
+            breaker.record(elapsed, failed)
+
+    def test_failure_rate(self):
+        breaker = CircuitBreaker('test', window=10, min_calls=4,
+                                 clock=self.clock)
+        self.calls(breaker, [True, True, True])
+        # Not enough calls yet
+        self.assertEqual(breaker.state, CLOSED)
+        self.calls(breaker, [False])
+        self.assertEqual(breaker.state, OPEN)
+        self.assertRaises(CircuitOpen, breaker.before)
+        self.assertEqual(breaker.stats['rejected'], 1)
+        self.assertEqual(breaker.stats['opened'], 1)
+
+    def test_window(self):
+        breaker = CircuitBreaker('test', window=4, min_calls=4,
+                                 failure_rate=0.75, clock=self.clock)
+        # Old failures slide out of the window
+        self.calls(breaker, [True, True, False, False, False, True, True])
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.stats['failures'], 2)
+        self.calls(breaker, [True])
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_slow_calls(self):
+        breaker = CircuitBreaker('test', min_calls=4, slow_call=0.1,
+                                 clock=self.clock)
+        self.calls(breaker, [False] * 3, elapsed=0.01)
+        self.calls(breaker, [False] * 2, elapsed=0.5)
+        self.assertEqual(breaker.state, CLOSED)
+        self.calls(breaker, [False], elapsed=0.5)
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.stats['failures'], 0)
+
+    def test_half_open(self):
+        breaker = CircuitBreaker('test', min_calls=2, reset_timeout=5,
+                                 clock=self.clock)
+        self.calls(breaker, [True, True])
+        self.clock.now += 4.9
+        self.assertRaises(CircuitOpen, breaker.before)
+
+        # A single probe is let through
+        self.clock.now += 0.1
+        breaker.before()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertRaises(CircuitOpen, breaker.before)
+        breaker.record(0.01, failed=True)
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.opened, 2)
+        self.assertRaises(CircuitOpen, breaker.before)
+
+        self.clock.now += 5
+        breaker.before()
+        breaker.record(0.01)
+        self.assertEqual(breaker.state, CLOSED)
+        # With a clean slate
+        self.assertEqual(breaker.stats['calls'], 0)
+
+
+class TestAdaptiveTimeout(unittest.TestCase):
+    def test_percentile(self):
+        timeout = AdaptiveTimeout(pct=90, multiplier=2, min_timeout=0.01,
+                                  max_timeout=10, min_samples=10)
+        for i in range(9):
+            timeout.record(0.01)
+        self.assertEqual(timeout.get(), 10)
+        timeout.record(1)
+        self.assertEqual(timeout.get(), 0.02)
+        # Only refreshed every few latencies
+        timeout.record(0.005)
+        self.assertEqual(timeout.get(), 0.02)
+
+    def test_bounds(self):
+        timeout = AdaptiveTimeout(min_timeout=0.5, max_timeout=2,
+                                  min_samples=5)
+        for i in range(5):
+            timeout.record(0.001)
+        self.assertEqual(timeout.get(), 0.5)
+        for i in range(16):
+            timeout.record(10)
+        self.assertEqual(timeout.get(), 2)
+
+    def test_grows(self):
+        timeout = AdaptiveTimeout(pct=90, multiplier=2, min_timeout=0.01,
+                                  min_samples=4, window=4)
+        for i in range(4):
+            timeout.record(0.01)
+        self.assertEqual(timeout.get(), 0.02)
+        # Timed out calls are taken into account right away
+        timeout.record(0.02)
+        self.assertEqual(timeout.get(), 0.04)
+
+
+class FaultServer(StubServer):
+    """ Stub server answering with status after delay seconds. """
+    def __init__(self):
+        self.status = 200
+        self.delay = 0
+        StubServer.__init__(self, self.respond)
+
+    def respond(self, method, path, body):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.status, '[]'
+
+
+class TestCubeBreaker(unittest.TestCase):
+    def setUp(self):
+        self.server = FaultServer()
+        self.cube = None
+        self.directory = None
+
+    def tearDown(self):
+        if self.cube is not None:
+            self.cube.close()
+        self.server.stop()
+        if self.directory is not None:
+            shutil.rmtree(self.directory)
+
+    def make_cube(self, **kwargs):
+        self.cube = Cube('127.0.0.1', collector_port=self.server.port,
+                         evaluator_port=self.server.port, breaker=True,
+                         breaker_min_calls=4, breaker_reset=60, **kwargs)
+        self.clock = Clock()
+        for endpoint in (list(self.cube.collectors.values()) +
+                         self.cube.replicas.replicas):
+            endpoint.breaker.clock = self.clock
+        return self.cube
+
+    def test_put(self):
+        cube = self.make_cube()
+        host = '127.0.0.1:{0}'.format(self.server.port)
+        self.server.status = 503
+        for i in range(4):
+            self.assertRaises(cube.collector_session.HTTPError,
+                              cube.put, 'test')
+        self.assertRaises(CircuitOpen, cube.put, 'test')
+        self.assertEqual(len(self.server.requests), 4)
+        results = cube.put_many([{'type': 'test'}])
+        self.assertTrue(isinstance(results[0].error, CircuitOpen))
+        self.assertEqual(len(self.server.requests), 4)
+
+        # Probed once the reset timeout is over
+        self.server.status = 200
+        self.clock.now += 60
+        cube.put('test')
+        self.assertEqual(cube.collectors[host].breaker.state, CLOSED)
+        self.assertEqual(len(self.server.requests), 5)
+
+    def test_query(self):
+        cube = self.make_cube()
+        self.server.status = 400
+        # The query is to blame
+        for i in range(4):
+            self.assertRaises(cube.evaluator_session.HTTPError,
+                              cube.event, 'test')
+        self.server.status = 500
+        for i in range(4):
+            self.assertRaises(cube.evaluator_session.HTTPError,
+                              cube.types)
+        self.assertRaises(CircuitOpen, cube.metric, 'sum(test)',
+                          step='1e4', start='2013-10-01')
+        self.assertEqual(len(self.server.requests), 8)
+        self.assertEqual(cube.replicas.replicas[0].breaker.state, OPEN)
+        self.assertEqual(cube._primary.breaker.state, CLOSED)
+
+    def test_spool(self):
+        self.directory = tempfile.mkdtemp()
+        cube = self.make_cube(spool_dir=self.directory, spool_retry=0)
+        self.server.status = 503
+        for i in range(6):
+            cube.put('test', {'i': i})
+        # Spooled, without reaching the collector once its circuit opened
+        self.assertEqual(cube.spool.appended, 6)
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_hedge(self):
+        other = FaultServer()
+        try:
+            cube = self.make_cube(
+                evaluators=['127.0.0.1:{0}'.format(port)
+                            for port in (self.server.port, other.port)],
+                hedge_delay=5)
+            cube.replicas.replicas[0].breaker._open()
+            start = time.time()
+            self.assertEqual(cube.event('test'), [])
+            self.assertTrue(time.time() - start < 1)
+            self.assertEqual(len(self.server.requests), 0)
+            self.assertEqual(len(other.requests), 1)
+        finally:
+            other.stop()
+
+    def test_slow(self):
+        cube = self.make_cube(breaker_slow_call=0.05)
+        self.server.delay = 0.1
+        for i in range(4):
+            cube.types()
+        self.assertRaises(CircuitOpen, cube.types)
+
+
+class TestCubeAdaptiveTimeout(unittest.TestCase):
+    def setUp(self):
+        self.server = FaultServer()
+        self.cube = Cube('127.0.0.1', evaluator_port=self.server.port,
+                         timeout='adaptive', timeout_percentile=50,
+                         min_timeout=0.1, max_timeout=5)
+
+    def tearDown(self):
+        self.cube.close()
+        self.server.stop()
+
+    def test_timeout(self):
+        timeout = self.cube.replicas.replicas[0].timeout
+        self.assertEqual(timeout.get(), 5)
+        for i in range(20):
+            self.cube.types()
+        self.assertEqual(timeout.get(), 0.1)
+
+        self.server.delay = 0.5
+        start = time.time()
+        self.assertRaises(self.cube.evaluator_session.Timeout,
+                          self.cube.types)
+        self.assertTrue(time.time() - start < 0.4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import unittest
+from datetime import datetime, timedelta
+
+from cube import Cube
+from cube.cache import MetricCache
+from cube.tests import StubServer
+from cube.time_utils import STEP_1_MIN, parse_iso
+
+
+def buckets(start, stop, step=timedelta(minutes=1)):
+    result = []
+    while start < stop:
+        result.append({'time': start.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                       'value': start.minute})
+        start += step
+    return result
+
+
+class TestMetricCache(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.now = datetime(2013, 10, 1, 12, 0, 30)
+
+    def fetch(self, start, stop):
+        self.calls.append((start, stop))
+        return buckets(start, stop)
+
+    def test_only_fetch_missing(self):
+        cache = MetricCache(grace=0)
+        start = datetime(2013, 10, 1, 11)
+        first = cache.query(self.fetch, 'sum(test)', STEP_1_MIN, start,
+                            now=self.now)
+        self.assertEqual(len(first), 60)
+        self.assertEqual(self.calls, [(start, datetime(2013, 10, 1, 12))])
+
+        # A minute later, only the new bucket is fetched
+        now = self.now + timedelta(minutes=1)
+        second = cache.query(self.fetch, 'sum(test)', STEP_1_MIN,
+                             start + timedelta(seconds=20), now=now)
+        self.assertEqual(second, first + buckets(datetime(2013, 10, 1, 12),
+                                                 datetime(2013, 10, 1, 12, 1)))
+        self.assertEqual(self.calls[1], (datetime(2013, 10, 1, 12),
+                                         datetime(2013, 10, 1, 12, 1)))
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.partial_hits, 1)
+        self.assertEqual(cache.buckets_hit, 60)
+
+        cache.query(self.fetch, 'sum(test)', STEP_1_MIN, start,
+                    datetime(2013, 10, 1, 11, 30), now=now)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_mutable_buckets(self):
+        cache = MetricCache(grace=60)
+        start = datetime(2013, 10, 1, 11, 50)
+        cache.query(self.fetch, 'sum(test)', STEP_1_MIN, start, now=self.now)
+        cache.query(self.fetch, 'sum(test)', STEP_1_MIN, start, now=self.now)
+        # The last bucket ends less than grace seconds before now
+        self.assertEqual(self.calls[1], (datetime(2013, 10, 1, 11, 59),
+                                         datetime(2013, 10, 1, 12)))
+
+    def test_mutated_result(self):
+        cache = MetricCache(grace=0)
+        start = datetime(2013, 10, 1, 11)
+        first = cache.query(self.fetch, 'sum(test)', STEP_1_MIN, start,
+                            now=self.now)
+        first[0]['value'] = 'changed'
+        first.pop()
+        second = cache.query(self.fetch, 'sum(test)', STEP_1_MIN, start,
+                             now=self.now)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(second, buckets(start, datetime(2013, 10, 1, 12)))
+        second[1]['value'] = 'changed'
+        self.assertEqual(cache.query(self.fetch, 'sum(test)', STEP_1_MIN,
+                                     start, now=self.now)[1]['value'], 1)
+
+    def test_equivalent_expressions(self):
+        cache = MetricCache(grace=0)
+        start = datetime(2013, 10, 1, 11)
+        cache.query(self.fetch, 'sum(a) + sum(b)', STEP_1_MIN, start,
+                    now=self.now)
+        cache.query(self.fetch, 'sum(b)+sum(a)', STEP_1_MIN, start,
+                    now=self.now)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_unparsed_expression(self):
+        cache = MetricCache(grace=0)
+        start = datetime(2013, 10, 1, 11)
+        for i in range(2):
+            cache.query(self.fetch, u'sum(a) +', STEP_1_MIN, start,
+                        now=self.now)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_gaps(self):
+        cache = MetricCache(grace=0)
+        cache.query(self.fetch, 'sum(test)', STEP_1_MIN,
+                    datetime(2013, 10, 1, 11, 10),
+                    datetime(2013, 10, 1, 11, 20), now=self.now)
+        result = cache.query(self.fetch, 'sum(test)', STEP_1_MIN,
+                             datetime(2013, 10, 1, 11),
+                             datetime(2013, 10, 1, 11, 30), now=self.now)
+        self.assertEqual([parse_iso(b['time']).minute for b in result],
+                         list(range(30)))
+        self.assertEqual(self.calls[1:], [
+            (datetime(2013, 10, 1, 11), datetime(2013, 10, 1, 11, 10)),
+            (datetime(2013, 10, 1, 11, 20), datetime(2013, 10, 1, 11, 30))])
+
+    def test_eviction(self):
+        cache = MetricCache(max_buckets=50, grace=0)
+        start = datetime(2013, 10, 1, 11, 30)
+        cache.query(self.fetch, 'sum(a)', STEP_1_MIN, start, now=self.now)
+        cache.query(self.fetch, 'sum(b)', STEP_1_MIN, start, now=self.now)
+        self.assertEqual(len(cache), 30)
+        self.assertEqual(cache.evictions, 1)
+        cache.query(self.fetch, 'sum(b)', STEP_1_MIN, start, now=self.now)
+        self.assertEqual(len(self.calls), 2)
+
+
+class TestCubeMetricCache(unittest.TestCase):
+    def test_metric_cache(self):
+        def responder(method, path, body):
+            return 200, json.dumps(buckets(datetime(2013, 10, 1),
+                                           datetime(2013, 10, 1, 0, 5)))
+        server = StubServer(responder)
+        cube = Cube('127.0.0.1', evaluator_port=server.port,
+                    metric_cache=True)
+        kwargs = dict(step='6e4', start='2013-10-01',
+                      stop=datetime(2013, 10, 1, 0, 5))
+        self.assertEqual(len(cube.metric('sum(test)', **kwargs)), 5)
+        self.assertEqual(len(cube.metric('sum(test)', **kwargs)), 5)
+        self.assertEqual(len(server.requests), 1)
+        cube.metric('sum(test)', cache=False, **kwargs)
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(cube.metric_cache.stats['hits'], 1)
+        cube.close()
+        server.stop()
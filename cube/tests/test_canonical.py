@@ -0,0 +1,61 @@
+# -*- encoding: utf-8 -*-
+
+import unittest
+
+from cube import canonical
+from cube.canonical import (canonical_key, canonical_string, canonicalize,
+                            equivalent)
+from cube.expression import EventExpression, Sum
+from cube.parser import parse
+
+
+class TestCanonical(unittest.TestCase):
+    def setUp(self):
+        canonical._cache.clear()
+
+    def test_commutative(self):
+        self.assertTrue(equivalent('sum(a) + sum(b)', 'sum(b) + sum(a)'))
+        self.assertTrue(equivalent('sum(a) * sum(b)', 'sum(b) * sum(a)'))
+        self.assertFalse(equivalent('sum(a) - sum(b)', 'sum(b) - sum(a)'))
+        self.assertFalse(equivalent('sum(a) / sum(b)', 'sum(b) / sum(a)'))
+
+    def test_associative(self):
+        m = Sum(EventExpression('request'))
+        self.assertNotEqual(m + (m + m), (m + m) + m)
+        self.assertTrue(equivalent(m + (m + m), (m + m) + m))
+        self.assertEqual(canonical_string('sum(c) + (sum(a) + sum(b))'),
+                         '((sum(a) + sum(b)) + sum(c))')
+        self.assertEqual(canonical_string('(sum(a) + sum(b)) * sum(c)'),
+                         '(sum(c) * (sum(a) + sum(b)))')
+
+    def test_constants(self):
+        self.assertEqual(canonical_string('2 * sum(a) * 3'), '(sum(a) * 6)')
+        self.assertEqual(canonical_string('sum(a) + 1 + 2 - 0'),
+                         '(sum(a) + 3)')
+        self.assertEqual(canonical_string('(sum(a) * 1) / 1'), 'sum(a)')
+        self.assertEqual(canonical_string('sum(a) / (4 - 2)'), '(sum(a) / 2)')
+        self.assertEqual(canonical_string('sum(a) / (1 - 1)'), '(sum(a) / 0)')
+        self.assertEqual(canonical_string('sum(a) * 0'), '(sum(a) * 0)')
+        self.assertEqual(canonical_string('sum(a) + ((sum(b) + 1) - 0)'),
+                         '((sum(a) + sum(b)) + 1)')
+
+    def test_filters(self):
+        self.assertEqual(
+            canonical_string('sum(req.gt(ms, 1).eq(path, "/").gt(ms, 1))'),
+            'sum(req.gt(ms, 1).eq(path, "/"))')
+        self.assertTrue(equivalent('req.in(s, [503, 500, 503])',
+                                   'req.in(s, [500, 503])'))
+        self.assertFalse(equivalent('req(a, b)', 'req(b, a)'))
+
+    def test_idempotent(self):
+        for text in ['sum(c) + (sum(a) + sum(b)) * 2 - max(x.eq(y, 1))',
+                     '2 - sum(a) / (sum(b) * sum(a) * 3)']:
+            once = canonicalize(text)
+            self.assertEqual(canonicalize(once), once)
+            self.assertEqual(parse(str(once)), once)
+
+    def test_key(self):
+        key = canonical_key('sum(a) + sum(b)')
+        self.assertEqual(key, canonical_key(parse('sum(b) + sum(a)')))
+        self.assertEqual(len(key), 40)
+        self.assertNotEqual(key, canonical_key('sum(a) - sum(b)'))
@@ -91,3 +91,18 @@ class TestCompoundMetricExpressions(unittest.TestCase):
                 "(sum(request(elapsed_ms).eq(path, \"/\")) - "\
                 "min(request(elapsed_ms).eq(path, \"/\").gt("\
                     "elapsed_ms, 500)))")
+
+    def test_hash(self):
+        e = EventExpression('request', 'elapsed_ms').eq('path', '/')
+        c1 = Sum(e) / Sum(EventExpression('request').eq('path', '/')) * 2
+        c2 = Sum(e) / Sum(EventExpression('request').eq('path', '/')) * 2
+        self.assertEqual(c1, c2)
+        self.assertEqual(hash(c1), hash(c2))
+        self.assertNotEqual(c1, c2 * 2)
+        self.assertNotEqual(c1, Sum(e))
+        self.assertEqual(len(set([c1, c2, Sum(e), MetricExpression('sum', e)])),
+                         2)
+        self.assertRaises(AttributeError, setattr, c1, 'operator', '+')
+
+    def test_zero(self):
+        self.assertEqual("%s" % (self.sum * 0), "(sum(test(ing)) * 0)")
@@ -0,0 +1,50 @@
+# -*- encoding: utf-8 -*-
+
+import threading
+import unittest
+
+from cube import Cube
+from cube.tests import StubServer
+
+
+class TestCubeSessions(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer(lambda method, path, body: (200, '[]'))
+        self.cube = Cube('127.0.0.1', collector_port=self.server.port,
+                         evaluator_port=self.server.port, timeout=5)
+
+    def tearDown(self):
+        self.cube.close()
+        self.server.stop()
+
+    def test_keep_alive(self):
+        for i in range(5):
+            self.cube.put('test', {'i': i})
+            self.cube.metric('sum(test)', step='1e4')
+        self.assertEqual(len(self.server.requests), 10)
+        # One connection per endpoint
+        self.assertEqual(len(self.server.clients), 2)
+
+    def test_no_keep_alive(self):
+        cube = Cube('127.0.0.1', collector_port=self.server.port,
+                    keep_alive=False)
+        for i in range(3):
+            cube.put('test', {'i': i})
+        cube.close()
+        self.assertEqual(len(self.server.clients), 3)
+
+    def test_threads(self):
+        def worker():
+            for i in range(10):
+                self.cube.types()
+        threads = [threading.Thread(target=worker) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(self.server.requests), 40)
+        self.assertTrue(len(self.server.clients) <= 4)
+
+    def test_context_manager(self):
+        with Cube('127.0.0.1', evaluator_port=self.server.port) as cube:
+            self.assertEqual(cube.types(), [])
@@ -0,0 +1,81 @@
+# -*- encoding: utf-8 -*-
+
+import gzip
+import io
+import json
+import unittest
+
+from cube import Cube
+from cube.batch import chunk_events
+from cube.encoding import compress, dumps, encode_events
+from cube.tests import StubServer
+
+
+def gunzip(body):
+    return gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+
+
+class TestEncoding(unittest.TestCase):
+    def test_encode_events(self):
+        events = [{'type': 'test', 'data': {'v': u'caf\xe9', 'i': i}}
+                  for i in range(3)]
+        body = encode_events(events)
+        self.assertTrue(isinstance(body, bytes))
+        self.assertFalse(b' ' in body)
+        self.assertEqual(json.loads(body.decode('utf-8')), events)
+        self.assertEqual(encode_events(iter(events)), body)
+        self.assertEqual(body, b'[' + b','.join(dumps(e) for e in events) +
+                         b']')
+
+    def test_json_compatible(self):
+        self.assertEqual(encode_events([{'data': {200: 3}}]),
+                         b'[{"data":{"200":3}}]')
+        self.assertEqual(dumps({'v': 2 ** 70}),
+                         b'{"v":1180591620717411303424}')
+        self.assertRaises(TypeError, dumps, {'v': object()})
+
+    def test_compress(self):
+        body = encode_events([{'type': 'test', 'data': {'i': i}}
+                              for i in range(100)])
+        self.assertEqual(compress(body, min_bytes=len(body) + 1),
+                         (body, None))
+        self.assertEqual(compress(body, min_bytes=None), (body, None))
+        compressed, encoding = compress(body, min_bytes=len(body))
+        self.assertEqual(encoding, 'gzip')
+        self.assertTrue(len(compressed) < len(body) / 4)
+        self.assertEqual(gunzip(compressed), body)
+
+    def test_chunk_events(self):
+        events = [{'type': 'test', 'data': {'i': i}} for i in range(10)]
+        for chunk, body in chunk_events(events, max_bytes=100):
+            self.assertTrue(len(body) <= 100)
+            self.assertEqual(body, encode_events(chunk))
+
+
+class TestCubeCompression(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer()
+
+    def tearDown(self):
+        self.cube.close()
+        self.server.stop()
+
+    def test_compress(self):
+        self.cube = Cube('127.0.0.1', collector_port=self.server.port,
+                         compress=True, compress_min_bytes=200)
+        self.cube.put('test', {'i': 1})
+        events = [dict(type='test', data={'i': i}) for i in range(20)]
+        self.cube.put_many(events)
+        small, large = self.server.requests
+        self.assertFalse('content-encoding' in small[2])
+        self.assertEqual(json.loads(small[3].decode('utf-8'))[0]['data'],
+                         {'i': 1})
+        self.assertEqual(large[2]['content-encoding'], 'gzip')
+        sent = json.loads(gunzip(large[3]).decode('utf-8'))
+        self.assertEqual([e['data']['i'] for e in sent], list(range(20)))
+
+    def test_default(self):
+        self.cube = Cube('127.0.0.1', collector_port=self.server.port)
+        self.cube.put_many([dict(type='test', data={'i': i})
+                            for i in range(100)])
+        self.assertFalse('content-encoding' in self.server.requests[0][2])
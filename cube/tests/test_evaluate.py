@@ -0,0 +1,105 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import unittest
+
+try:
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from urllib.parse import parse_qs, urlparse
+
+from cube import Cube
+from cube.evaluate import evaluate, evaluate_many, leaves
+from cube.expression import EventExpression, Sum, Max
+from cube.tests import StubServer
+
+
+class TestEvaluate(unittest.TestCase):
+    def setUp(self):
+        self.ms = Sum(EventExpression('req', 'ms'))
+        self.count = Sum(EventExpression('req'))
+        self.max = Max(EventExpression('req', 'ms'))
+        self.results = {
+            'sum(req(ms))': [{'time': 't1', 'value': 40},
+                             {'time': 't2', 'value': 10},
+                             {'time': 't3', 'value': 5}],
+            'sum(req)': [{'time': 't1', 'value': 4},
+                         {'time': 't2', 'value': 0}],
+            'max(req(ms))': [{'time': 't1', 'value': 20},
+                             {'time': 't2', 'value': None},
+                             {'time': 't3', 'value': 5}],
+        }
+
+    def values(self, expression):
+        return [b['value'] for b in evaluate(expression, self.results)]
+
+    def test_leaves(self):
+        expression = self.ms / self.count + (self.ms - self.count) * 2
+        self.assertEqual([str(l) for l in leaves(expression)],
+                         ['sum(req(ms))', 'sum(req)'])
+
+    def test_arithmetic(self):
+        self.assertEqual(self.values(self.ms + self.count), [44, 10, None])
+        self.assertEqual(self.values(self.ms - self.count * 2), [32, 10, None])
+        self.assertEqual(self.values(self.max * 2), [40, None, 10])
+        self.assertEqual(self.values(self.ms), [40, 10, 5])
+
+    def test_division(self):
+        # Division by zero and missing buckets are None
+        self.assertEqual(self.values(self.ms / self.count), [10.0, None, None])
+
+    def test_times(self):
+        self.assertEqual([b['time'] for b in
+                          evaluate(self.ms / self.count, self.results)],
+                         ['t1', 't2', 't3'])
+
+    def test_string(self):
+        self.assertEqual(self.values('sum(req(ms)) / sum(req)'),
+                         [10.0, None, None])
+
+    def test_invalid_leaf(self):
+        self.assertRaises(TypeError, list, leaves(self.ms + 'sum(req)'))
+
+
+class TestEvaluateMany(unittest.TestCase):
+    def test_shared_leaves(self):
+        def responder(method, path, body):
+            expression = parse_qs(urlparse(path).query)['expression'][0]
+            value = 10 if expression == 'sum(req(ms))' else 2
+            return 200, json.dumps([{'time': 't1', 'value': value}])
+        server = StubServer(responder)
+        cube = Cube('127.0.0.1', evaluator_port=server.port)
+        ms = Sum(EventExpression('req', 'ms'))
+        count = Sum(EventExpression('req'))
+        results = evaluate_many(cube, [ms / count, count, ms - count],
+                                step='1e4', start='2013-10-01')
+        self.assertEqual([r[0]['value'] for r in results], [5.0, 2, 8])
+        self.assertEqual(len(server.requests), 2)
+
+        result = cube.metric(ms / count, local=True, step='1e4')
+        self.assertEqual(result, [{'time': 't1', 'value': 5.0}])
+        result = cube.metric('sum(req(ms)) / sum(req)', local=True, step='1e4')
+        self.assertEqual(result, [{'time': 't1', 'value': 5.0}])
+        cube.close()
+        server.stop()
+
+    def test_local_without_cache(self):
+        server = StubServer(lambda method, path, body: (200, json.dumps(
+            [{'time': '2013-10-01T00:00:00.000Z', 'value': 2}])))
+        cube = Cube('127.0.0.1', evaluator_port=server.port,
+                    metric_cache=True)
+        kwargs = dict(local=True, step='1e4', start='2013-10-01',
+                      stop='2013-10-01T00:00:10')
+        for _ in range(2):
+            result = cube.metric('sum(req) * 2', cache=False, **kwargs)
+            self.assertEqual(result[0]['value'], 4)
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(len(cube.metric_cache), 0)
+
+        for _ in range(2):
+            series = cube.metric('sum(req) * 2', columnar=True, **kwargs)
+            self.assertEqual(list(series.values), [4])
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(len(cube.metric_cache), 1)
+        cube.close()
+        server.stop()
@@ -113,3 +113,32 @@ class TestEventExpressions(unittest.TestCase):
         self.assertEqual(len(e.filters), 3)
         self.assertEqual("%s" % e,
                 'test.eq(bar, "baz").lt(fizz, "bang").ge(foo, 4)')
+
+    def test_immutable(self):
+        e = EventExpression('test', 'foo')
+        self.assertRaises(AttributeError, setattr, e, 'event_type', 'bar')
+        e.event_properties.append('bar')
+        self.assertEqual(e.event_properties, ['foo'])
+        f = e.eq('foo', 1)
+        self.assertEqual(len(e.filters), 0)
+        self.assertEqual(len(f.filters), 1)
+        self.assertRaises(AttributeError, setattr, f.filters[0], 'value', 2)
+
+    def test_shared_chain(self):
+        e = EventExpression('test').eq('bar', 'baz')
+        f1 = e.lt('foo', 1)
+        f2 = e.gt('foo', 1)
+        self.assertTrue(f1.filters[0] is f2.filters[0])
+        self.assertEqual("%s" % f1, 'test.eq(bar, "baz").lt(foo, 1)')
+        self.assertEqual("%s" % f2, 'test.eq(bar, "baz").gt(foo, 1)')
+        self.assertTrue(str(f1) is str(f1))
+
+    def test_hash(self):
+        e1 = EventExpression('test', ['foo']).eq('bar', 'baz').in_array(
+            'foo', ['a', 'b'])
+        e2 = EventExpression('test', 'foo').eq('bar', 'baz').in_array(
+            'foo', ('a', 'b'))
+        self.assertEqual(e1, e2)
+        self.assertEqual(hash(e1), hash(e2))
+        self.assertEqual(len(set([e1, e2, e1.eq('bar', 'baz')])), 2)
+        self.assertEqual({e1: 1}[e2], 1)
@@ -74,3 +74,18 @@ class TestFilter(unittest.TestCase):
     def test_in(self):
         f = IN('name', ['a', 'b', 'c'])
         self.assertEqual("%s" % f, '.in(name, ["a", "b", "c"])')
+
+    def test_frozen_value(self):
+        values = ['a', 'b']
+        nested = {'k': [1, 2]}
+        f = IN('name', values)
+        g = Filter('eq', 'name', nested)
+        key, rendered = hash(f), str(g)
+        values.append('c')
+        nested['k'].append(3)
+        self.assertEqual(str(f), '.in(name, ["a", "b"])')
+        self.assertEqual(f.value, ('a', 'b'))
+        self.assertEqual(hash(f), key)
+        self.assertEqual(f, IN('name', ['a', 'b']))
+        self.assertEqual(str(Filter('eq', 'name', {'k': [1, 2]})), rendered)
+        self.assertEqual(g, Filter('eq', 'name', {'k': [1, 2]}))
@@ -0,0 +1,178 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import unittest
+
+from cube import Cube
+from cube.instrument import CallRecord, Histogram, Histograms, _index, \
+    _lowest
+from cube.tests import StubServer
+
+EVENTS = [{'time': 1}, {'time': 2}, {'time': 3}]
+METRIC = [{'time': '2013-10-01T00:00:00.000Z', 'value': 1},
+          {'time': '2013-10-01T00:00:10.000Z', 'value': 2}]
+
+
+def respond(method, path, body):
+    if path.startswith('/1.0/metric'):
+        return 200, json.dumps(METRIC)
+    if path.startswith('/1.0/types'):
+        return 200, json.dumps(['a', 'b', 'c'])
+    if path.startswith('/1.0/event?'):
+        return 200, json.dumps(EVENTS)
+    if path.startswith('/1.0/event/put'):
+        return 200, '{}'
+    return 400, '{"error": "bad request"}'
+
+
+class TestHistogram(unittest.TestCase):
+    def test_buckets(self):
+        for value in [0, 1, 63, 64, 65, 1000, 123456, 10 ** 9]:
+            index = _index(value)
+            self.assertTrue(_lowest(index) <= value < _lowest(index + 1))
+            # ~3% buckets
+            self.assertTrue(_lowest(index + 1) - _lowest(index) <=
+                            max(1, value / 32.0))
+
+    def test_snapshot(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.snapshot().percentile(99), None)
+        for i in range(1, 1001):
+            histogram.record(i / 1e5)
+        snapshot = histogram.snapshot(reset=True)
+        self.assertEqual(snapshot.count, 1000)
+        self.assertEqual(snapshot.min, 0.00001)
+        self.assertEqual(snapshot.max, 0.01)
+        for pct in (50, 90, 99):
+            expected = pct / 1e4
+            value = snapshot.percentile(pct)
+            self.assertTrue(expected <= value <= expected * 1.04,
+                            (pct, value))
+        self.assertEqual(snapshot.percentile(100), 0.01)
+        self.assertEqual(snapshot.as_dict()['max_ms'], 10)
+        self.assertEqual(histogram.snapshot().count, 0)
+
+
+class TestListeners(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer(respond)
+        self.host = '127.0.0.1:{0}'.format(self.server.port)
+        self.records = []
+        self.cube = Cube('127.0.0.1', collector_port=self.server.port,
+                         evaluator_port=self.server.port,
+                         listeners=[self.records.append])
+
+    def tearDown(self):
+        self.cube.close()
+        self.server.stop()
+
+    def test_put(self):
+        self.cube.put('test', {'value': 1})
+        self.cube.put_many([{'type': 'test'}] * 5, max_events=2)
+        self.assertEqual([r.events for r in self.records], [1, 2, 2, 1])
+        record = self.records[0]
+        self.assertEqual((record.endpoint, record.path, record.host),
+                         ('collector', 'event/put', self.host))
+        self.assertEqual(record.bytes_sent,
+                         len(self.server.requests[0][3]))
+        self.assertEqual(record.bytes_received, 2)
+        self.assertTrue(record.serialize >= 0 and record.network > 0)
+        self.assertEqual(record.queue_depth, None)
+        self.assertEqual(record.error, None)
+
+    def test_async_put(self):
+        self.cube.close()
+        self.cube = Cube('127.0.0.1', collector_port=self.server.port,
+                         async_put=True, listeners=[self.records.append])
+        for i in range(3):
+            self.cube.put('test', {'i': i})
+        self.cube.flush()
+        self.assertEqual(sum(r.events for r in self.records), 3)
+        self.assertTrue(all(r.queue_depth is not None
+                            for r in self.records))
+
+    def test_queries(self):
+        self.assertEqual(len(self.cube.metric('sum(test)', step='1e4',
+                                              start='2013-10-01',
+                                              cache=False)), 2)
+        self.assertEqual(len(self.cube.metric('sum(test)', step='1e4',
+                                              start='2013-10-01',
+                                              cache=False,
+                                              columnar=True)), 2)
+        self.cube.types()
+        self.assertEqual([r.path for r in self.records],
+                         ['metric', 'metric', 'types'])
+        metric = self.records[0]
+        self.assertEqual((metric.endpoint, metric.host, metric.expression,
+                          metric.step),
+                         ('evaluator', self.host, 'sum(test)', '1e4'))
+        self.assertEqual(metric.result_size, 2)
+        self.assertEqual(metric.bytes_received, len(json.dumps(METRIC)))
+        self.assertTrue(metric.bytes_sent > 0)
+        self.assertTrue(metric.decode >= 0)
+        self.assertEqual(self.records[2].result_size, 3)
+        self.assertEqual(self.records[2].bytes_sent, None)
+
+    def test_iter_events(self):
+        events = self.cube.iter_events('test')
+        self.assertEqual(self.records, [])
+        self.assertEqual(len(list(events)), 3)
+        record, = self.records
+        self.assertEqual((record.path, record.expression, record.result_size),
+                         ('event', 'test', 3))
+        self.assertEqual(record.bytes_received, len(json.dumps(EVENTS)))
+        self.assertTrue(record.network > 0 and record.decode >= 0)
+
+        self.cube.event('test')
+        self.assertEqual(self.records[-1].result_size, 3)
+
+    def test_error(self):
+        self.assertRaises(self.cube.evaluator_session.HTTPError,
+                          self.cube.make_query, 'bogus', 'test')
+        record, = self.records
+        self.assertTrue(isinstance(record.error,
+                                   self.cube.evaluator_session.HTTPError))
+        self.assertEqual(record.result_size, None)
+        self.assertTrue('error' in repr(record))
+
+    def test_failing_listener(self):
+        def fail(record):
+            raise ValueError(record)
+        self.cube.add_listener(fail)
+        self.assertEqual(self.cube.types(), ['a', 'b', 'c'])
+        self.assertEqual(len(self.records), 1)
+        self.cube.remove_listener(fail)
+        self.cube.remove_listener(self.records.append)
+        self.cube.types()
+        self.assertEqual(len(self.records), 1)
+
+    def test_histograms(self):
+        histograms = Histograms()
+        self.cube.add_listener(histograms)
+        for i in range(10):
+            self.cube.types()
+        self.cube.put('test')
+        snapshot = histograms.snapshot(reset=True)
+        self.assertEqual(sorted(snapshot),
+                         [('collector', 'event/put'), ('evaluator', 'types')])
+        types = snapshot[('evaluator', 'types')]
+        self.assertEqual((types['calls'], types['errors']), (10, 0))
+        self.assertEqual(types['bytes_received'], 150)
+        self.assertEqual(types['network'].count, 10)
+        self.assertEqual(types['serialize'].count, 0)
+        self.assertTrue(types['total'].percentile(99) >=
+                        types['network'].percentile(50))
+        self.assertEqual(histograms.snapshot(), {})
+
+
+class TestCallRecord(unittest.TestCase):
+    def test_total(self):
+        record = CallRecord('evaluator', 'metric', serialize=0.001,
+                            network=0.01)
+        self.assertAlmostEqual(record.total, 0.011)
+        self.assertEqual(record.as_dict()['path'], 'metric')
+        self.assertEqual(record.as_dict()['decode'], None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- encoding: utf-8 -*-
+
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from cube.paginate import paginate_events
+from cube.time_utils import format_iso, to_datetime
+
+
+class FakeCube(object):
+    """ Evaluator stand-in, with an inclusive stop
+    and the latest events first. """
+    def __init__(self, times):
+        self.events = [{'time': format_iso(t), 'data': {'i': i}}
+                       for i, t in enumerate(times)]
+        self.queries = []
+
+    def event(self, expression, start, stop, limit, **kwargs):
+        self.queries.append((start, stop))
+        start, stop = format_iso(start), format_iso(stop)
+        events = [e for e in self.events if start <= e['time'] <= stop]
+        return list(reversed(events))[:limit]
+
+
+class TestPaginateEvents(unittest.TestCase):
+    def setUp(self):
+        self.start = datetime(2013, 10, 1)
+        self.stop = datetime(2013, 10, 2)
+
+    def check(self, cube, **kwargs):
+        events = list(paginate_events(cube, 'test(i)', self.start,
+                                      self.stop, **kwargs))
+        self.assertEqual(events, [e for e in cube.events
+                                  if e['time'] < format_iso(self.stop)])
+        return events
+
+    def test_sparse(self):
+        cube = FakeCube([self.start + timedelta(hours=h) for h in range(24)])
+        self.check(cube, limit=100, window=timedelta(hours=1))
+        # The window grows
+        spans = [b - a for a, b in cube.queries]
+        self.assertTrue(spans[-1] > spans[0])
+        self.assertTrue(len(cube.queries) < 24)
+
+    def test_dense(self):
+        # A burst of events at 12:00
+        times = [self.start + timedelta(hours=h) for h in range(24)]
+        times += [self.start + timedelta(hours=12, seconds=s)
+                  for s in range(1, 200)]
+        cube = FakeCube(sorted(times))
+        self.check(cube, limit=50, window=timedelta(hours=6))
+        # The window shrinks
+        spans = [b - a for a, b in cube.queries]
+        self.assertTrue(min(spans) < timedelta(hours=1))
+
+    def test_boundary(self):
+        cube = FakeCube([self.start + timedelta(hours=h) for h in range(24)])
+        events = self.check(cube, limit=100, window=timedelta(hours=1),
+                            max_window=timedelta(hours=1), prefetch=False)
+        self.assertEqual(len(events), 24)
+
+    def test_prefetch(self):
+        cube = FakeCube([self.start + timedelta(minutes=m)
+                         for m in range(0, 24 * 60, 7)])
+        iterator = paginate_events(cube, 'test(i)', self.start, self.stop,
+                                   limit=1000, window=timedelta(hours=2))
+        next(iterator)
+        # The next window is fetched while the first one is consumed
+        for i in range(100):
+            if len(cube.queries) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(cube.queries), 2)
+        self.assertEqual(len(list(iterator)), len(cube.events) - 1)
+        self.assertEqual(to_datetime(format_iso(cube.queries[1][0])),
+                         datetime(2013, 10, 1, 2))
@@ -0,0 +1,69 @@
+# -*- encoding: utf-8 -*-
+
+import unittest
+
+from cube import parser
+from cube.expression import EventExpression, Sum, Max, Median
+from cube.parser import ParseError, parse, parse_event, parse_metric
+
+EXPRESSIONS = [
+    'request',
+    'request(elapsed_ms)',
+    'request(path, user.id, tags[0])',
+    'request.eq(path, "/")',
+    'request(elapsed_ms).eq(path, "/").gt(elapsed_ms, 100).lt(elapsed_ms, '
+    '1000)',
+    'request.re(path, "^/cube\\\\d+").in(status, [500, 503])',
+    'request.ne(user, null).ge(size, 1.5)',
+    'sum(request)',
+    'median(request(elapsed_ms).eq(path, "/"))',
+    '(sum(request(elapsed_ms)) / sum(request))',
+    '((sum(request) + max(request(ms))) - (min(request(ms)) * 2))',
+    '(sum(request) + ((sum(request) * sum(request)) / sum(request)))',
+    '(2 * sum(request))',
+]
+
+
+class TestParser(unittest.TestCase):
+    def setUp(self):
+        parser._cache.clear()
+
+    def test_round_trip(self):
+        for text in EXPRESSIONS:
+            self.assertEqual(str(parse(text)), text)
+            self.assertEqual(parse(str(parse(text))), parse(text))
+
+    def test_objects(self):
+        e = EventExpression('request', 'elapsed_ms').eq('path', '/')
+        self.assertEqual(parse_event('request(elapsed_ms).eq(path, "/")'), e)
+        m = Sum(EventExpression('request'))
+        self.assertEqual(parse_metric('sum(request) + sum(request) * 2'),
+                         m + m * 2)
+        self.assertEqual(parse_metric(' ( sum( request ) ) '), m)
+        self.assertEqual(parse_metric('max(request(ms)) / sum(request)'),
+                         Max(EventExpression('request', 'ms')) / m)
+        self.assertEqual(parse_metric('sum(request) - 1.5e3'), m - 1500.0)
+
+    def test_ambiguous(self):
+        # Events named after a metric type need parse_event
+        self.assertEqual(parse('median(ms)'),
+                         Median(EventExpression('ms')))
+        self.assertEqual(parse_event('median(ms)'),
+                         EventExpression('median', 'ms'))
+
+    def test_cache(self):
+        text = 'sum(request.eq(path, "/"))'
+        self.assertTrue(parse_metric(text) is parse_metric(text))
+        self.assertFalse(parse_event('sum') is parse_metric('sum(sum)'))
+
+    def test_errors(self):
+        for text in ['', 'request(', 'request.foo(path, 1)',
+                     'request.eq(path, /)', 'request.eq(path 1)',
+                     'request)', 'sum(request', '2 * 3',
+                     'sum(request) +', 'sum(request) sum(request)']:
+            self.assertRaises(ParseError, parse, text)
+        self.assertRaises(ParseError, parse_metric, 'count(request)')
+        try:
+            parse_metric('sum(request) +')
+        except ValueError as e:
+            self.assertEqual(e.pos, 14)
@@ -0,0 +1,89 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import threading
+import time
+import unittest
+from datetime import datetime
+
+try:
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from urllib.parse import parse_qs, urlparse
+
+from cube import Cube
+from cube.planner import QueryPlan
+from cube.result import MetricSeries
+from cube.tests import StubServer
+
+VALUES = {'sum(req(ms))': 10, 'sum(req)': 2, 'max(req(ms))': 4}
+
+
+class TestQueryPlan(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.lock = threading.Lock()
+        self.running = self.max_running = 0
+
+    def fetch(self, expression, **kwargs):
+        with self.lock:
+            self.calls.append((str(expression), kwargs))
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+        return [{'time': '2013-10-01T00:00:00.000Z',
+                 'value': VALUES[str(expression)]}]
+
+    def test_dedupe(self):
+        plan = QueryPlan(self.fetch, [
+            'sum(req(ms)) / sum(req)',
+            'sum(req) + sum(req(ms))',
+            'sum(req)',
+            {'expression': 'sum(req)', 'step': '6e4'},
+            {'expression': 'max(req(ms)) * 2', 'step': 60000},
+        ], step='1e4', start=datetime(2013, 10, 1))
+        self.assertEqual(plan.requested, 7)
+        self.assertEqual(plan.unique, 4)
+        self.assertEqual(self.calls, [])
+        results = plan.execute()
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual([r[0]['value'] for r in results], [5.0, 12, 2, 2, 8])
+
+    def test_parallelism(self):
+        queries = ['sum(req(ms))', 'sum(req)', 'max(req(ms))']
+        QueryPlan(self.fetch, queries, parallelism=2).execute()
+        self.assertEqual(self.max_running, 2)
+        self.max_running = 0
+        QueryPlan(self.fetch, queries, parallelism=1).execute()
+        self.assertEqual(self.max_running, 1)
+
+    def test_columnar(self):
+        result = QueryPlan(self.fetch, ['sum(req) * 2'], step='1e4',
+                           columnar=True).execute()[0]
+        self.assertTrue(isinstance(result, MetricSeries))
+        self.assertEqual(list(result.values), [4])
+        self.assertEqual(self.calls[0][1], {'step': '1e4'})
+
+
+class TestCubeMetrics(unittest.TestCase):
+    def setUp(self):
+        def responder(method, path, body):
+            expression = parse_qs(urlparse(path).query)['expression'][0]
+            return 200, json.dumps([{'time': '2013-10-01T00:00:00.000Z',
+                                     'value': VALUES[expression]}])
+        self.server = StubServer(responder)
+        self.cube = Cube('127.0.0.1', evaluator_port=self.server.port)
+
+    def tearDown(self):
+        self.cube.close()
+        self.server.stop()
+
+    def test_metrics(self):
+        queries = ['sum(req(ms)) / sum(req)', 'sum(req)', 'sum(req(ms))']
+        plan = self.cube.plan_metrics(queries, step='1e4', start='2013-10-01')
+        self.assertEqual((plan.requested, plan.unique), (4, 2))
+        results = self.cube.metrics(queries, step='1e4', start='2013-10-01')
+        self.assertEqual([r[0]['value'] for r in results], [5.0, 2, 10])
+        self.assertEqual(len(self.server.requests), 2)
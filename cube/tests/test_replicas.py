@@ -0,0 +1,253 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import threading
+import time
+import unittest
+
+from cube import Cube
+from cube.replicas import Replica, ReplicaSet, EWMA, percentile
+from cube.tests import StubServer
+
+
+class Down(Exception):
+    pass
+
+
+class BadRequest(Exception):
+    pass
+
+
+class Answer(object):
+    def __init__(self, host):
+        self.host = host
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_set(count=2, **kwargs):
+    replicas = [Replica('r{0}'.format(i), None, None) for i in range(count)]
+    kwargs.setdefault('is_failure', lambda exc: isinstance(exc, Down))
+    return ReplicaSet(replicas, **kwargs)
+
+
+class TestReplicaSet(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([3], 1), 3)
+        self.assertEqual(percentile([], 50), None)
+
+    def test_least_outstanding(self):
+        replicas = make_set(3, hedge_percentile=None)
+        r0, r1, r2 = replicas.replicas
+        # Round robin while idle
+        self.assertEqual([replicas.choose().host for _ in range(6)],
+                         ['r0', 'r1', 'r2'] * 2)
+        r0.outstanding, r1.outstanding, r2.outstanding = 2, 0, 1
+        self.assertEqual(replicas.choose(), r1)
+        self.assertEqual(replicas.choose(exclude=(r1,)), r2)
+        self.assertEqual(replicas.choose(exclude=(r0, r1, r2)), None)
+
+    def test_ewma(self):
+        replicas = make_set(3, policy=EWMA, hedge_percentile=None)
+        delays = {'r0': 0.03, 'r1': 0.001, 'r2': 0.015}
+
+        def func(replica):
+            time.sleep(delays[replica.host])
+            return replica.host
+        # Each one is measured first
+        self.assertEqual(sorted(replicas.call(func) for _ in range(3)),
+                         ['r0', 'r1', 'r2'])
+        self.assertEqual([replicas.call(func) for _ in range(5)],
+                         ['r1'] * 5)
+        self.assertTrue(replicas.replicas[0].ewma >
+                        replicas.replicas[1].ewma)
+        self.assertRaises(ValueError, make_set, policy='random')
+
+    def test_hedge(self):
+        replicas = make_set(hedge_delay=0.01)
+        release = threading.Event()
+        answers = []
+
+        def func(replica):
+            if replica.host == 'r0':
+                release.wait()
+            answer = Answer(replica.host)
+            answers.append(answer)
+            return answer
+
+        self.assertEqual(replicas.call(func).host, 'r1')
+        self.assertEqual((replicas.hedged, replicas.hedge_wins), (1, 1))
+        release.set()
+        while len(answers) < 2:
+            time.sleep(0.001)
+        time.sleep(0.01)
+        # The late answer is dropped
+        self.assertEqual([a.closed for a in answers], [False, True])
+        self.assertEqual(replicas.replicas[0].outstanding, 0)
+
+        # Fast enough, not hedged
+        replicas.hedge_delay = 5
+        replicas.call(func)
+        self.assertEqual(replicas.hedged, 1)
+        # Not hedged either
+        replicas.call(func, hedge=False)
+        self.assertEqual(replicas.hedged, 1)
+
+    def test_hedge_percentile(self):
+        replicas = make_set(hedge_percentile=90)
+        self.assertEqual(replicas.hedge_after(), None)
+        for i in range(1, 21):
+            replicas.replicas[i % 2].latencies.append(i / 1000.0)
+            replicas._samples += 1
+        self.assertEqual(replicas.hedge_after(), 0.018)
+        replicas.hedge_percentile = None
+        self.assertEqual(replicas.hedge_after(), None)
+
+    def test_hedge_on_error(self):
+        replicas = make_set(hedge_delay=5)
+
+        def func(replica):
+            if replica.host == 'r0':
+                raise Down()
+            return replica.host
+        start = time.time()
+        self.assertEqual(replicas.call(func), 'r1')
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual(replicas.replicas[0].errors, 1)
+
+        def fail(replica):
+            raise Down(replica.host)
+        self.assertRaises(Down, replicas.call, fail)
+
+        def bad(replica):
+            raise BadRequest()
+        calls = replicas.calls
+        self.assertRaises(BadRequest, replicas.call, bad)
+        self.assertEqual(replicas.calls, calls + 1)
+        # The request is to blame, not the replica
+        self.assertEqual([r.errors for r in replicas.replicas], [2, 1])
+
+    def test_eject(self):
+        replicas = make_set(hedge_percentile=None, eject_after=2,
+                            eject_for=0.05)
+        r0, r1 = replicas.replicas
+
+        def func(replica):
+            if replica is r0:
+                raise Down()
+            return replica.host
+        for _ in range(4):
+            try:
+                replicas.call(func)
+            except Down:
+                pass
+        self.assertTrue(r0.ejected)
+        self.assertEqual(r0.stats['errors'], 2)
+        self.assertEqual([replicas.call(func) for _ in range(5)],
+                         ['r1'] * 5)
+        # All ejected, tried anyway
+        r1.ejected_until = time.time() + 10
+        self.assertTrue(replicas.choose() in (r0, r1))
+        r1.ejected_until = 0
+
+        time.sleep(0.06)
+        self.assertFalse(r0.ejected)
+        r0.outstanding = -10
+        self.assertEqual(replicas.choose(), r0)
+
+    def test_stats(self):
+        replicas = make_set(hedge_percentile=None)
+        for _ in range(4):
+            replicas.call(lambda replica: replica.host)
+        stats = replicas.stats
+        self.assertEqual(sorted(stats), ['r0', 'r1'])
+        self.assertEqual(stats['r0']['requests'], 2)
+        self.assertEqual(stats['r0']['errors'], 0)
+        self.assertEqual(stats['r0']['outstanding'], 0)
+        self.assertFalse(stats['r0']['ejected'])
+        for key in ['ewma_ms', 'p50_ms', 'p90_ms', 'p99_ms']:
+            self.assertTrue(stats['r1'][key] >= 0)
+        self.assertEqual(Replica('r', None, None).stats['p99_ms'], None)
+
+
+class TestCubeReplicas(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.status = {}
+
+        def responder(port):
+            def respond(method, path, body):
+                if path.startswith('/1.0/metric') and port == self.slow:
+                    self.release.wait(5)
+                status = self.status.get(port, 200)
+                return status, json.dumps([{'port': port}])
+            return respond
+        self.servers = [StubServer() for _ in range(2)]
+        for server in self.servers:
+            server.responder = responder(server.port)
+        self.hosts = ['127.0.0.1:{0}'.format(s.port) for s in self.servers]
+        self.slow = None
+        self.cube = None
+
+    def tearDown(self):
+        self.release.set()
+        if self.cube is not None:
+            self.cube.close()
+        for server in self.servers:
+            server.stop()
+
+    def test_hedged_metric(self):
+        self.cube = Cube(evaluators=self.hosts, hedge_delay=0.05)
+        self.assertEqual(self.cube.evaluator_url,
+                         'http://{0}/1.0/'.format(self.hosts[0]))
+        self.slow = self.servers[0].port
+        result = self.cube.metric('sum(test)', step='1e4',
+                                  start='2013-10-01')
+        self.assertEqual(result, [{'port': self.servers[1].port}])
+        self.assertEqual(self.cube.replicas.hedge_wins, 1)
+        stats = self.cube.replicas.stats
+        self.assertEqual(stats[self.hosts[1]]['requests'], 1)
+        self.assertEqual(stats[self.hosts[0]]['outstanding'], 1)
+
+    def test_balance(self):
+        self.cube = Cube(evaluators=self.hosts, hedge_percentile=None)
+        for _ in range(4):
+            self.cube.event('test')
+        self.assertEqual([len(s.requests) for s in self.servers], [2, 2])
+        self.assertEqual(list(self.cube.iter_events('test')),
+                         [{'port': self.servers[0].port}])
+        self.cube.types()
+        self.assertEqual([len(s.requests) for s in self.servers], [3, 3])
+
+    def test_eject(self):
+        self.cube = Cube(evaluators=self.hosts, hedge_percentile=None,
+                         eject_after=1, eject_for=60)
+        self.status[self.servers[0].port] = 503
+        self.assertRaises(self.cube.evaluator_session.HTTPError,
+                          self.cube.event, 'test')
+        for _ in range(3):
+            self.assertEqual(self.cube.event('test'),
+                             [{'port': self.servers[1].port}])
+        self.assertTrue(self.cube.replicas.stats[self.hosts[0]]['ejected'])
+
+        # The query is to blame, the replica stays in
+        self.status[self.servers[1].port] = 400
+        self.assertRaises(self.cube.evaluator_session.HTTPError,
+                          self.cube.event, 'test')
+        self.assertFalse(self.cube.replicas.stats[self.hosts[1]]['ejected'])
+
+    def test_default_port(self):
+        self.cube = Cube('127.0.0.1', evaluator_port=self.servers[0].port)
+        self.assertEqual(len(self.cube.replicas), 1)
+        self.assertEqual(self.cube.event('test'),
+                         [{'port': self.servers[0].port}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import math
+import unittest
+
+from cube import Cube
+from cube.result import MetricSeries
+from cube.tests import StubServer
+
+BUCKETS = [{'time': '2013-10-01T00:00:00.000Z', 'value': 3},
+           {'time': '2013-10-01T00:00:10.000Z', 'value': 1.5},
+           {'time': '2013-10-01T00:00:20.000Z', 'value': None}]
+
+# As serialized by the evaluator
+RESPONSE = ('[{"time":"2013-10-01T00:00:00.000Z","value":3},'
+            '{"time":"2013-10-01T00:00:10.000Z","value":1.5},'
+            '{"time":"2013-10-01T00:00:20.000Z","value":null}]')
+
+
+class TestMetricSeries(unittest.TestCase):
+    def test_from_json(self):
+        series = MetricSeries.from_json(RESPONSE)
+        self.assertEqual(list(series.times),
+                         [1380585600000, 1380585610000, 1380585620000])
+        self.assertEqual(list(series.values)[:2], [3.0, 1.5])
+        self.assertTrue(math.isnan(series.values[2]))
+        self.assertEqual(series.to_list(), BUCKETS)
+        self.assertEqual(MetricSeries.from_json(RESPONSE, step=10000), series)
+
+    def test_from_json_fallback(self):
+        text = json.dumps([{'value': 2, 'time': '2013-10-01T00:00:00.000Z'},
+                           {'time': '2013-10-01T00:00:10.000Z'}])
+        series = MetricSeries.from_json(text)
+        self.assertEqual(len(series), 2)
+        self.assertEqual(series[0], {'time': '2013-10-01T00:00:00.000Z',
+                                     'value': 2})
+        self.assertEqual(series[1]['value'], None)
+
+    def test_from_buckets(self):
+        series = MetricSeries.from_buckets(BUCKETS)
+        self.assertEqual(series, MetricSeries.from_json(json.dumps(BUCKETS)))
+        self.assertEqual(len(series[1:]), 2)
+        self.assertEqual(list(series.items())[0], (1380585600000, 3.0))
+
+    def test_length_mismatch(self):
+        self.assertRaises(ValueError, MetricSeries, [1, 2], [1.0])
+
+
+class TestCubeColumnar(unittest.TestCase):
+    def test_columnar(self):
+        server = StubServer(lambda method, path, body:
+                            (200, RESPONSE))
+        cube = Cube('127.0.0.1', evaluator_port=server.port)
+        series = cube.metric('sum(test)', step='1e4', columnar=True)
+        self.assertTrue(isinstance(series, MetricSeries))
+        self.assertEqual(series.to_list(), BUCKETS)
+        cube.close()
+        server.stop()
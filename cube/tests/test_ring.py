@@ -0,0 +1,218 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+
+from cube import Cube
+from cube.ring import HashRing
+from cube.tests import StubServer
+
+TYPES = ['type{0}'.format(i) for i in range(1000)]
+
+
+class TestHashRing(unittest.TestCase):
+    def test_get(self):
+        ring = HashRing(['a', 'b', 'c'])
+        self.assertEqual(len(ring), 3)
+        self.assertTrue('b' in ring)
+        owners = Counter(ring.get(t) for t in TYPES)
+        self.assertEqual(sorted(owners), ['a', 'b', 'c'])
+        # Roughly even
+        for count in owners.values():
+            self.assertTrue(200 < count < 466, owners)
+        # Doesn't depend on the order nodes were added
+        other = HashRing(['c', 'a', 'b'])
+        self.assertEqual([ring.get(t) for t in TYPES],
+                         [other.get(t) for t in TYPES])
+
+    def test_rebalance(self):
+        ring = HashRing(['a', 'b', 'c'])
+        before = dict((t, ring.get(t)) for t in TYPES)
+
+        ring.add('d')
+        moved = [t for t in TYPES if ring.get(t) != before[t]]
+        # Only the keys taken over by d move
+        self.assertEqual(set(ring.get(t) for t in moved), set(['d']))
+        self.assertTrue(150 < len(moved) < 350, len(moved))
+
+        ring.remove('d')
+        self.assertEqual(dict((t, ring.get(t)) for t in TYPES), before)
+        ring.remove('a')
+        for t in TYPES:
+            if before[t] != 'a':
+                self.assertEqual(ring.get(t), before[t])
+
+    def test_errors(self):
+        ring = HashRing(['a'])
+        self.assertRaises(ValueError, ring.add, 'a')
+        self.assertRaises(ValueError, ring.remove, 'b')
+        ring.remove('a')
+        self.assertRaises(LookupError, ring.get, 'test')
+
+
+class ShardingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.servers = [StubServer() for _ in range(3)]
+        self.hosts = ['127.0.0.1:{0}'.format(s.port) for s in self.servers]
+        self.cube = None
+
+    def tearDown(self):
+        if self.cube is not None:
+            self.cube.close()
+        for server in self.servers:
+            server.stop()
+
+    def received(self):
+        """ event type => set of the server indexes it reached. """
+        types = {}
+        for i, server in enumerate(self.servers):
+            for method, path, headers, body in server.requests:
+                for event in json.loads(body.decode('utf-8')):
+                    types.setdefault(event['type'], set()).add(i)
+        return types
+
+    def server_of(self, event_type):
+        return self.hosts.index(self.cube.ring.get(event_type))
+
+
+class TestCubeSharding(ShardingTestCase):
+    def test_put(self):
+        self.cube = Cube(collectors=self.hosts)
+        types = TYPES[:30]
+        for event_type in types:
+            self.cube.put(event_type, {'value': 1})
+        received = self.received()
+        self.assertEqual(sorted(received), sorted(types))
+        for event_type in types:
+            self.assertEqual(received[event_type],
+                             set([self.server_of(event_type)]))
+        # Spread over all the collectors, each with its own pool
+        self.assertTrue(all(server.requests for server in self.servers))
+        for server in self.servers:
+            self.assertEqual(len(server.clients), 1)
+
+    def test_put_many(self):
+        self.cube = Cube(collectors=self.hosts)
+        events = [{'type': TYPES[i % 40], 'data': {'i': i}}
+                  for i in range(200)]
+        results = self.cube.put_many(events)
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(sum(len(r.events) for r in results), 200)
+        # One POST per collector
+        self.assertEqual(len(results), 3)
+        for event_type, servers in self.received().items():
+            self.assertEqual(servers, set([self.server_of(event_type)]))
+        # Per collector order is kept
+        for server in self.servers:
+            body = json.loads(server.requests[0][3].decode('utf-8'))
+            indexes = [e['data']['i'] for e in body]
+            self.assertEqual(indexes, sorted(indexes))
+
+    def test_async_put(self):
+        self.cube = Cube(collectors=self.hosts, async_put=True, linger=10)
+        for event_type in TYPES[:30]:
+            self.cube.put(event_type)
+        self.assertTrue(self.cube.flush())
+        # Batched per collector
+        for server in self.servers:
+            self.assertEqual(len(server.requests), 1)
+        senders = [c.sender for c in self.cube.collectors.values()]
+        self.assertEqual(len(set(senders)), 3)
+        self.assertEqual(sum(s.sent for s in senders), 30)
+        for event_type, servers in self.received().items():
+            self.assertEqual(servers, set([self.server_of(event_type)]))
+
+    def test_rebalance(self):
+        self.cube = Cube(collectors=self.hosts[:2])
+        types = TYPES[:30]
+        before = dict((t, self.cube.ring.get(t)) for t in types)
+
+        self.cube.add_collector(self.hosts[2])
+        self.assertEqual(list(self.cube.collectors), self.hosts)
+        for event_type in types:
+            self.cube.put(event_type)
+        received = self.received()
+        for event_type in types:
+            self.assertEqual(received[event_type],
+                             set([self.server_of(event_type)]))
+            if self.server_of(event_type) != 2:
+                self.assertEqual(self.cube.ring.get(event_type),
+                                 before[event_type])
+        self.assertTrue(self.servers[2].requests)
+
+        self.cube.remove_collector(self.hosts[0])
+        self.assertEqual(list(self.cube.collectors), self.hosts[1:])
+        self.assertEqual(self.cube.collector_url,
+                         'http://{0}/1.0/'.format(self.hosts[1]))
+        sent = len(self.servers[0].requests)
+        for event_type in types:
+            self.cube.put(event_type)
+        self.assertEqual(len(self.servers[0].requests), sent)
+
+        self.assertRaises(ValueError, self.cube.add_collector, self.hosts[1])
+        self.assertRaises(ValueError, self.cube.remove_collector,
+                          self.hosts[0])
+        self.cube.remove_collector(self.hosts[1])
+        self.assertRaises(ValueError, self.cube.remove_collector,
+                          self.hosts[2])
+
+    def test_remove_flushes(self):
+        self.cube = Cube(collectors=self.hosts, async_put=True, linger=10)
+        for event_type in TYPES[:30]:
+            self.cube.put(event_type)
+        self.cube.remove_collector(self.hosts[0])
+        # Its enqueued events were still sent to it
+        self.assertEqual(len(self.servers[0].requests), 1)
+
+    def test_default_port(self):
+        self.cube = Cube('127.0.0.1', collector_port=self.servers[0].port,
+                         collectors=['127.0.0.1'])
+        self.assertEqual(list(self.cube.collectors), self.hosts[:1])
+        self.cube.put('test')
+        self.assertEqual(len(self.servers[0].requests), 1)
+
+
+class TestShardingSpool(ShardingTestCase):
+    def setUp(self):
+        super(TestShardingSpool, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(TestShardingSpool, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def test_outage(self):
+        down = StubServer(lambda method, path, body: (503, '{}'))
+        self.servers.append(down)
+        self.hosts.append('127.0.0.1:{0}'.format(down.port))
+        self.cube = Cube(collectors=self.hosts, spool_dir=self.directory,
+                         spool_retry=60)
+        types = TYPES[:40]
+        for event_type in types:
+            self.cube.put(event_type)
+        down_types = [t for t in types if self.server_of(t) == 3]
+        self.assertTrue(down_types)
+        self.assertEqual(self.cube.spool.appended, len(down_types))
+        # Only the collector that's down is skipped
+        self.assertEqual(len(down.requests), 1)
+        self.assertTrue(self.cube.collectors[self.hosts[3]].spool_until)
+        self.assertFalse(self.cube.collectors[self.hosts[0]].spool_until)
+
+        self.cube._replay_thread.join(5)
+        # The spooled events go to the new owners of their type
+        self.cube.remove_collector(self.hosts[3])
+        self.assertEqual(self.cube.replay_spool(), len(down_types))
+        self.assertFalse(self.cube.spool.pending)
+        self.servers.remove(down)
+        down.stop()
+        received = self.received()
+        for event_type in types:
+            self.assertEqual(received[event_type],
+                             set([self.server_of(event_type)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# -*- encoding: utf-8 -*-
+
+import math
+import unittest
+from datetime import datetime
+
+from cube import rollup as rollup_module
+from cube.expression import EventExpression, Median, Sum
+from cube.result import MetricSeries, NAN
+from cube.rollup import (NotComposable, metric_type, multi_resolution,
+                         rollup)
+from cube.time_utils import STEP_10_SEC, STEP_1_MIN, to_epoch_ms
+
+START = to_epoch_ms(datetime(2013, 10, 1))
+
+
+def series(values, step=STEP_10_SEC, start=START):
+    return MetricSeries([start + i * step for i in range(len(values))],
+                        values)
+
+
+def values(series):
+    return [None if math.isnan(v) else v for v in series.values]
+
+
+class RollupTests(object):
+    def test_sum(self):
+        result = rollup(series(range(12)), STEP_10_SEC, STEP_1_MIN, 'sum')
+        self.assertEqual(list(result.times), [START, START + STEP_1_MIN])
+        self.assertEqual(values(result), [15, 51])
+
+    def test_min_max(self):
+        data = [5, 1, 9, NAN, 3, 2, NAN, NAN, NAN, NAN, NAN, NAN]
+        self.assertEqual(values(rollup(series(data), STEP_10_SEC,
+                                       STEP_1_MIN, 'min')), [1, None])
+        self.assertEqual(values(rollup(series(data), STEP_10_SEC,
+                                       STEP_1_MIN, 'max')), [9, None])
+        self.assertEqual(values(rollup(series(data), STEP_10_SEC,
+                                       STEP_1_MIN, 'sum')), [20, None])
+
+    def test_unaligned_start(self):
+        result = rollup(series(range(8), start=START + 4 * STEP_10_SEC),
+                        STEP_10_SEC, STEP_1_MIN, 'sum')
+        self.assertEqual(values(result), [1, 27])
+        result = rollup(series(range(8), start=START + 4 * STEP_10_SEC),
+                        STEP_10_SEC, STEP_1_MIN, 'sum', drop_partial=True)
+        self.assertEqual(values(result), [27])
+
+    def test_approximate(self):
+        data = series([1, 5, 3, 8, 2, 4])
+        self.assertRaises(NotComposable, rollup, data, STEP_10_SEC,
+                          STEP_1_MIN, 'median')
+        result = rollup(data, STEP_10_SEC, STEP_1_MIN, 'median',
+                        approximate=True)
+        self.assertEqual(values(result), [3.5])
+        result = rollup(data, STEP_10_SEC, STEP_1_MIN, 'distinct',
+                        approximate=True)
+        self.assertEqual(values(result), [8])
+
+    def test_invalid_steps(self):
+        self.assertRaises(ValueError, rollup, series([1]), STEP_1_MIN,
+                          STEP_10_SEC * 3 // 2, 'sum')
+
+
+class TestRollup(RollupTests, unittest.TestCase):
+    pass
+
+
+class TestRollupPurePython(RollupTests, unittest.TestCase):
+    def setUp(self):
+        self.numpy = rollup_module.numpy
+        rollup_module.numpy = None
+
+    def tearDown(self):
+        rollup_module.numpy = self.numpy
+
+
+class FakeCube(object):
+    def __init__(self, count=360):
+        self.queries = []
+        self.count = count
+
+    def metric(self, expression, **kwargs):
+        self.queries.append(kwargs)
+        return series([1] * self.count)
+
+
+class TestMultiResolution(unittest.TestCase):
+    def test_single_fetch(self):
+        cube = FakeCube()
+        result = multi_resolution(cube, 'sum(request)',
+                                  ['1e4', '6e4', '36e5'],
+                                  start=datetime(2013, 10, 1, 0, 20))
+        self.assertEqual(len(cube.queries), 1)
+        self.assertEqual(cube.queries[0]['step'], '1e4')
+        self.assertEqual(cube.queries[0]['start'], datetime(2013, 10, 1))
+        self.assertEqual(len(result['6e4']), 60)
+        self.assertEqual(values(result['36e5']), [360])
+
+    def test_unaligned_stop(self):
+        # Up to 01:20, the 01:00 hour is partial
+        result = multi_resolution(FakeCube(480), 'sum(request)',
+                                  ['1e4', '6e4', '36e5'],
+                                  start=datetime(2013, 10, 1),
+                                  stop=datetime(2013, 10, 1, 1, 20))
+        self.assertEqual(len(result['1e4']), 480)
+        self.assertEqual(len(result['6e4']), 80)
+        self.assertEqual(values(result['36e5']), [360])
+
+    def test_metric_type(self):
+        self.assertEqual(metric_type(Sum(EventExpression('request'))), 'sum')
+        self.assertRaises(NotComposable, multi_resolution, FakeCube(),
+                          Median(EventExpression('request', 'ms')),
+                          ['1e4', '6e4'])
+        self.assertRaises(NotComposable, metric_type, 'request')
+        self.assertEqual(metric_type(' max(request(ms).eq(path, "/"))'), 'max')
+        for expression in ['sum(request(ms)) / sum(request)',
+                           'sum(request) * 2', '3', 'sum(request']:
+            self.assertRaises(NotComposable, metric_type, expression)
+        self.assertRaises(NotComposable, metric_type,
+                          Sum(EventExpression('request')) / 2)
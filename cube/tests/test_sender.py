@@ -0,0 +1,110 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import threading
+import unittest
+
+from cube import Cube
+from cube.sender import BackgroundSender, PutFuture, EventDropped
+from cube.tests import StubServer
+
+
+class TestBackgroundSender(unittest.TestCase):
+    def setUp(self):
+        self.bodies = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def post(self, data, count):
+        self.gate.wait()
+        self.bodies.append(json.loads(data))
+
+    def test_batch_on_count(self):
+        sender = BackgroundSender(self.post, max_events=10, linger=60)
+        for i in range(25):
+            sender.put({'i': i})
+        self.assertTrue(sender.flush(5))
+        self.assertEqual([len(b) for b in self.bodies], [10, 10, 5])
+        self.assertEqual(sender.sent, 25)
+        self.assertEqual(sender.batches, 3)
+        sender.close()
+
+    def test_batch_on_bytes(self):
+        size = len(json.dumps({'i': 0}))
+        sender = BackgroundSender(self.post, max_bytes=2 + 2 * size + 1,
+                                  linger=60)
+        for i in range(5):
+            sender.put({'i': i})
+        sender.close(5)
+        self.assertEqual([len(b) for b in self.bodies], [2, 2, 1])
+
+    def test_linger(self):
+        sender = BackgroundSender(self.post, linger=0.01)
+        future = sender.put({'i': 1}, PutFuture())
+        self.assertEqual(future.result(5), [{'i': 1}])
+        self.assertFalse(future.spooled())
+        self.assertEqual(self.bodies, [[{'i': 1}]])
+        sender.close()
+
+    def test_drop_newest(self):
+        self.gate.clear()
+        sender = BackgroundSender(self.post, queue_size=2, max_events=1,
+                                  overflow='drop_newest')
+        futures = [sender.put({'i': i}, PutFuture()) for i in range(10)]
+        self.assertTrue(isinstance(futures[-1].exception(5), EventDropped))
+        self.gate.set()
+        sender.close(5)
+        self.assertTrue(sender.dropped > 0)
+        self.assertEqual(sender.dropped + sender.sent, 10)
+        self.assertEqual(self.bodies[0], [{'i': 0}])
+
+    def test_drop_oldest(self):
+        self.gate.clear()
+        sender = BackgroundSender(self.post, queue_size=2, max_events=1,
+                                  overflow='drop_oldest')
+        futures = [sender.put({'i': i}, PutFuture()) for i in range(10)]
+        self.assertEqual(futures[-1].done(), False)
+        self.gate.set()
+        sender.close(5)
+        self.assertEqual(sender.dropped + sender.sent, 10)
+        self.assertEqual(self.bodies[-1], [{'i': 9}])
+
+    def test_failure(self):
+        def post(data, count):
+            raise ValueError("down")
+        sender = BackgroundSender(post, linger=0)
+        future = sender.put({'i': 1}, PutFuture())
+        self.assertRaises(ValueError, future.result, 5)
+        sender.close()
+        self.assertEqual(sender.failed, 1)
+
+    def test_unencodable_event(self):
+        sender = BackgroundSender(self.post, linger=0.01)
+        poison = sender.put({'time': object()}, PutFuture())
+        future = sender.put({'i': 1}, PutFuture())
+        self.assertTrue(poison.exception(5) is not None)
+        self.assertEqual(future.result(5), [{'i': 1}])
+        self.assertTrue(sender.flush(5))
+        self.assertEqual((sender.sent, sender.failed), (1, 1))
+        self.assertEqual(self.bodies, [[{'i': 1}]])
+        self.assertTrue(sender.close(5))
+
+    def test_invalid_overflow(self):
+        self.assertRaises(ValueError, BackgroundSender, self.post,
+                          overflow='nope')
+
+
+class TestAsyncPut(unittest.TestCase):
+    def test_async_put(self):
+        server = StubServer()
+        cube = Cube('127.0.0.1', collector_port=server.port,
+                    async_put=True, linger=60)
+        for i in range(3):
+            self.assertEqual(cube.put('test', {'i': i})[0]['type'], 'test')
+        future = cube.put('test', {'i': 3}, future=True)
+        cube.close()
+        self.assertTrue(future.done())
+        self.assertEqual(len(server.requests), 1)
+        sent = json.loads(server.requests[0][3].decode('utf-8'))
+        self.assertEqual([e['data']['i'] for e in sent], [0, 1, 2, 3])
+        server.stop()
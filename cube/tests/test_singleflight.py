@@ -0,0 +1,179 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import threading
+import time
+import unittest
+from datetime import datetime
+
+from cube import Cube
+from cube.singleflight import SingleFlight, process_singleflight
+from cube.tests import StubServer
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_coalesce(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls, results = [], []
+
+        def func():
+            calls.append(1)
+            release.wait()
+            return [1, 2]
+
+        def target():
+            results.append(flight.do('key', func))
+
+        leader = threading.Thread(target=target)
+        leader.start()
+        while not flight.in_flight:
+            time.sleep(0.001)
+        followers = [threading.Thread(target=target) for _ in range(4)]
+        for t in followers:
+            t.start()
+        while flight.coalesced < 4:
+            time.sleep(0.001)
+        release.set()
+        for t in [leader] + followers:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [[1, 2]] * 5)
+        # Each caller got its own copy
+        self.assertEqual(len(set(id(result) for result in results)), 5)
+        self.assertEqual(flight.stats, dict(calls=5, executed=1, coalesced=4,
+                                            in_flight=0))
+        # Not in flight anymore, runs again
+        flight.do('key', func)
+        self.assertEqual(len(calls), 2)
+
+    def test_shared_result(self):
+        flight = SingleFlight(copy=None)
+        release = threading.Event()
+        result = [1, 2]
+        results = []
+
+        def target():
+            results.append(flight.do('key', lambda: release.wait() and
+                                     result))
+
+        threads = [threading.Thread(target=target) for _ in range(3)]
+        threads[0].start()
+        while not flight.in_flight:
+            time.sleep(0.001)
+        for t in threads[1:]:
+            t.start()
+        while flight.coalesced < 2:
+            time.sleep(0.001)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertTrue(all(r is result for r in results))
+        # Not coalesced, not copied either
+        self.assertTrue(SingleFlight().do('key', lambda: result) is result)
+
+    def test_error(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        errors = []
+
+        def func():
+            release.wait()
+            raise ValueError('boom')
+
+        def target():
+            try:
+                flight.do('key', func)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=target) for _ in range(3)]
+        threads[0].start()
+        while not flight.in_flight:
+            time.sleep(0.001)
+        for t in threads[1:]:
+            t.start()
+        while flight.coalesced < 2:
+            time.sleep(0.001)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(flight.in_flight, 0)
+
+
+class TestCubeCoalescing(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+
+        def responder(method, path, body):
+            self.release.wait(5)
+            return 200, json.dumps([{'time': '2013-10-01T00:00:00.000Z',
+                                     'value': 1}])
+        self.server = StubServer(responder)
+        self.cubes = []
+
+    def tearDown(self):
+        self.release.set()
+        for cube in self.cubes:
+            cube.close()
+        self.server.stop()
+
+    def cube(self, **kwargs):
+        cube = Cube('127.0.0.1', evaluator_port=self.server.port, **kwargs)
+        self.cubes.append(cube)
+        return cube
+
+    def query(self, cubes, count, flight, **kwargs):
+        results = []
+
+        def target(cube):
+            results.append(cube.metric('sum(request)', step='1e4',
+                                       start=datetime(2013, 10, 1),
+                                       **kwargs))
+
+        threads = [threading.Thread(target=target,
+                                    args=(cubes[i % len(cubes)],))
+                   for i in range(count)]
+        for t in threads:
+            t.start()
+        deadline = time.time() + 5
+        while flight is not None and flight.coalesced < count - 1 and \
+                time.time() < deadline:
+            time.sleep(0.001)
+        self.release.set()
+        for t in threads:
+            t.join()
+        self.release.clear()
+        return results
+
+    def test_instance(self):
+        cube = self.cube()
+        results = self.query([cube], 8, cube.singleflight)
+        self.assertEqual(len(results), 8)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(cube.singleflight.coalesced, 7)
+        # Callers own their result
+        results[0][0]['value'] = 2
+        self.assertEqual([r[0]['value'] for r in results[1:]], [1] * 7)
+
+    def test_distinct_queries(self):
+        cube = self.cube()
+        self.query([cube], 1, None)
+        self.query([cube], 1, None, stop=datetime(2013, 10, 2))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_shared(self):
+        flight = SingleFlight()
+        cubes = [self.cube(coalesce=flight), self.cube(coalesce=flight)]
+        self.query(cubes, 4, flight)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertTrue(self.cube(coalesce='process').singleflight is
+                        process_singleflight())
+
+    def test_disabled(self):
+        cube = self.cube(coalesce=False)
+        self.assertTrue(cube.singleflight is None)
+        self.release.set()
+        self.query([cube], 3, None)
+        self.assertEqual(len(self.server.requests), 3)
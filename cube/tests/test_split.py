@@ -0,0 +1,123 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+
+try:
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from urllib.parse import parse_qs, urlparse
+
+from cube import Cube
+from cube.split import split_range, fetch_ranges
+from cube.tests import StubServer
+from cube.time_utils import STEP_1_HOUR, format_iso, parse_iso
+
+
+class TestSplitRange(unittest.TestCase):
+    def test_split(self):
+        ranges = list(split_range(datetime(2013, 10, 1),
+                                  datetime(2013, 10, 1, 5, 30),
+                                  timedelta(hours=2)))
+        self.assertEqual([(a.hour, b.hour, b.minute) for a, b in ranges],
+                         [(0, 2, 0), (2, 4, 0), (4, 5, 30)])
+
+    def test_step_aligned(self):
+        ranges = list(split_range(datetime(2013, 10, 1, 0, 20),
+                                  datetime(2013, 10, 1, 5),
+                                  timedelta(minutes=150), STEP_1_HOUR))
+        self.assertEqual([(a.hour, b.hour) for a, b in ranges],
+                         [(0, 2), (2, 4), (4, 5)])
+
+    def test_invalid_size(self):
+        self.assertRaises(ValueError, list,
+                          split_range(datetime(2013, 10, 1),
+                                      datetime(2013, 10, 2), timedelta(0)))
+
+
+class TestFetchRanges(unittest.TestCase):
+    def hourly(self, start, stop):
+        result = []
+        # Inclusive stop, to check seams are deduplicated
+        while start <= stop:
+            result.append({'time': format_iso(start), 'value': start.hour})
+            start += timedelta(hours=1)
+        return list(reversed(result))
+
+    def test_no_duplicates_or_gaps(self):
+        lock = threading.Lock()
+        threads = set()
+
+        def fetch(start, stop):
+            with lock:
+                threads.add(threading.current_thread().name)
+            # Long enough for the other workers to pick up ranges
+            time.sleep(0.02)
+            return self.hourly(start, stop)
+        result = fetch_ranges(fetch, datetime(2013, 10, 1),
+                              datetime(2013, 10, 1, 23), timedelta(hours=3),
+                              STEP_1_HOUR, parallelism=4)
+        self.assertEqual([b['value'] for b in result], list(range(24)))
+        self.assertTrue(len(threads) > 1)
+
+    def test_limit(self):
+        fetched = []
+
+        def fetch(start, stop):
+            fetched.append(start.hour)
+            # The latest 2 items of the sub-range, like the evaluator
+            return self.hourly(start, stop)[:2]
+        result = fetch_ranges(fetch, datetime(2013, 10, 1),
+                              datetime(2013, 10, 1, 23), timedelta(hours=3),
+                              STEP_1_HOUR, parallelism=2, limit=5)
+        self.assertEqual([b['value'] for b in result], [18, 20, 21, 22, 23])
+        self.assertEqual(sorted(fetched), [12, 15, 18, 21])
+
+
+class TestCubeSplit(unittest.TestCase):
+    def test_metric_split(self):
+        def responder(method, path, body):
+            params = parse_qs(urlparse(path).query)
+            start = parse_iso(params['start'][0])
+            stop = parse_iso(params['stop'][0])
+            result = []
+            while start < stop:
+                result.append({'time': format_iso(start), 'value': 1})
+                start += timedelta(hours=1)
+            return 200, json.dumps(result)
+        server = StubServer(responder)
+        cube = Cube('127.0.0.1', evaluator_port=server.port)
+        result = cube.metric('sum(test)', step='36e5',
+                             start=datetime(2013, 10, 1),
+                             stop=datetime(2013, 10, 8),
+                             split=timedelta(days=1), parallelism=3)
+        self.assertEqual(len(result), 7 * 24)
+        self.assertEqual(len(server.requests), 7)
+        times = [parse_iso(b['time']) for b in result]
+        self.assertEqual(times, sorted(set(times)))
+        cube.close()
+        server.stop()
+
+    def test_event_limit(self):
+        def responder(method, path, body):
+            params = parse_qs(urlparse(path).query)
+            start = parse_iso(params['start'][0])
+            stop = parse_iso(params['stop'][0])
+            result = []
+            while start < stop:
+                result.insert(0, {'time': format_iso(start)})
+                start += timedelta(hours=1)
+            return 200, json.dumps(result[:int(params['limit'][0])])
+        server = StubServer(responder)
+        cube = Cube('127.0.0.1', evaluator_port=server.port)
+        result = cube.event('test', start=datetime(2013, 10, 1),
+                            stop=datetime(2013, 10, 8), limit='30',
+                            split=timedelta(days=1), parallelism=1)
+        self.assertEqual(len(result), 30)
+        self.assertEqual(result[-1]['time'], '2013-10-07T23:00:00.000Z')
+        self.assertEqual(len(server.requests), 2)
+        cube.close()
+        server.stop()
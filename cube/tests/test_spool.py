@@ -0,0 +1,149 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from cube import Cube
+from cube.spool import Spool
+from cube.tests import StubServer
+
+
+class SpoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sent = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def send(self, data):
+        self.sent.extend(json.loads(data.decode('utf-8')))
+
+    def payload(self, i):
+        return json.dumps([{'type': 'test', 'data': {'i': i}}])
+
+
+class TestSpool(SpoolTestCase):
+    def test_append_replay(self):
+        spool = Spool(self.directory, segment_size=256)
+        for i in range(20):
+            self.assertTrue(spool.append(self.payload(i)))
+        self.assertTrue(spool.pending)
+        self.assertTrue(len(os.listdir(self.directory)) > 2)
+        self.assertEqual(spool.replay(self.send, max_events=3), 20)
+        self.assertEqual([e['data']['i'] for e in self.sent], list(range(20)))
+        self.assertFalse(spool.pending)
+        # Replayed segments are removed
+        self.assertEqual(len([n for n in os.listdir(self.directory)
+                              if n.endswith('.seg')]), 1)
+        spool.close()
+
+    def test_replay_failure(self):
+        spool = Spool(self.directory, segment_size=256)
+        for i in range(5):
+            spool.append(self.payload(i))
+
+        def fail(data):
+            raise IOError("down")
+        self.assertRaises(IOError, spool.replay, fail)
+        self.assertEqual(spool.replay(self.send, max_events=2), 5)
+        self.assertEqual(len(self.sent), 5)
+        spool.close()
+
+    def test_recovery(self):
+        spool = Spool(self.directory, segment_size=4096)
+        for i in range(5):
+            spool.append(self.payload(i))
+        spool.replay(self.send, max_events=2)
+        spool.append(self.payload(5))
+        spool.append(self.payload(6))
+        spool.close()
+        # Simulate a torn write of the last record
+        path = os.path.join(self.directory, sorted(
+            n for n in os.listdir(self.directory) if n.endswith('.seg'))[-1])
+        with open(path, 'r+b') as f:
+            data = f.read()
+            end = data.index(b'\0' * 16)
+            f.seek(end - 3)
+            f.write(b'\0\0\0')
+
+        self.sent = []
+        spool = Spool(self.directory, segment_size=4096)
+        self.assertTrue(spool.pending)
+        spool.replay(self.send)
+        self.assertEqual([e['data']['i'] for e in self.sent], [5])
+        spool.append(self.payload(7))
+        spool.replay(self.send)
+        self.assertEqual([e['data']['i'] for e in self.sent], [5, 7])
+        spool.close()
+
+    def test_drop_oldest(self):
+        spool = Spool(self.directory, segment_size=128, max_bytes=512)
+        for i in range(30):
+            self.assertTrue(spool.append(self.payload(i)))
+        self.assertTrue(spool.dropped > 0)
+        self.assertTrue(spool.size <= 512)
+        spool.replay(self.send)
+        self.assertEqual(self.sent[-1]['data']['i'], 29)
+        self.assertEqual(len(self.sent) + spool.dropped, 30)
+        spool.close()
+
+    def test_drop_newest(self):
+        spool = Spool(self.directory, segment_size=128, max_bytes=512,
+                      eviction='drop_newest')
+        results = [spool.append(self.payload(i)) for i in range(30)]
+        self.assertFalse(results[-1])
+        spool.replay(self.send)
+        self.assertEqual(self.sent[0]['data']['i'], 0)
+        self.assertEqual(len(self.sent) + spool.dropped, 30)
+        spool.close()
+
+
+class TestCubeSpool(SpoolTestCase):
+    def test_outage(self):
+        self.status = 503
+
+        def responder(method, path, body):
+            if self.status == 200:
+                self.send(body)
+            return self.status, '{}'
+        server = StubServer(responder)
+        cube = Cube('127.0.0.1', collector_port=server.port,
+                    spool_dir=self.directory, spool_retry=0)
+        cube.put('test', {'i': 0})
+        cube.put_many([{'type': 'test', 'data': {'i': i}}
+                       for i in range(1, 4)])
+        self.assertTrue(cube.spool.pending)
+        self.assertEqual(cube.spool.appended, 4)
+
+        self.status = 200
+        cube.put('test', {'i': 4})
+        cube._replay_thread.join(5)
+        self.assertFalse(cube.spool.pending)
+        self.assertEqual(sorted(e['data']['i'] for e in self.sent),
+                         [0, 1, 2, 3, 4])
+        cube.close()
+        server.stop()
+
+    def test_async_outage(self):
+        server = StubServer(lambda method, path, body: (503, '{}'))
+        cube = Cube('127.0.0.1', collector_port=server.port,
+                    spool_dir=self.directory, spool_retry=60,
+                    async_put=True, linger=0.01)
+        futures = [cube.put('test', {'i': i}, future=True) for i in range(3)]
+        self.assertTrue(cube.flush(5))
+        for i, future in enumerate(futures):
+            self.assertEqual(future.result(5)[0]['data'], {'i': i})
+            self.assertTrue(future.spooled())
+        # Spooled, not sent
+        self.assertEqual((cube.sender.sent, cube.sender.spooled), (0, 3))
+        self.assertEqual(cube.spool.appended, 3)
+
+        results = cube.put_many([{'type': 'test'}] * 2)
+        self.assertTrue(results[0].ok and results[0].spooled)
+        self.assertTrue('spooled' in repr(results[0]))
+        cube.close()
+        server.stop()
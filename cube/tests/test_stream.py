@@ -0,0 +1,64 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import unittest
+
+try:
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from urllib.parse import parse_qs, urlparse
+
+from cube import Cube
+from cube.stream import iter_json_array, iter_chunks
+from cube.tests import StubServer
+
+EVENTS = [{'time': '2013-10-01T00:00:{0:02d}.000Z'.format(i),
+           'data': {'path': u'/caf\xe9/{0}'.format(i), 'ms': i * 1.5}}
+          for i in range(50)]
+
+
+class TestIterJSONArray(unittest.TestCase):
+    def test_byte_chunks(self):
+        data = json.dumps(EVENTS, ensure_ascii=False).encode('utf-8')
+        for size in (1, 3, 7, 64, len(data)):
+            chunks = [data[i:i + size] for i in range(0, len(data), size)]
+            self.assertEqual(list(iter_json_array(chunks)), EVENTS)
+
+    def test_lazy(self):
+        def chunks():
+            yield b'[{"a": 1},'
+            raise AssertionError("read too much")
+        self.assertEqual(next(iter_json_array(chunks())), {'a': 1})
+
+    def test_numbers(self):
+        self.assertEqual(list(iter_json_array([b'[1', b'23, 4', b']'])),
+                         [123, 4])
+
+    def test_empty(self):
+        self.assertEqual(list(iter_json_array([b' [ ', b'] '])), [])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, list, iter_json_array([b'{}']))
+        self.assertRaises(ValueError, list, iter_json_array([b'[{"a": 1}']))
+
+    def test_iter_chunks(self):
+        self.assertEqual(list(iter_chunks(range(5), 5)), [list(range(5))])
+
+
+class TestCubeIterEvents(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer(lambda method, path, body:
+                                 (200, json.dumps(EVENTS)))
+        self.cube = Cube('127.0.0.1', evaluator_port=self.server.port)
+
+    def tearDown(self):
+        self.cube.close()
+        self.server.stop()
+
+    def test_iter_events(self):
+        self.assertEqual(list(self.cube.iter_events('test(path, ms)')),
+                         EVENTS)
+        chunks = list(self.cube.get_event('test').iter_events(chunk_size=20))
+        self.assertEqual([len(c) for c in chunks], [20, 20, 10])
+        params = parse_qs(urlparse(self.server.requests[1][1]).query)
+        self.assertEqual(params['expression'], ['test'])
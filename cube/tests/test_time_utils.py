@@ -52,3 +52,45 @@ class TestMetric(unittest.TestCase):
                          datetime(2012, 6, 29, 20, 33, 16, 573225))
         self.assertEqual(time_utils.timeago('1M', start=self.now),
                          datetime(2012, 6, 6, 20, 33, 16, 573225))
+
+    def test_parse_time_ms(self):
+        self.assertEqual(time_utils.parse_time_ms('2012-10-01T13:04:04.453Z'),
+                         1349096644453)
+        self.assertEqual(time_utils.parse_time_ms('1969-12-31T23:59:59.000Z'),
+                         -1000)
+        # Not Cube's fixed-width layout
+        self.assertEqual(time_utils.parse_time_ms('2012-10-01T13:04:04Z'),
+                         1349096644000)
+
+    def test_parse_times_ms(self):
+        regular = ['2012-10-01T13:00:{0:02d}.000Z'.format(s)
+                   for s in range(0, 60, 10)]
+        expected = list(range(1349096400000, 1349096460000, 10000))
+        self.assertEqual(time_utils.parse_times_ms(regular), expected)
+        self.assertEqual(time_utils.parse_times_ms(regular, step=10000),
+                         expected)
+        irregular = regular[:]
+        irregular[1] = '2012-10-01T13:00:05.000Z'
+        self.assertEqual(time_utils.parse_times_ms(irregular)[1],
+                         1349096405000)
+        self.assertEqual(time_utils.parse_times_ms([]), [])
+
+    def test_parse_times_ms_irregular(self):
+        times = list(range(1349096400000, 1349097400000, 10000))
+        times[50] += 250
+        values = [time_utils.format_iso(time_utils.from_epoch_ms(t))
+                  for t in times]
+        self.assertEqual(time_utils.parse_times_ms(values), times)
+        self.assertEqual(time_utils.parse_times_ms(values, step=10000), times)
+        # A gap and a duplicate bucket, same count and bounds as regular
+        times = list(range(1349096400000, 1349097400000, 10000))
+        times[30:31] = []
+        times[60:60] = [times[60]]
+        values = [time_utils.format_iso(time_utils.from_epoch_ms(t))
+                  for t in times]
+        self.assertEqual(time_utils.parse_times_ms(values, step=10000), times)
+        # Across midnight
+        times = list(range(1349135000000, 1349137000000, 10000))
+        values = [time_utils.format_iso(time_utils.from_epoch_ms(t))
+                  for t in times]
+        self.assertEqual(time_utils.parse_times_ms(values), times)
@@ -0,0 +1,193 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import socket
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+from cube import Cube
+from cube.transport import HTTPTransport, RequestsTransport, make_transport
+from cube.tests import StubServer
+
+
+class TransportTests(object):
+    transport = None
+
+    def setUp(self):
+        def responder(method, path, body):
+            if path.startswith('/error'):
+                return 500, '{"error": "boom"}'
+            if path.startswith('/1.0/event?'):
+                return 200, json.dumps([{'path': path}])
+            if path.startswith('/slow'):
+                time.sleep(0.5)
+            return 200, json.dumps({'method': method, 'path': path,
+                                    'body': body.decode('utf-8')})
+        self.server = StubServer(responder)
+        self.url = 'http://127.0.0.1:{0}/'.format(self.server.port)
+        self.t = make_transport(self.transport)
+
+    def tearDown(self):
+        self.t.close()
+        self.server.stop()
+
+    def test_get(self):
+        r = self.t.get(self.url + 'metric', params={'expression': 'sum(a)',
+                                                    'step': '1e4'})
+        self.assertEqual(r.status_code, 200)
+        path = r.json()['path']
+        self.assertTrue(path.startswith('/metric?'))
+        self.assertTrue('expression=sum%28a%29' in path)
+        self.assertTrue('step=1e4' in path)
+
+    def test_post(self):
+        r = self.t.post(self.url + 'event/put', '[{"type": "test"}]',
+                        headers={'content-type': 'application/json'})
+        r.raise_for_status()
+        self.assertEqual(r.json()['body'], '[{"type": "test"}]')
+        self.assertEqual(self.server.requests[0][2]['content-type'],
+                         'application/json')
+
+    def test_keep_alive(self):
+        for _ in range(5):
+            self.t.get(self.url).json()
+        self.assertEqual(len(self.server.clients), 1)
+
+    def test_errors(self):
+        r = self.t.get(self.url + 'error')
+        self.assertEqual(r.status_code, 500)
+        self.assertRaises(self.t.HTTPError, r.raise_for_status)
+        try:
+            r.raise_for_status()
+        except self.t.RequestException as e:
+            self.assertEqual(e.response.status_code, 500)
+        self.assertRaises(self.t.Timeout, self.t.get, self.url + 'slow',
+                          timeout=0.05)
+        self.server.stop()
+        self.assertRaises(self.t.ConnectionError, self.t.get,
+                          'http://127.0.0.1:1/')
+
+    def test_stream(self):
+        r = self.t.get(self.url + 'stream', stream=True)
+        body = b''.join(r.iter_content(4))
+        r.close()
+        self.assertEqual(json.loads(body.decode('utf-8'))['path'], '/stream')
+        # The connection is reused once the stream is consumed
+        self.t.get(self.url).json()
+        self.assertEqual(len(self.server.clients), 1)
+
+    def test_cube(self):
+        cube = Cube('127.0.0.1', collector_port=self.server.port,
+                    evaluator_port=self.server.port, transport=self.transport)
+        cube.put('test', {'a': 1})
+        self.assertEqual(cube.types()['path'], '/1.0/types')
+        events = list(cube.iter_events('test'))
+        self.assertTrue(events[0]['path'].startswith('/1.0/event?'))
+        event = json.loads(self.server.requests[0][3].decode('utf-8'))[0]
+        self.assertEqual(event['data'], {'a': 1})
+        cube.close()
+
+
+class TestRequestsTransport(TransportTests, unittest.TestCase):
+    transport = 'requests'
+
+
+class TestHTTPTransport(TransportTests, unittest.TestCase):
+    transport = 'http'
+
+    def test_stale_connection(self):
+        # A server closing idle keep-alive connections
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(5)
+        url = 'http://127.0.0.1:{0}/'.format(listener.getsockname()[1])
+        accepted = []
+
+        def serve():
+            for _ in range(2):
+                conn, _ = listener.accept()
+                accepted.append(conn)
+                conn.recv(65536)
+                conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n'
+                             b'\r\n{}')
+                conn.close()
+
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+        t = HTTPTransport()
+        self.assertEqual(t.get(url).json(), {})
+        time.sleep(0.05)
+        self.assertEqual(t.get(url).json(), {})
+        self.assertEqual(len(accepted), 2)
+        t.close()
+        listener.close()
+
+    def test_post_not_retried(self):
+        # The connection is lost after the POST was sent
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(5)
+        url = 'http://127.0.0.1:{0}/'.format(listener.getsockname()[1])
+        received = []
+
+        def recv_request(conn):
+            data = b''
+            while not data.endswith(b'\r\n\r\n[]'):
+                data += conn.recv(65536)
+            received.append(data)
+
+        def serve():
+            conn, _ = listener.accept()
+            recv_request(conn)
+            conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n'
+                         b'\r\n{}')
+            recv_request(conn)
+            conn.close()
+
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+        t = HTTPTransport()
+        self.assertEqual(t.post(url, b'[]', timeout=5).json(), {})
+        self.assertRaises(t.ConnectionError, t.post, url, b'[]', timeout=5)
+        thread.join()
+        self.assertEqual(len(received), 2)
+        listener.settimeout(0.1)
+        self.assertRaises(socket.timeout, listener.accept)
+        t.close()
+        listener.close()
+
+    def test_pool_block(self):
+        t = HTTPTransport(pool_size=1, pool_block=True)
+        r = t.get(self.url, stream=True)
+        done = []
+        thread = threading.Thread(target=lambda: done.append(
+            t.get(self.url).json()))
+        thread.start()
+        time.sleep(0.05)
+        self.assertEqual(done, [])
+        r.close()
+        thread.join()
+        self.assertEqual(len(done), 1)
+        t.close()
+
+
+class TestMakeTransport(unittest.TestCase):
+    def test_make_transport(self):
+        self.assertTrue(isinstance(make_transport('http'), HTTPTransport))
+        t = make_transport(pool_size=3)
+        self.assertTrue(isinstance(t, RequestsTransport))
+        self.assertEqual(t.pool_size, 3)
+        self.assertTrue(make_transport(lambda **kwargs: 1) == 1)
+        self.assertRaises(ValueError, make_transport, 'ftp')
+
+    def test_lazy_imports(self):
+        code = ('import sys, cube; '
+                'print(" ".join(m for m in ("requests", "numpy", "httplib", '
+                '"http.client", "multiprocessing.pool") if m in sys.modules))')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.strip(), b'')
@@ -0,0 +1,103 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import socket
+import unittest
+
+from cube import Cube
+from cube.udp import UDPSender
+
+
+class UDPTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(5)
+        self.port = self.sock.getsockname()[1]
+
+    def tearDown(self):
+        self.sock.close()
+
+    def recv(self):
+        return json.loads(self.sock.recv(65535).decode('utf-8'))
+
+
+class TestUDPSender(UDPTestCase):
+    def test_pack(self):
+        sender = UDPSender('127.0.0.1', self.port, mtu=200)
+        events = [{'type': 'test', 'data': {'i': i}} for i in range(20)]
+        self.assertEqual(sender.send(events), 20)
+        received = []
+        for i in range(sender.datagrams):
+            received.extend(self.recv())
+        self.assertEqual(received, events)
+        self.assertTrue(sender.datagrams > 1)
+        sender.close()
+
+    def test_too_large(self):
+        sender = UDPSender('127.0.0.1', self.port)
+        self.assertEqual(sender.send([{'type': 'test',
+                                       'data': 'x' * 70000}]), 0)
+        self.assertEqual(sender.dropped, 1)
+        sender.close()
+
+
+class TestCubeUDP(UDPTestCase):
+    def test_cube_udp(self):
+        cube = Cube('127.0.0.1', udp=True, udp_port=self.port,
+                    collector_port=1)
+        cube.put('test', {'i': 1})
+        self.assertEqual(self.recv()[0]['data'], {'i': 1})
+        self.assertEqual(cube.put_many([{'type': 'test'}] * 3), 3)
+        self.assertEqual(len(self.recv()), 3)
+        cube.close()
+
+    def test_event_udp(self):
+        cube = Cube('127.0.0.1', udp_port=self.port)
+        event = cube.get_event('timing', udp=True)
+        event.put({'ms': 10})
+        self.assertEqual(self.recv()[0]['type'], 'timing')
+        cube.close()
+
+
+class TestShardedUDP(unittest.TestCase):
+    def setUp(self):
+        # One socket per collector host, on the same UDP port
+        self.socks = {}
+        port = 0
+        for address in ('127.0.0.1', '127.0.0.2'):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((address, port))
+            sock.settimeout(0.2)
+            port = sock.getsockname()[1]
+            self.socks['{0}:1080'.format(address)] = sock
+        self.cube = Cube(collectors=sorted(self.socks), udp=True,
+                         udp_port=port)
+
+    def tearDown(self):
+        self.cube.close()
+        for sock in self.socks.values():
+            sock.close()
+
+    def received(self):
+        received = {}
+        for host, sock in self.socks.items():
+            try:
+                while True:
+                    for event in json.loads(sock.recv(65535).decode('utf-8')):
+                        received.setdefault(event['type'], set()).add(host)
+            except socket.timeout:
+                pass
+        return received
+
+    def test_sharded(self):
+        types = ['type{0}'.format(i) for i in range(20)]
+        for event_type in types[:10]:
+            self.cube.put(event_type)
+        self.assertEqual(self.cube.put_many([{'type': t}
+                                             for t in types[10:]] * 2), 20)
+        received = self.received()
+        self.assertEqual(sorted(received), sorted(types))
+        for event_type, hosts in received.items():
+            self.assertEqual(hosts, set([self.cube.ring.get(event_type)]))
+        self.assertEqual(len(set(self.cube.ring.get(t) for t in types)), 2)
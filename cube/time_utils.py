@@ -7,9 +7,16 @@ Originally from:
 https://github.com/sbuss/pypercube/blob/master/pypercube/time_utils.py
 """
 
+import calendar
 import re
 from datetime import datetime, timedelta
 
+try:
+    long
+except NameError:
+    # Python 3
+    long = int
+
 STEP_10_SEC = long(1e4)
 STEP_1_MIN = long(6e4)
 STEP_5_MIN = long(3e5)
@@ -23,6 +30,13 @@ STEP_CHOICES = ((STEP_10_SEC, "10 seconds"),
                 (STEP_1_DAY, "1 day"))
 
 
+EPOCH = datetime(1970, 1, 1)
+
+_ISO_RE = re.compile(r"^(\d{4})-(\d{1,2})-(\d{1,2})"
+                     r"(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6})\d*)?)?)?"
+                     r"(?:Z|[+-]00:?00)?$")
+
+
 def now():
     return datetime.utcnow()
 
@@ -71,6 +85,195 @@ def floor(start, resolution):
                                             choices=STEP_CHOICES))
 
 
+def step_to_ms(step):
+    """Convert a step, like '1e4' or STEP_10_SEC, to milliseconds.
+
+    >>> step_to_ms('36e5') == STEP_1_HOUR
+    True
+    """
+    return long(float(step))
+
+
+def to_epoch_ms(timestamp):
+    """Convert a naive UTC datetime to milliseconds since epoch.
+
+    >>> to_epoch_ms(datetime(2012, 10, 1, 13))
+    1349096400000
+    """
+    return (calendar.timegm(timestamp.utctimetuple()) * 1000 +
+            timestamp.microsecond // 1000)
+
+
+def from_epoch_ms(ms):
+    """Convert milliseconds since epoch to a naive UTC datetime.
+
+    >>> from_epoch_ms(1349096400000)
+    datetime.datetime(2012, 10, 1, 13, 0)
+    """
+    return EPOCH + timedelta(milliseconds=ms)
+
+
+def parse_iso(value):
+    """Parse an ISO 8601 UTC date or datetime, like the ones Cube returns.
+
+    >>> parse_iso('2012-10-01T13:00:00.000Z')
+    datetime.datetime(2012, 10, 1, 13, 0)
+    >>> parse_iso('2013-9-01')
+    datetime.datetime(2013, 9, 1, 0, 0)
+    """
+    match = _ISO_RE.match(value)
+    if match is None:
+        raise ValueError("{0} is not a valid ISO 8601 UTC datetime".format(
+            value))
+    year, month, day, hour, minute, second, fraction = match.groups()
+    return datetime(int(year), int(month), int(day), int(hour or 0),
+                    int(minute or 0), int(second or 0),
+                    int((fraction or '0').ljust(6, '0')))
+
+
+def format_iso(timestamp):
+    """Format a naive UTC datetime the way Cube does.
+
+    >>> format_iso(datetime(2012, 10, 1, 13, 0, 0, 453929))
+    '2012-10-01T13:00:00.453Z'
+    """
+    return "{0:04d}-{1:02d}-{2:02d}T{3:02d}:{4:02d}:{5:02d}.{6:03d}Z".format(
+        timestamp.year, timestamp.month, timestamp.day, timestamp.hour,
+        timestamp.minute, timestamp.second, timestamp.microsecond // 1000)
+
+
+def _days_from_civil(year, month, day):
+    """Days since 1970-01-01 of a proleptic Gregorian date.
+
+    >>> _days_from_civil(2012, 10, 1)
+    15614
+    """
+    year -= month <= 2
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+# Epoch ms of the dates already seen, results span few distinct days
+_day_ms_cache = {}
+
+
+def parse_time_ms(value):
+    """Parse a Cube timestamp, like 2012-10-01T13:00:00.000Z, to epoch ms.
+
+    Relies on the fixed-width layout Cube always returns, any other
+    ISO 8601 string goes through parse_iso.
+
+    >>> parse_time_ms('2012-10-01T13:00:00.000Z')
+    1349096400000
+    """
+    if len(value) != 24 or value[10] != 'T' or value[23] != 'Z':
+        return to_epoch_ms(parse_iso(value))
+    date = value[:10]
+    day_ms = _day_ms_cache.get(date)
+    if day_ms is None:
+        day_ms = _days_from_civil(int(value[:4]), int(value[5:7]),
+                                  int(value[8:10])) * 86400000
+        if len(_day_ms_cache) > 10000:
+            _day_ms_cache.clear()
+        _day_ms_cache[date] = day_ms
+    return (day_ms + int(value[11:13]) * 3600000 +
+            int(value[14:16]) * 60000 + int(value[17:19]) * 1000 +
+            int(value[20:23]))
+
+
+_DAY_MS = 86400000
+
+# 'THH:MM:SS.mmmZ' of the step-spaced times of a day, by (step, phase)
+_times_of_day_cache = {}
+
+
+def _times_of_day(step, phase):
+    key = (step, phase)
+    times = _times_of_day_cache.get(key)
+    if times is None:
+        times = [format_iso(from_epoch_ms(ms))[10:]
+                 for ms in range(phase, _DAY_MS, step)]
+        if len(_times_of_day_cache) > 100:
+            _times_of_day_cache.clear()
+        _times_of_day_cache[key] = times
+    return times
+
+
+def _format_date(day):
+    return format_iso(from_epoch_ms(day * _DAY_MS))[:10]
+
+
+def _regular(values, first, step):
+    """Check every value is the Cube timestamp of first + i * step,
+    comparing strings instead of parsing them.
+
+    >>> _regular(['2012-10-01T23:59:50.000Z', '2012-10-02T00:00:00.000Z'],
+    ...          1349135990000, 10000)
+    True
+    """
+    if step < 1000 or _DAY_MS % step:
+        return False
+    times = _times_of_day(step, first % step)
+    index = first % _DAY_MS // step
+    day = first // _DAY_MS
+    date = _format_date(day)
+    for value in values:
+        if value != date + times[index]:
+            return False
+        index += 1
+        if index == len(times):
+            index = 0
+            day += 1
+            date = _format_date(day)
+    return True
+
+
+def parse_times_ms(values, step=None):
+    """Parse a list of Cube timestamps to a list of epoch ms.
+
+    A step-spaced series (like the buckets of a metric) is synthesized
+    instead of parsed, once every item has been checked against the
+    timestamp it should hold. The step (in ms) is taken from the first
+    two items unless given.
+
+    >>> parse_times_ms(['2012-10-01T13:00:00.000Z',
+    ...                 '2012-10-01T13:00:10.000Z',
+    ...                 '2012-10-01T13:00:20.000Z'])
+    [1349096400000, 1349096410000, 1349096420000]
+    """
+    count = len(values)
+    if count > 2:
+        first = parse_time_ms(values[0])
+        if step is None:
+            step = parse_time_ms(values[1]) - first
+        if step > 0 and parse_time_ms(values[-1]) == \
+                first + (count - 1) * step and _regular(values, first, step):
+            return list(range(first, first + count * step, step))
+    return [parse_time_ms(value) for value in values]
+
+
+def to_datetime64(values, step=None):
+    """Parse a list of Cube timestamps to a numpy datetime64[ms] array,
+    requires numpy.
+    """
+    import numpy
+    return numpy.array(parse_times_ms(values, step), dtype='datetime64[ms]')
+
+
+def to_datetime(value):
+    """Return value as a datetime, parsing ISO 8601 strings.
+
+    >>> to_datetime('2012-10-01')
+    datetime.datetime(2012, 10, 1, 0, 0)
+    """
+    if isinstance(value, datetime):
+        return value
+    return parse_iso(value)
+
+
 def _timedelta_total_seconds(td):
     """Python 2.6 backward compatibility function for timedelta.total_seconds.
 
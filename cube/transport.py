@@ -0,0 +1,340 @@
+# -*- encoding: utf-8 -*-
+"""
+HTTP transports, each Cube endpoint (collector, evaluator) has its own.
+
+- RequestsTransport, on a requests Session (the default),
+- HTTPTransport, on the standard library httplib/http.client,
+  for when requests isn't installed or its import time matters.
+
+Both import their HTTP library on first use, and raise the exception
+types they expose (RequestException, ConnectionError, Timeout and
+HTTPError), responses have the status_code, text, json(), iter_content,
+raise_for_status and close of requests responses.
+"""
+import errno
+import json
+import select
+import socket
+import threading
+
+# Connection pool defaults, per endpoint
+POOL_SIZE = 10
+
+
+def _http_client():
+    try:
+        import httplib
+        return httplib
+    except ImportError:
+        import http.client
+        return http.client
+
+
+def _urlencode(params):
+    try:
+        from urllib import urlencode
+    except ImportError:
+        from urllib.parse import urlencode
+    return urlencode(params)
+
+
+def _urlsplit(url):
+    try:
+        from urlparse import urlsplit
+    except ImportError:
+        from urllib.parse import urlsplit
+    return urlsplit(url)
+
+
+class RequestsTransport(object):
+    """ requests Session, with a pool_size connection pool. """
+    def __init__(self, pool_size=POOL_SIZE, pool_block=False,
+                 keep_alive=True, **kwargs):
+        self.pool_size = pool_size
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def requests(self):
+        import requests
+        return requests
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._make_session()
+        return self._session
+
+    def _make_session(self):
+        from requests.adapters import HTTPAdapter
+        session = self.requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                              pool_block=self.pool_block)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    @property
+    def RequestException(self):
+        return self.requests.RequestException
+
+    @property
+    def ConnectionError(self):
+        return self.requests.ConnectionError
+
+    @property
+    def Timeout(self):
+        return self.requests.Timeout
+
+    @property
+    def HTTPError(self):
+        return self.requests.HTTPError
+
+    def get(self, url, params=None, timeout=None, stream=False):
+        return self.session.get(url, params=params, timeout=timeout,
+                                stream=stream)
+
+    def post(self, url, data, headers=None, timeout=None):
+        return self.session.post(url, data=data, headers=headers,
+                                 timeout=timeout)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+class RequestException(IOError):
+    """ An HTTPTransport request failed. """
+    def __init__(self, *args, **kwargs):
+        self.response = kwargs.pop('response', None)
+        super(RequestException, self).__init__(*args, **kwargs)
+
+
+class ConnectionError(RequestException):
+    """ Couldn't connect, or the connection was lost. """
+
+
+class Timeout(RequestException):
+    """ The server didn't answer in time. """
+
+
+class HTTPError(RequestException):
+    """ The server answered with an error status. """
+
+
+class Response(object):
+    """ An HTTPTransport response. """
+    def __init__(self, transport, key, conn, raw, url, stream):
+        self.status_code = raw.status
+        self.reason = raw.reason
+        self.headers = dict((k.lower(), v) for k, v in raw.getheaders())
+        self.url = url
+        self._transport = transport
+        self._key = key
+        self._conn = conn
+        self._raw = raw
+        self._content = None
+        if not stream:
+            self._content = self._read()
+
+    def _read(self, size=None):
+        try:
+            if size is None:
+                data = self._raw.read()
+            else:
+                data = self._raw.read(size)
+        except socket.timeout as e:
+            self._discard()
+            raise Timeout(e, response=self)
+        except (socket.error, _http_client().HTTPException) as e:
+            self._discard()
+            raise ConnectionError(e, response=self)
+        if size is None or not data:
+            self._release()
+        return data
+
+    def _release(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._transport._put_conn(self._key, conn,
+                                      reuse=not self._raw.will_close)
+
+    def _discard(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._transport._put_conn(self._key, conn, reuse=False)
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self._read()
+        return self._content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_content(self, chunk_size=1):
+        if self._content is not None:
+            for i in range(0, len(self._content), chunk_size):
+                yield self._content[i:i + chunk_size]
+            return
+        while True:
+            chunk = self._read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPError("{0} {1} for url: {2}".format(
+                self.status_code, self.reason, self.url), response=self)
+
+    def close(self):
+        # A partly read response leaves the connection unusable
+        self._discard()
+
+
+class HTTPTransport(object):
+    """ Standard library transport, keeping up to pool_size idle
+    connections per host; with pool_block, at most pool_size requests
+    are in flight at once. """
+    RequestException = RequestException
+    ConnectionError = ConnectionError
+    Timeout = Timeout
+    HTTPError = HTTPError
+
+    def __init__(self, pool_size=POOL_SIZE, pool_block=False,
+                 keep_alive=True, **kwargs):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size) \
+            if pool_block else None
+
+    def _get_conn(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                conn = idle.pop()
+                if not _is_dropped(conn):
+                    return conn, True
+                conn.close()
+        http_client = _http_client()
+        scheme, netloc = key
+        cls = http_client.HTTPSConnection if scheme == 'https' \
+            else http_client.HTTPConnection
+        return cls(netloc), False
+
+    def _put_conn(self, key, conn, reuse=True):
+        self._release_slot()
+        if reuse and self.keep_alive:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.pool_size:
+                    idle.append(conn)
+                    return
+        conn.close()
+
+    def _request(self, method, url, body=None, headers=None, timeout=None,
+                 stream=False):
+        parts = _urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(headers or {})
+        if not self.keep_alive:
+            headers['Connection'] = 'close'
+        connect_timeout = read_timeout = timeout
+        if isinstance(timeout, tuple):
+            connect_timeout, read_timeout = timeout
+
+        if self._slots is not None:
+            self._slots.acquire()
+        key = (parts.scheme, parts.netloc)
+        retry = True
+        while True:
+            conn, reused = self._get_conn(key)
+            try:
+                if conn.sock is None:
+                    conn.timeout = connect_timeout
+                    conn.connect()
+                conn.sock.settimeout(read_timeout)
+                conn.request(method, path, body, headers)
+                raw = conn.getresponse()
+            except socket.timeout as e:
+                conn.close()
+                self._release_slot()
+                raise Timeout(e)
+            except (socket.error, _http_client().HTTPException) as e:
+                conn.close()
+                if reused and retry and method == 'GET' and _is_stale(e):
+                    # The server closed the idle connection, retry once.
+                    # Not a POST, it may have reached the server already
+                    retry = False
+                    continue
+                self._release_slot()
+                raise ConnectionError(e)
+            return Response(self, key, conn, raw, url, stream)
+
+    def _release_slot(self):
+        if self._slots is not None:
+            self._slots.release()
+
+    def get(self, url, params=None, timeout=None, stream=False):
+        if params:
+            url += '?' + _urlencode(sorted(params.items()))
+        return self._request('GET', url, timeout=timeout, stream=stream)
+
+    def post(self, url, data, headers=None, timeout=None):
+        return self._request('POST', url, data, headers, timeout)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+def _is_dropped(conn):
+    """ An idle connection is readable once the server closed it. """
+    if conn.sock is None:
+        return False
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (ValueError, select.error):
+        return False
+
+
+def _is_stale(error):
+    http_client = _http_client()
+    if isinstance(error, http_client.BadStatusLine):
+        # Includes RemoteDisconnected on Python 3
+        return True
+    return getattr(error, 'errno', None) in (errno.ECONNRESET, errno.EPIPE,
+                                             errno.ECONNABORTED)
+
+
+TRANSPORTS = {'requests': RequestsTransport, 'http': HTTPTransport}
+
+
+def make_transport(transport='requests', **kwargs):
+    """ A transport from its name (requests or http), or a callable
+    building it from the pool kwargs. """
+    if callable(transport):
+        return transport(**kwargs)
+    try:
+        return TRANSPORTS[transport](**kwargs)
+    except KeyError:
+        raise ValueError("Unknown transport {0!r}".format(transport))
@@ -0,0 +1,61 @@
+# -*- encoding: utf-8 -*-
+import socket
+import threading
+
+from cube.batch import chunk_events
+
+# Default Cube collector UDP port
+UDP_PORT = 1180
+
+# Keep datagrams under a typical ethernet MTU to avoid fragmentation
+MAX_DATAGRAM = 1400
+
+# Max UDP payload over IPv4
+_MAX_UDP_PAYLOAD = 65507
+
+
+class UDPSender(object):
+    """ Fire-and-forget collector transport.
+
+    Events are packed as JSON arrays into datagrams of at most mtu bytes,
+    the socket is non-blocking: when the kernel buffer is full, or the
+    collector unreachable, events are dropped and counted, the caller
+    never waits.
+    """
+    def __init__(self, hostname, port=UDP_PORT, mtu=MAX_DATAGRAM):
+        # Resolve once, sendto would hit the resolver on every call
+        self.address = (socket.gethostbyname(hostname), port)
+        self.mtu = mtu
+        self.sent = 0
+        self.dropped = 0
+        self.datagrams = 0
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+
+    def send(self, events):
+        """ Send events, returns the number of events actually
+        handed to the kernel. """
+        sent = dropped = datagrams = 0
+        for chunk, data in chunk_events(events, max_events=_MAX_UDP_PAYLOAD,
+                                        max_bytes=self.mtu):
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8')
+            if len(data) > _MAX_UDP_PAYLOAD:
+                dropped += len(chunk)
+                continue
+            try:
+                self._sock.sendto(data, self.address)
+            except (socket.error, OSError):
+                dropped += len(chunk)
+            else:
+                sent += len(chunk)
+                datagrams += 1
+        with self._lock:
+            self.sent += sent
+            self.dropped += dropped
+            self.datagrams += datagrams
+        return sent
+
+    def close(self):
+        self._sock.close()
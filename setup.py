@@ -18,6 +18,7 @@ setup(
     test_suite="cube.tests",
     long_description=read('README.rst'),
     install_requires=['requests'],
+    extras_require={'async': ['aiohttp']},
     classifiers=[
         'Development Status :: 4 - Beta',
         'Intended Audience :: Developers',